@@ -1,5 +1,10 @@
+import codecs
 import os
+import hmac
+import time
+from datetime import datetime, timezone
 from functools import wraps
+import click
 from dotenv import load_dotenv
 from flask import (
     Flask,
@@ -10,13 +15,60 @@ from flask import (
     url_for,
     session,
     abort,
+    g,
+    jsonify,
+    make_response,
+    Response,
+    stream_with_context,
 )
-from sqlalchemy import desc
+from sqlalchemy import insert, text
 from sqlalchemy.exc import IntegrityError
-from werkzeug.security import generate_password_hash, check_password_hash
-from forms import RegisterForm, LoginForm, CancerDiagnosisForm
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from forms import RegisterForm, LoginForm, CancerDiagnosisForm, UploadForm
 from database import db, User, CancerDiagnosis
-from models.model import predict_cancerous
+from schema import FEATURES, FEATURE_NAMES, FeatureError, vectorizer
+from persistence import WriteBehindWriter
+from metrics import MetricsRegistry, stage_timer
+from profiling import RequestProfiler
+from engines import (
+    REPLICA_BIND,
+    engine_options,
+    pool_stats,
+    primary_reads,
+    read_engine,
+    use_replica,
+)
+from passwords import PasswordHasher, HasherBusy
+from history import (
+    FragmentCache,
+    history_etag,
+    history_page,
+    history_version,
+    template_fingerprint,
+)
+from identity import UserCache, load_user, invalidate_on_change
+from feature_storage import (
+    STORAGE_MODES,
+    feature_values,
+    migrate_feature_storage,
+    add_features_column,
+)
+from upload import UploadError, ingest_csv
+from stats import ALL_USERS, read_stats, rebuild_stats, record_diagnoses
+from export import (
+    EXPORT_FORMATS,
+    export_query,
+    export_stream,
+    parse_date,
+)
+from models.model import (
+    predict_cancerous,
+    predict_batch,
+    model_info,
+    registry,
+    drift_monitor,
+)
 
 
 # Load environment variables from .env file
@@ -28,27 +80,173 @@ POSTGRES_USER = os.getenv('POSTGRES_USER')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST')
 POSTGRES_DB = os.getenv('POSTGRES_DB')
+# Full database URL overriding the settings above (benchmarks, local runs)
+DATABASE_URL = os.getenv('DATABASE_URL')
+# Host of a streaming replica serving the read-only routes, unset for none
+POSTGRES_REPLICA_HOST = os.getenv('POSTGRES_REPLICA_HOST')
+# Connection pool of each worker process, per database
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Seconds after which a connection is replaced, -1 to keep connections
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+# Test connections before use, so restarts of the server are survived
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+# Server-side limit on the duration of each statement, 0 for none
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+# Upper bound on the number of rows scored by one API request
+API_MAX_BATCH_ROWS = int(os.getenv('API_MAX_BATCH_ROWS', 10000))
+# Rows of an uploaded CSV parsed, scored and inserted at a time
+UPLOAD_CHUNK_ROWS = int(os.getenv('UPLOAD_CHUNK_ROWS', 5000))
+# Store the 30 features of new diagnoses as one packed array
+PACKED_FEATURES = os.getenv('DIAGNOSIS_FEATURE_STORAGE', 'columns') == 'packed'
+# werkzeug password hashing method and cost, e.g. scrypt:32768:8:1 or
+# pbkdf2:sha256:600000; older hashes are upgraded on login
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+# Processes hashing passwords per worker, 0 to hash in the request thread
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 0))
+# Requests per worker that may hash at once (keep below GUNICORN_THREADS so
+# the other threads stay free for predictions), and how long others wait
+PASSWORD_HASH_MAX_CONCURRENT = int(os.getenv('PASSWORD_HASH_MAX_CONCURRENT',
+                                             2))
+PASSWORD_HASH_ADMISSION_MS = float(os.getenv('PASSWORD_HASH_ADMISSION_MS',
+                                             1000))
+# Seconds a loaded user is reused across requests, 0 to disable
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 0))
+# Diagnoses per history page, and the most a client may ask for
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', 500))
+# Memory for rendered history tables per worker, 0 to render every view
+HISTORY_CACHE_BYTES = int(os.getenv('HISTORY_CACHE_BYTES', 16 * 1024 * 1024))
+# Insert diagnosis rows in the background instead of before responding
+WRITE_BEHIND = os.getenv('DIAGNOSIS_WRITE_BEHIND', '0') == '1'
+WRITE_BEHIND_BATCH = int(os.getenv('DIAGNOSIS_WRITE_BEHIND_BATCH', 200))
+WRITE_BEHIND_DELAY_MS = float(os.getenv('DIAGNOSIS_WRITE_BEHIND_DELAY_MS',
+                                        200))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('DIAGNOSIS_WRITE_BEHIND_MAX_PENDING',
+                                         10000))
+# Local journal of buffered rows, replayed after a crash
+SPILL_DIR = os.getenv('DIAGNOSIS_SPILL_DIR')
+# Record request and per-stage latency metrics, served at /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+# Directory shared by the workers to aggregate their metrics; unset to
+# report the answering process only
+METRICS_DIR = os.getenv('METRICS_DIR')
+# Directory for request profiles; profiling is off when it is not set
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+# cprofile (pstats files) or sampler (collapsed stacks for flamegraphs)
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'cprofile')
+# Also profile every Nth request of each worker, 0 for flagged ones only
+PROFILE_SAMPLE_RATE = int(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# Token for the admin endpoints, which are disabled when it is not set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+
+def database_options(url):
+    """
+    Engine options for ``url`` from the DB_* settings
+    """
+    return engine_options(url, pool_size=DB_POOL_SIZE,
+                          max_overflow=DB_MAX_OVERFLOW,
+                          pool_timeout=DB_POOL_TIMEOUT,
+                          pool_recycle=DB_POOL_RECYCLE,
+                          pre_ping=DB_POOL_PRE_PING,
+                          statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS)
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
+if DATABASE_URL:
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 # Check if we are in testing mode
-if os.getenv('FLASK_ENV') == 'testing':
+elif os.getenv('FLASK_ENV') == 'testing':
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'  # In-memory SQLite for testing
 else:
     # PostgreSQL database
     app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:5432/{POSTGRES_DB}'
+    if POSTGRES_REPLICA_HOST:
+        replica_uri = f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_REPLICA_HOST}:5432/{POSTGRES_DB}'
+        app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA_BIND: {'url': replica_uri,
+                           **database_options(replica_uri)}}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_options(
+    app.config['SQLALCHEMY_DATABASE_URI'])
 db.init_app(app)
 
+password_hasher = PasswordHasher(
+    PASSWORD_HASH_METHOD,
+    workers=PASSWORD_HASH_WORKERS,
+    max_concurrent=PASSWORD_HASH_MAX_CONCURRENT,
+    admission_timeout=PASSWORD_HASH_ADMISSION_MS / 1e3)
+
+metrics = MetricsRegistry(METRICS_DIR)
+REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'Time spent handling requests.',
+    ('endpoint', 'method'))
+REQUESTS = metrics.counter(
+    'http_requests_total', 'Requests handled, by response status.',
+    ('endpoint', 'method', 'status'))
+STAGE_SECONDS = metrics.histogram(
+    'request_stage_duration_seconds',
+    'Time spent in each stage of a request.', ('endpoint', 'stage'))
+stage = stage_timer(STAGE_SECONDS, METRICS_ENABLED)
+
+user_cache = None
+if USER_CACHE_TTL > 0:
+    user_cache = UserCache(USER_CACHE_TTL)
+    invalidate_on_change(user_cache)
+
+write_behind = None
+if WRITE_BEHIND:
+    write_behind = WriteBehindWriter(
+        app,
+        spill_dir=SPILL_DIR or os.path.join(app.instance_path, 'spill'),
+        max_batch_size=WRITE_BEHIND_BATCH,
+        max_delay=WRITE_BEHIND_DELAY_MS / 1e3,
+        max_pending=WRITE_BEHIND_MAX_PENDING)
+
 
 def get_current_user():
     """
-    Get User information
+    Get User information, loaded at most once per request
     """
-    if 'username' in session:
-        user = User.query.filter_by(username=session['username']).first()
-        return user
-    return None
+    if 'current_user' not in g:
+        if 'username' in session:
+            # A replica may not have the rows of a user who just registered
+            with primary_reads():
+                g.current_user = load_user(session.get('user_id'),
+                                           session['username'], user_cache)
+            if (g.current_user is not None
+                    and session.get('user_id') != g.current_user.id):
+                session['user_id'] = g.current_user.id
+        else:
+            g.current_user = None
+    return g.current_user
+
+
+@app.before_request
+def forget_current_user():
+    # An application context can outlive one request (as in the tests), so
+    # never carry the memoized user over from a previous request
+    g.pop('current_user', None)
+
+
+@app.before_request
+def start_request_timer():
+    if METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if METRICS_ENABLED and 'request_started' in g:
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started,
+                                endpoint, request.method)
+        REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        metrics.ensure_started()
+    return response
 
 
 @app.context_processor
@@ -60,6 +258,26 @@ def inject_user_data():
     return dict(user=user)
 
 
+# The feature schema drives the columns of the history table
+app.jinja_env.globals['FEATURES'] = FEATURES
+
+# Rendered history tables, served again until the user's history changes
+history_cache = None
+if HISTORY_CACHE_BYTES > 0:
+    history_cache = FragmentCache(HISTORY_CACHE_BYTES)
+# Part of every history ETag, so changed templates are sent again
+HISTORY_ETAG_SALT = template_fingerprint(app, 'base.html', 'history.html',
+                                         'history_table.html')
+
+
+def forget_history(user_id):
+    """
+    Free the cached history tables of a user who just got new diagnoses
+    """
+    if history_cache is not None:
+        history_cache.discard(user_id)
+
+
 def login_required(f):
     """
     Restrict access to logged-in users only
@@ -74,28 +292,100 @@ def login_required(f):
     return decorated_function
 
 
+def is_admin_request():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def admin_required(f):
+    """
+    Restrict access to requests carrying the admin token
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_admin_request():
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# Hooks are only installed when profiling is configured, so it costs
+# nothing otherwise; flagged requests need the admin token
+profiler = None
+if PROFILE_DIR:
+    profiler = RequestProfiler(PROFILE_DIR, PROFILE_MODE, PROFILE_SAMPLE_RATE)
+    profiler.init_app(app, authorized=is_admin_request)
+
+
+@app.route('/healthz')
+def healthz():
+    """
+    Liveness probe: the worker is up and serving requests
+    """
+    return jsonify(status='ok')
+
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness probe: the model is loaded and the database answers
+    """
+    try:
+        db.session.execute(text('SELECT 1'))
+    except Exception:
+        db.session.rollback()
+        return jsonify(status='unavailable', database=False), 503
+    finally:
+        db.session.remove()
+    return jsonify(status='ok', database=True,
+                   model=registry.current.name)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Request metrics of all workers in the Prometheus text format
+    """
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def home():
     return render_template('index.html')
 
 
+def busy_response(template, form):
+    """
+    Ask the client to retry when password hashing is at capacity
+    """
+    flash('We are handling many sign-ins right now. Please try again in a '
+          'moment.', 'warning')
+    return render_template(template, form=form), 503, {'Retry-After': '1'}
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
     if request.method == "POST":
-        if form.validate_on_submit():
+        with stage('validate'):
+            valid = form.validate_on_submit()
+        if valid:
             try:
                 # Hash the password
-                hashed_password = generate_password_hash(form.password.data)
+                with stage('hash'):
+                    hashed_password = password_hasher.hash(form.password.data)
                 # Create instance of user
                 new_user = User(fullname=form.fullname.data,
                                 username=form.username.data,
                                 email=form.email.data,
                                 password=hashed_password)
-                db.session.add(new_user)
-                db.session.commit()
+                with stage('persist'):
+                    db.session.add(new_user)
+                    db.session.commit()
                 # Save user credentials and the logged-in user to their account
                 session['username'] = new_user.username
+                session['user_id'] = new_user.id
                 flash('Signup successful!', 'success')
                 return redirect(url_for('home'))
             except IntegrityError:
@@ -103,6 +393,8 @@ def register():
                 flash('Username or email already exists. Please choose a '
                       'different one.', 'danger')
                 return render_template('register.html', form=form)
+            except HasherBusy:
+                return busy_response('register.html', form)
         else:
             # Form is invalid, flash errors and
             # redirect back to the register page
@@ -116,18 +408,34 @@ def register():
 def login():
     form = LoginForm()
     if request.method == "POST":
-        if form.validate_on_submit():
+        with stage('validate'):
+            valid = form.validate_on_submit()
+        if valid:
             # Check identifier and password for authentication
             identifier = form.identifier.data
             password = form.password.data
             # Query the User model for the provided username or email
-            user = User.query.filter((User.username == identifier) |
-                                     (User.email == identifier)).first()
+            with stage('lookup'):
+                user = User.query.filter((User.username == identifier) |
+                                         (User.email == identifier)).first()
 
-            if user and check_password_hash(user.password, password):
+            try:
+                with stage('verify'):
+                    authenticated = user is not None and \
+                        password_hasher.verify(user.password, password)
+                    if authenticated and \
+                            password_hasher.needs_rehash(user.password):
+                        # Upgrade hashes made with an outdated method or cost
+                        user.password = password_hasher.hash(password)
+                        db.session.commit()
+            except HasherBusy:
+                return busy_response('login.html', form)
+
+            if authenticated:
                 # Password matches, user authenticated
                 # Save user credentials
                 session['username'] = user.username
+                session['user_id'] = user.id
 
                 flash('Login successful!', 'success')
                 return redirect(url_for('home'))
@@ -148,6 +456,8 @@ def login():
 def logout():
     # Remove user credentials
     session.pop('username')
+    session.pop('user_id', None)
+    g.pop('current_user', None)
     flash('You have been logged out', 'info')
     return redirect(url_for('home'))
 
@@ -155,43 +465,15 @@ def logout():
 @app.route('/input', methods=['GET', 'POST'])
 @login_required
 def diagnosis():
-    form = CancerDiagnosisForm()
-    if form.validate_on_submit():
-        input_data = [
-            form.mean_radius.data,
-            form.mean_texture.data,
-            form.mean_perimeter.data,
-            form.mean_area.data,
-            form.mean_smoothness.data,
-            form.mean_compactness.data,
-            form.mean_concavity.data,
-            form.mean_concave_points.data,
-            form.mean_symmetry.data,
-            form.mean_fractal_dimension.data,
-            form.radius_error.data,
-            form.texture_error.data,
-            form.perimeter_error.data,
-            form.area_error.data,
-            form.smoothness_error.data,
-            form.compactness_error.data,
-            form.concavity_error.data,
-            form.concave_points_error.data,
-            form.symmetry_error.data,
-            form.fractal_dimension_error.data,
-            form.worst_radius.data,
-            form.worst_texture.data,
-            form.worst_perimeter.data,
-            form.worst_area.data,
-            form.worst_smoothness.data,
-            form.worst_compactness.data,
-            form.worst_concavity.data,
-            form.worst_concave_points.data,
-            form.worst_symmetry.data,
-            form.worst_fractal_dimension.data
-        ]
+    with stage('validate'):
+        form = CancerDiagnosisForm()
+        valid = form.validate_on_submit()
+    if valid:
+        input_data = [form[name].data for name in FEATURE_NAMES]
 
         # make the prediction
-        prediction = predict_cancerous(input_data)
+        with stage('predict'):
+            prediction = predict_cancerous(input_data)
 
         # Based on the prediction, determine the result
         if prediction[0] == 1:
@@ -203,60 +485,360 @@ def diagnosis():
 
         current_user = get_current_user()
 
+        if write_behind is not None:
+            # Respond now, the row is inserted in bulk in the background
+            now = datetime.now(timezone.utc)
+            with stage('persist'):
+                write_behind.submit(dict(feature_values(input_data,
+                                                        PACKED_FEATURES),
+                                         user_id=current_user.id,
+                                         diagnosis_result=diagnosis_result,
+                                         created_at=now, updated_at=now))
+            forget_history(current_user.id)
+            with stage('render'):
+                return render_template('result.html',
+                                       result=diagnosis_result,
+                                       bg_color=bg_color)
+
         new_diagnosis = CancerDiagnosis(
             user_id=current_user.id,
-            mean_radius=form.mean_radius.data,
-            mean_texture=form.mean_texture.data,
-            mean_perimeter=form.mean_perimeter.data,
-            mean_area=form.mean_area.data,
-            mean_smoothness=form.mean_smoothness.data,
-            mean_compactness=form.mean_compactness.data,
-            mean_concavity=form.mean_concavity.data,
-            mean_concave_points=form.mean_concave_points.data,
-            mean_symmetry=form.mean_symmetry.data,
-            mean_fractal_dimension=form.mean_fractal_dimension.data,
-            radius_error=form.radius_error.data,
-            texture_error=form.texture_error.data,
-            perimeter_error=form.perimeter_error.data,
-            area_error=form.area_error.data,
-            smoothness_error=form.smoothness_error.data,
-            compactness_error=form.compactness_error.data,
-            concavity_error=form.concavity_error.data,
-            concave_points_error=form.concave_points_error.data,
-            symmetry_error=form.symmetry_error.data,
-            fractal_dimension_error=form.fractal_dimension_error.data,
-            worst_radius=form.worst_radius.data,
-            worst_texture=form.worst_texture.data,
-            worst_perimeter=form.worst_perimeter.data,
-            worst_area=form.worst_area.data,
-            worst_smoothness=form.worst_smoothness.data,
-            worst_compactness=form.worst_compactness.data,
-            worst_concavity=form.worst_concavity.data,
-            worst_concave_points=form.worst_concave_points.data,
-            worst_symmetry=form.worst_symmetry.data,
-            worst_fractal_dimension=form.worst_fractal_dimension.data,
-            diagnosis_result=diagnosis_result  # Cancerous or Non-Cancerous
+            diagnosis_result=diagnosis_result,  # Cancerous or Non-Cancerous
+            **feature_values(input_data, PACKED_FEATURES)
         )
 
-        # Save to database
-        db.session.add(new_diagnosis)
-        db.session.commit()
+        # Save to database, with the stats in the same transaction
+        with stage('persist'):
+            db.session.add(new_diagnosis)
+            record_diagnoses([current_user.id], [diagnosis_result],
+                             [input_data])
+            db.session.commit()
+        forget_history(current_user.id)
 
         # Render a template to show the result
-        return render_template('result.html', result=diagnosis_result,
-                               bg_color=bg_color)
+        with stage('render'):
+            return render_template('result.html', result=diagnosis_result,
+                                   bg_color=bg_color)
 
     # Render the form template
-    return render_template('diagnosis.html', form=form)
+    with stage('render'):
+        return render_template('diagnosis.html', form=form)
+
+
+@app.route('/upload', methods=['GET', 'POST'])
+@login_required
+def upload():
+    """
+    Score and save a CSV file of diagnoses in chunks
+    """
+    form = UploadForm()
+    if form.validate_on_submit():
+        # Uploads are spooled to disk, so only one chunk is held in memory.
+        # Decoded line by line: TextIOWrapper needs readable(), which the
+        # SpooledTemporaryFile of Python 3.10 lacks
+        stream = codecs.iterdecode(form.file.data.stream, 'utf-8-sig')
+        user_id = get_current_user().id
+        try:
+            report = ingest_csv(stream, user_id, UPLOAD_CHUNK_ROWS,
+                                PACKED_FEATURES)
+        except (UploadError, UnicodeDecodeError) as error:
+            flash(f"The file could not be read: {error}", 'danger')
+            return render_template('upload.html', form=form), 400
+        finally:
+            # Chunks before a failure are already committed
+            forget_history(user_id)
+        flash(f"{report['inserted']} diagnoses saved.", 'success')
+        return render_template('upload.html', form=form, report=report)
+    return render_template('upload.html', form=form)
+
+
+def history_limit(limit=None):
+    if limit is None:
+        limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    return max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+
+def history_json(user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of a user's diagnoses as JSON-ready values, for the JSON APIs
+    """
+    rows, next_cursor = history_page(user_id, cursor, limit)
+    for row in rows:
+        row['created_at'] = row['created_at'].isoformat()
+    return {'diagnoses': rows, 'next_cursor': next_cursor}
+
+
+def describe_predictions(labels, probabilities):
+    """
+    Result names of the labels, and the JSON APIs' prediction objects
+    """
+    results = ["Cancerous" if label == 1 else "Non-Cancerous"
+               for label in labels]
+    predictions = [{'label': int(label), 'result': result,
+                    'probability': float(probability)}
+                   for label, result, probability
+                   in zip(labels, results, probabilities)]
+    return results, predictions
+
+
+def persist_predictions(user_id, features, results):
+    """
+    Save the rows scored by a JSON API request with one bulk insert
+    """
+    rows = [dict(feature_values(row, PACKED_FEATURES),
+                 user_id=user_id, diagnosis_result=result)
+            for row, result in zip(features.tolist(), results)]
+    db.session.execute(insert(CancerDiagnosis), rows)
+    record_diagnoses([user_id] * len(rows), results, features)
+    db.session.commit()
+    forget_history(user_id)
 
 
 @app.route('/history')
 @login_required
+@use_replica
 def history():
+    """
+    One page of the user's diagnoses, answering repeat views with a 304 or
+    a cached table while the user has no new diagnosis
+    """
     user = get_current_user()
-    user_diagnoses = CancerDiagnosis.query.filter_by(user_id=user.id)\
-        .order_by(desc(CancerDiagnosis.created_at)).all()
-    return render_template('history.html', user_diagnoses=user_diagnoses)
+    cursor = request.args.get('cursor')
+    limit = history_limit()
+    # Position of the first row, only used to number the rows
+    start = max(request.args.get('start', 0, type=int), 0)
+    page = (cursor, limit, start)
+    with stage('version'):
+        version = history_version(user.id)
+    etag = history_etag(user.id, version, page, HISTORY_ETAG_SALT)
+    last_modified = None
+    if version is not None:
+        last_modified = version[1].replace(tzinfo=timezone.utc)
+    # Pending flash messages are shown by the page, so it must be rendered
+    if '_flashes' not in session and not is_resource_modified(
+            request.environ, etag=etag, last_modified=last_modified):
+        return conditional_headers(Response(status=304), etag,
+                                   last_modified)
+
+    table = None
+    if history_cache is not None:
+        table = history_cache.get(user.id, page, version)
+    if table is None:
+        try:
+            with stage('query'):
+                user_diagnoses, next_cursor = history_page(user.id, cursor,
+                                                           limit)
+        except ValueError:
+            # Stale or mangled cursor, start again from the newest diagnosis
+            return redirect(url_for('history'))
+        with stage('render'):
+            table = Markup(render_template('history_table.html',
+                                           user_diagnoses=user_diagnoses,
+                                           next_cursor=next_cursor,
+                                           start=start, limit=limit))
+        if history_cache is not None:
+            history_cache.set(user.id, page, version, table)
+    with stage('render'):
+        response = make_response(render_template('history.html',
+                                                 table=table))
+    return conditional_headers(response, etag, last_modified)
+
+
+def conditional_headers(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Browsers may keep the page but must ask whether it is still current
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/api/v1/history')
+@login_required
+@use_replica
+def api_history():
+    """
+    One page of the user's diagnoses as JSON, newest first
+    """
+    try:
+        page = history_json(get_current_user().id,
+                            request.args.get('cursor'), history_limit())
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    return jsonify(page)
+
+
+@app.route('/api/v1/predict', methods=['POST'])
+@login_required
+def api_predict():
+    """
+    Score a batch of feature vectors with a single model call
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = {}
+    instances = payload.get('instances')
+    if not isinstance(instances, list) or not instances:
+        return jsonify(error="'instances' must be a non-empty list of "
+                       "feature vectors."), 400
+    if len(instances) > API_MAX_BATCH_ROWS:
+        return jsonify(error=f"At most {API_MAX_BATCH_ROWS} instances are "
+                       "allowed per request."), 413
+
+    # Rows are lists in model order or objects keyed by feature name
+    try:
+        features = vectorizer.batch(instances)
+    except FeatureError as error:
+        return jsonify(error=f"Every instance must hold "
+                       f"{len(FEATURE_NAMES)} finite numbers.",
+                       fields=error.errors), 400
+
+    # make the predictions for all rows at once
+    results, predictions = describe_predictions(*predict_batch(features))
+
+    if payload.get('persist'):
+        persist_predictions(get_current_user().id, features, results)
+
+    return jsonify(predictions=predictions)
+
+
+@app.route('/api/v1/model')
+@login_required
+def api_model():
+    """
+    Serving model version with cache and batching statistics
+    """
+    return jsonify(model_info())
+
+
+@app.route('/api/v1/stats')
+@login_required
+@use_replica
+def api_stats():
+    """
+    Counts and feature means and variances of the user's diagnoses
+    """
+    return jsonify(read_stats(get_current_user().id))
+
+
+@app.route('/admin/stats')
+@admin_required
+@use_replica
+def admin_stats():
+    """
+    Counts and feature means and variances of all diagnoses
+    """
+    return jsonify(read_stats(ALL_USERS))
+
+
+def export_response(user_id):
+    """
+    Stream diagnoses as CSV or NDJSON, optionally gzipped on the fly
+    """
+    fmt = request.args.get('format', 'csv')
+    gzip = request.args.get('gzip') == '1'
+    if fmt not in EXPORT_FORMATS:
+        return jsonify(error=f"'format' must be one of "
+                       f"{', '.join(EXPORT_FORMATS)}."), 400
+    try:
+        query = export_query(user_id,
+                             start=parse_date(request.args.get('from')),
+                             end=parse_date(request.args.get('to')))
+    except ValueError:
+        return jsonify(error="'from' and 'to' must be ISO dates."), 400
+
+    if gzip:
+        mimetype = 'application/gzip'
+    elif fmt == 'csv':
+        mimetype = 'text/csv'
+    else:
+        mimetype = 'application/x-ndjson'
+    filename = f"diagnoses.{fmt}{'.gz' if gzip else ''}"
+    # The engine is picked now: the body is streamed after the view returns
+    stream = export_stream(query, fmt, gzip, engine=read_engine(db))
+    return Response(stream_with_context(stream),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition':
+                             f'attachment; filename={filename}'})
+
+
+@app.route('/export/diagnoses')
+@login_required
+@use_replica
+def export_diagnoses():
+    """
+    Export the logged-in user's diagnoses
+    """
+    return export_response(get_current_user().id)
+
+
+@app.route('/admin/export/diagnoses')
+@admin_required
+@use_replica
+def admin_export_diagnoses():
+    """
+    Export the diagnoses of every user, or of ``user_id``
+    """
+    return export_response(request.args.get('user_id', type=int))
+
+
+@app.route('/admin/db/pool')
+@admin_required
+def admin_db_pool():
+    """
+    Pool usage of this worker's database engines
+    """
+    return jsonify({key or 'primary': pool_stats(engine)
+                    for key, engine in db.engines.items()})
+
+
+@app.route('/admin/model/reload', methods=['POST'])
+@admin_required
+def admin_model_reload():
+    """
+    Load a model version in the background and swap it in when warm
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = {}
+    name = payload.get('version', 'default')
+    # Recorded before the swap, which replaces registry.current
+    outgoing = registry.current.name
+    try:
+        registry.reload(name).result()
+        # Other workers pick the published version up on their next poll
+        registry.publish(name, previous=outgoing)
+    except (LookupError, ValueError) as error:
+        return jsonify(error=str(error)), 404
+    return jsonify(model_info())
+
+
+@app.route('/admin/model/drift')
+@admin_required
+def admin_model_drift():
+    """
+    Input drift of every worker's scored rows against the training data
+    """
+    if drift_monitor is None:
+        return jsonify(error="The drift monitor is disabled."), 404
+    if request.args.get('check') == '1':
+        drift_monitor.check(force=True)
+    return jsonify(drift_monitor.report())
+
+
+@app.route('/admin/model/rollback', methods=['POST'])
+@admin_required
+def admin_model_rollback():
+    """
+    Swap back to the previously served model version
+    """
+    outgoing = registry.current.name
+    try:
+        registry.rollback()
+    except LookupError as error:
+        return jsonify(error=str(error)), 409
+    registry.publish(registry.current.name, previous=outgoing)
+    return jsonify(model_info())
 
 
 @app.errorhandler(404)
@@ -289,8 +871,145 @@ def internal_server_error(error):
     return render_template('errors.html', **context), 500
 
 
-if __name__ == '__main__':
-    # Create tables if it does not exist
+def init_db():
+    """
+    Create the tables that do not exist yet
+    """
     with app.app_context():
         db.create_all()
+        # create_all() skips indexes and columns added to tables that
+        # already exist
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        add_features_column()
+        db.session.commit()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """
+    Create the database tables, once, before starting the workers
+    """
+    init_db()
+    click.echo('Initialized the database')
+
+
+@app.cli.command('export-diagnoses')
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS),
+              default='csv', show_default=True)
+@click.option('--user-id', type=int, help='Only export this user.')
+@click.option('--from', 'start', help='Earliest created_at (ISO date).')
+@click.option('--to', 'end', help='Exclusive latest created_at (ISO date).')
+@click.option('--gzip', is_flag=True, help='Gzip the output.')
+@click.option('--output', type=click.File('wb'), default='-',
+              help='Output file, standard output by default.')
+def export_diagnoses_command(fmt, user_id, start, end, gzip, output):
+    """
+    Stream diagnoses to a file in fixed-size chunks
+    """
+    try:
+        query = export_query(user_id, start=parse_date(start),
+                             end=parse_date(end))
+    except ValueError:
+        raise click.BadParameter("--from and --to must be ISO dates.")
+    for piece in export_stream(query, fmt, gzip):
+        output.write(piece)
+
+
+@app.cli.command('import-diagnoses')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user-id', type=int, required=True,
+              help='User the diagnoses are saved for.')
+@click.option('--chunk-size', type=int, default=UPLOAD_CHUNK_ROWS,
+              show_default=True)
+def import_diagnoses_command(path, user_id, chunk_size):
+    """
+    Score and save a CSV file of diagnoses
+    """
+    if db.session.get(User, user_id) is None:
+        raise click.BadParameter(f"No user with id {user_id}.",
+                                 param_hint='--user-id')
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        try:
+            report = ingest_csv(f, user_id, chunk_size, PACKED_FEATURES)
+        except UploadError as error:
+            raise click.ClickException(str(error))
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Saved {report['inserted']} diagnoses "
+               f"({report['cancerous']} cancerous), "
+               f"rejected {report['rejected']} rows")
+
+
+@app.cli.command('migrate-features')
+@click.option('--to', 'mode', type=click.Choice(STORAGE_MODES),
+              default='packed', show_default=True)
+@click.option('--chunk-size', type=int, default=1000, show_default=True)
+def migrate_features_command(mode, chunk_size):
+    """
+    Convert stored diagnoses between column and packed feature storage
+    """
+    try:
+        converted = migrate_feature_storage(mode, chunk_size)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Converted {converted} diagnoses to {mode} storage")
+
+
+@app.cli.command('rebuild-stats')
+@click.option('--chunk-size', type=int, default=5000, show_default=True)
+def rebuild_stats_command(chunk_size):
+    """
+    Recompute the diagnosis stats from the diagnoses table
+    """
+    counted = rebuild_stats(chunk_size)
+    click.echo(f"Rebuilt the stats from {counted} diagnoses")
+
+
+@app.cli.group('model')
+def model_cli():
+    """
+    Manage the served model version
+    """
+
+
+@model_cli.command('list')
+def model_list():
+    """
+    List the available model versions
+    """
+    published = registry.read_pointer().get('version', 'default')
+    for name in registry.versions():
+        click.echo(f"{'*' if name == published else ' '} {name}")
+
+
+@model_cli.command('activate')
+@click.argument('version')
+def model_activate(version):
+    """
+    Publish VERSION to every worker watching the registry
+    """
+    try:
+        registry.publish(version)
+    except (LookupError, ValueError) as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Published model version {version}")
+
+
+@model_cli.command('rollback')
+def model_rollback():
+    """
+    Publish the previously published version again
+    """
+    try:
+        version = registry.publish_rollback()
+    except LookupError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Rolled back to model version {version}")
+
+
+if __name__ == '__main__':
+    # Development server only; production runs gunicorn with wsgi.py
+    init_db()
     app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,328 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+from flask import g
+from itsdangerous import BadSignature
+from app import (
+    app,
+    API_MAX_BATCH_ROWS,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    describe_predictions,
+    HISTORY_PAGE_SIZE,
+    history_json,
+    history_limit,
+    persist_predictions,
+    user_cache,
+)
+from identity import load_user
+from models.model import predict_batch
+from schema import FEATURE_NAMES, FeatureError, vectorizer
+
+
+# Asynchronous twin of /api/v1/predict and /api/v1/history, as an ASGI app
+# sharing the Flask app's configuration, sessions, database and model:
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker \
+#       asgi:application
+# Each process serves many open connections from one event loop; model
+# calls and database work run on two bounded thread pools, so slow commits
+# never hold back inference and neither blocks the loop.
+
+# Threads per process scoring rows (the forest releases the GIL)
+INFERENCE_WORKERS = int(os.getenv('ASYNC_INFERENCE_WORKERS')
+                        or os.cpu_count() or 1)
+# Threads per process talking to the database; more than the connection
+# pool holds would only wait for a connection
+DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS')
+                 or DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# Milliseconds a request may take before it is cancelled with a 504
+REQUEST_TIMEOUT_MS = float(os.getenv('ASYNC_REQUEST_TIMEOUT_MS', 10000))
+# Requests per process in flight at once, later ones get a 503
+MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 1024))
+# Largest accepted request body
+MAX_BODY_BYTES = int(os.getenv('ASYNC_MAX_BODY_BYTES', 64 * 1024 * 1024))
+
+
+class HTTPError(Exception):
+    def __init__(self, status, payload):
+        super().__init__(status)
+        self.status = status
+        self.payload = payload
+
+
+class Executors:
+    """
+    The inference and database thread pools of the current process
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+        self.inference = self.database = None
+
+    def ensure_started(self):
+        # Threads do not survive fork(), so every worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.inference = ThreadPoolExecutor(
+                INFERENCE_WORKERS, thread_name_prefix='async-inference')
+            self.database = ThreadPoolExecutor(
+                DB_WORKERS, thread_name_prefix='async-db')
+            self._pid = os.getpid()
+
+    def shutdown(self):
+        if self._pid == os.getpid():
+            # Queued work is dropped, running calls finish on their own
+            self.inference.shutdown(wait=False, cancel_futures=True)
+            self.database.shutdown(wait=False, cancel_futures=True)
+            self._pid = None
+
+
+executors = Executors()
+
+
+async def run_inference(function, *args):
+    """
+    Run a model call on the inference pool; cancelling the awaiting task
+    drops it if it has not started yet
+    """
+    executors.ensure_started()
+    return await asyncio.get_running_loop().run_in_executor(
+        executors.inference, function, *args)
+
+
+def _in_app_context(function, args, replica):
+    # Every call gets its own context, so its own scoped session
+    with app.app_context():
+        if replica:
+            g.db_replica = True
+        return function(*args)
+
+
+async def run_database(function, *args, replica=False):
+    """
+    Run ``function`` in an application context on the database pool;
+    ``replica`` sends its SELECTs to the read replica, if any
+    """
+    executors.ensure_started()
+    return await asyncio.get_running_loop().run_in_executor(
+        executors.database, _in_app_context, function, args, replica)
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.args = {name: values[-1] for name, values in parse_qs(
+            scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+
+    def session(self):
+        """
+        The Flask session in the request's cookie, empty when invalid
+        """
+        cookie = SimpleCookie(self.headers.get('cookie', ''))
+        morsel = cookie.get(app.config['SESSION_COOKIE_NAME'])
+        serializer = app.session_interface.get_signing_serializer(app)
+        if morsel is None or serializer is None:
+            return {}
+        try:
+            return serializer.loads(morsel.value, max_age=int(
+                app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return {}
+
+
+def _user_id(session):
+    user = load_user(session.get('user_id'), session['username'], user_cache)
+    return user.id if user is not None else None
+
+
+def login_session(request):
+    """
+    The session of a logged-in user, or a 403 as from login_required
+    """
+    session = request.session()
+    if 'username' not in session:
+        raise HTTPError(403, {'error': "You do not have access to this "
+                                       "page. Please log in!"})
+    return session
+
+
+async def current_user_id(session):
+    """
+    Id of the logged-in user, found the way get_current_user finds it
+    """
+    user_id = await run_database(_user_id, session)
+    if user_id is None:
+        raise HTTPError(403, {'error': "Unknown user."})
+    return user_id
+
+
+def parse_instances(body):
+    """
+    The payload and feature matrix of a predict request body, or the
+    error response of /api/v1/predict
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        payload = {}
+    instances = payload.get('instances')
+    if not isinstance(instances, list) or not instances:
+        raise HTTPError(400, {'error': "'instances' must be a non-empty list "
+                                       "of feature vectors."})
+    if len(instances) > API_MAX_BATCH_ROWS:
+        raise HTTPError(413, {'error': f"At most {API_MAX_BATCH_ROWS} "
+                                       "instances are allowed per request."})
+    try:
+        return payload, vectorizer.batch(instances)
+    except FeatureError as error:
+        raise HTTPError(400, {'error': f"Every instance must hold "
+                                       f"{len(FEATURE_NAMES)} finite numbers.",
+                              'fields': error.errors})
+
+
+def score_body(body):
+    payload, features = parse_instances(body)
+    results, predictions = describe_predictions(*predict_batch(features))
+    return payload, features, results, predictions
+
+
+async def api_predict(request):
+    """
+    Score a batch of feature vectors, as /api/v1/predict does
+    """
+    session = login_session(request)
+    # Decoding, vectorizing and describing a large batch would stall the
+    # event loop as much as scoring it, so all of it runs on the pool
+    payload, features, results, predictions = await run_inference(
+        score_body, request.body)
+    if payload.get('persist'):
+        await run_database(persist_predictions,
+                           await current_user_id(session), features, results)
+    return 200, {'predictions': predictions}
+
+
+async def api_history(request):
+    """
+    One page of the user's diagnoses, as /api/v1/history does
+    """
+    user_id = await current_user_id(login_session(request))
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+    try:
+        page = await run_database(history_json, user_id,
+                                  request.args.get('cursor'),
+                                  history_limit(limit), replica=True)
+    except ValueError as error:
+        raise HTTPError(400, {'error': str(error)})
+    return 200, page
+
+
+ROUTES = {
+    ('POST', '/api/v1/predict'): api_predict,
+    ('GET', '/api/v1/history'): api_history,
+}
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, {'error': "The request body is too large."})
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+in_flight = 0
+
+
+async def handle(scope, receive, send):
+    global in_flight
+
+    view = ROUTES.get((scope['method'], scope['path']))
+    if view is None:
+        methods = [method for method, path in ROUTES if path == scope['path']]
+        if methods:
+            return await send_json(send, 405, {'error': "Method not allowed."})
+        return await send_json(send, 404, {'error': "Not found."})
+    if in_flight >= MAX_IN_FLIGHT:
+        return await send_json(send, 503, {'error': "Too many requests in "
+                                                    "progress, retry later."})
+    in_flight += 1
+    try:
+        try:
+            body = await read_body(receive)
+        except HTTPError as error:
+            return await send_json(send, error.status, error.payload)
+        if body is None:
+            return
+        task = asyncio.ensure_future(view(Request(scope, body)))
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        done, _ = await asyncio.wait({task, disconnect},
+                                     timeout=REQUEST_TIMEOUT_MS / 1e3,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        disconnect.cancel()
+        if task not in done:
+            # Pool work that has not started yet is dropped with the task
+            task.cancel()
+            if disconnect in done:
+                return
+            return await send_json(send, 504, {'error': "The request timed "
+                                                        "out."})
+        try:
+            status, payload = task.result()
+        except HTTPError as error:
+            status, payload = error.status, error.payload
+        await send_json(send, status, payload)
+    finally:
+        in_flight -= 1
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            executors.ensure_started()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executors.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
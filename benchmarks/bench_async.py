@@ -0,0 +1,208 @@
+"""
+Compare the sync Flask API with the asyncio one under many connections
+
+Starts gunicorn twice with gunicorn.conf.py and the same number of
+workers: once with the gthread workers serving wsgi:app, once with
+uvicorn workers serving asgi:application. Both use a fresh SQLite file
+holding one user with some history. Then, for every --connections count,
+that many keep-alive connections send requests as fast as they are
+answered for --duration seconds: single-row /api/v1/predict requests,
+with every --history-every-th one a /api/v1/history page instead.
+Reports requests per second, latency percentiles and errors. Needs
+uvicorn installed. Run from the repository root:
+
+    python -m benchmarks.bench_async --connections 16 128 512
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from sklearn.datasets import load_breast_cancer
+
+
+SERVERS = {
+    'sync': ['gthread', 'wsgi:app'],
+    'async': ['uvicorn.workers.UvicornWorker', 'asgi:application'],
+}
+
+
+def prepare_database(url, diagnoses):
+    """
+    Create the tables, a user with ``diagnoses`` rows, and their session
+    cookie
+    """
+    os.environ['DATABASE_URL'] = url
+    from app import app, db
+    from database import User, CancerDiagnosis, FEATURE_COLUMNS
+
+    rows = load_breast_cancer().data.tolist()
+    with app.app_context():
+        db.create_all()
+        user = User(fullname='Bench User', username='bench',
+                    email='bench@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add_all(CancerDiagnosis(
+            user_id=user.id, diagnosis_result='Non-Cancerous',
+            **dict(zip(FEATURE_COLUMNS, rows[index % len(rows)])))
+            for index in range(diagnoses))
+        db.session.commit()
+        serializer = app.session_interface.get_signing_serializer(app)
+        return serializer.dumps({'username': 'bench', 'user_id': user.id})
+
+
+def start_server(kind, port, env):
+    worker_class, target = SERVERS[kind]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '-k', worker_class, '--bind', f"127.0.0.1:{port}",
+         '--access-logfile', '/dev/null', target],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            asyncio.run(request_once(port))
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The {kind} server did not start on port {port}")
+
+
+async def request_once(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b"GET /api/v1/history HTTP/1.1\r\nHost: bench\r\n"
+                 b"Connection: close\r\n\r\n")
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+
+async def exchange(reader, writer, raw):
+    writer.write(raw)
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+def build_requests(cookie):
+    headers = (f"Host: bench\r\nCookie: session={cookie}\r\n"
+               f"Connection: keep-alive\r\n")
+    predicts = []
+    for row in load_breast_cancer().data[:100].tolist():
+        body = json.dumps({'instances': [row]}).encode()
+        predicts.append(
+            (f"POST /api/v1/predict HTTP/1.1\r\n{headers}"
+             f"Content-Type: application/json\r\n"
+             f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+    history = f"GET /api/v1/history HTTP/1.1\r\n{headers}\r\n".encode()
+    return predicts, history
+
+
+async def run_load(port, connections, duration, history_every, requests):
+    predicts, history = requests
+    latencies, errors = [], [0]
+    stop = time.perf_counter() + duration
+
+    async def connection(index):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        step = index
+        try:
+            while time.perf_counter() < stop:
+                step += 1
+                raw = history if step % history_every == 0 \
+                    else predicts[step % len(predicts)]
+                started = time.perf_counter()
+                try:
+                    status = await exchange(reader, writer, raw)
+                except (OSError, asyncio.IncompleteReadError):
+                    errors[0] += 1
+                    writer.close()
+                    reader, writer = await asyncio.open_connection(
+                        '127.0.0.1', port)
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    errors[0] += 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection(index)
+                           for index in range(connections)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def percentile(fraction):
+        if not latencies:
+            return float('nan')
+        return latencies[min(int(len(latencies) * fraction),
+                             len(latencies) - 1)] * 1e3
+
+    return {'rps': len(latencies) / elapsed, 'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+            'mean_ms': statistics.mean(latencies) * 1e3 if latencies
+            else float('nan'),
+            'errors': errors[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connections', type=int, nargs='+',
+                        default=[16, 128, 512])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Threads of each sync worker.')
+    parser.add_argument('--history-every', type=int, default=5)
+    parser.add_argument('--diagnoses', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-async-')
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    cookie = prepare_database(url, args.diagnoses)
+    env = dict(os.environ, DATABASE_URL=url,
+               GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_THREADS=str(args.threads),
+               METRICS_DIR=os.path.join(directory, 'metrics'),
+               MODEL_DRIFT_DIR=os.path.join(directory, 'drift'))
+    requests = build_requests(cookie)
+
+    results = {}
+    for offset, kind in enumerate(SERVERS):
+        port = args.port + offset
+        process = start_server(kind, port, env)
+        try:
+            for connections in args.connections:
+                results[kind, connections] = asyncio.run(run_load(
+                    port, connections, args.duration, args.history_every,
+                    requests))
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"{args.workers} workers ({args.threads} threads each when sync), "
+          f"{args.duration:.0f}s per run")
+    print(f"{'server':<6} {'conns':>6} {'req/s':>9} {'p50 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>7}")
+    for (kind, connections), result in results.items():
+        print(f"{kind:<6} {connections:>6} {result['rps']:>9.1f} "
+              f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+              f"{result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare the compiled tree-ensemble evaluator with sklearn's predict path
+
+Run from the repository root:
+
+    python -m benchmarks.bench_compiled --repeat 2000
+"""
+import argparse
+import time
+import numpy as np
+from sklearn.datasets import load_breast_cancer
+from models.model import registry
+from models.compiled import CompiledForest
+
+
+model = registry.current.model
+
+
+def us_per_row(predict, rows, batch_size, repeat):
+    batches = [rows[i % len(rows):i % len(rows) + batch_size]
+               for i in range(0, repeat * batch_size, batch_size)]
+    batches = [batch for batch in batches if len(batch) == batch_size]
+    started = time.perf_counter()
+    for batch in batches:
+        predict(batch)
+    elapsed = time.perf_counter() - started
+    return elapsed / (len(batches) * batch_size) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 8, 64, 512])
+    args = parser.parse_args()
+
+    rows = load_breast_cancer().data
+
+    started = time.perf_counter()
+    compiled = CompiledForest.from_model(model)
+    compile_ms = (time.perf_counter() - started) * 1e3
+
+    exact = np.array_equal(compiled.predict(rows), model.predict(rows))
+    print(f"compiled in {compile_ms:.1f} ms, "
+          f"{len(compiled.threshold)} nodes, exact match: {exact}")
+
+    for batch_size in args.batch_sizes:
+        # sklearn is slow per call, so give it fewer repetitions
+        sklearn_us = us_per_row(model.predict, rows, batch_size,
+                                max(args.repeat // 20, 10))
+        compiled_us = us_per_row(compiled.predict, rows, batch_size,
+                                 args.repeat)
+        print(f"batch {batch_size:>4}: sklearn {sklearn_us:9.1f} us/row  "
+              f"compiled {compiled_us:9.1f} us/row  "
+              f"speedup {sklearn_us / compiled_us:6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
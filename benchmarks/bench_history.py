@@ -0,0 +1,77 @@
+"""
+Measure repeat views of /history: full render, cached table and 304
+
+Seeds one user with --rows diagnoses, then views the first page through
+the test client three ways: with the fragment cache off (query and render
+every time), with it on, and revalidating with the ETag of the previous
+response. Reports the time and SQL statements per view of each. Uses the
+in-memory test database. Run from the repository root:
+
+    python -m benchmarks.bench_history --views 500
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--views', type=int, default=500)
+    parser.add_argument('--rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    from sqlalchemy import event, insert
+    import app as app_module
+    from app import app, db
+    from database import User, CancerDiagnosis, FEATURE_COLUMNS
+    from history import FragmentCache
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(fullname='Bench', username='bench',
+                            email='bench@example.com', password='x'))
+        db.session.commit()
+        db.session.execute(insert(CancerDiagnosis), [
+            dict(dict.fromkeys(FEATURE_COLUMNS, index * 0.5), user_id=1,
+                 diagnosis_result='Non-Cancerous')
+            for index in range(args.rows)])
+        db.session.commit()
+
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *arguments: statements.append(arguments[2]))
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = 'bench'
+            session['user_id'] = 1
+
+        def views(headers=None):
+            client.get('/history')  # warm up, and fill the cache
+            statements.clear()
+            started = time.perf_counter()
+            for _ in range(args.views):
+                response = client.get('/history', headers=headers)
+            elapsed = (time.perf_counter() - started) / args.views
+            return response, elapsed, len(statements) / args.views
+
+        app_module.history_cache = None
+        full, full_seconds, full_queries = views()
+        app_module.history_cache = FragmentCache(16 * 1024 * 1024)
+        _, cached_seconds, cached_queries = views()
+        response, conditional_seconds, conditional_queries = views(
+            {'If-None-Match': full.headers['ETag']})
+        assert response.status_code == 304
+
+    for name, seconds, queries in (
+            ('full render', full_seconds, full_queries),
+            ('cached table', cached_seconds, cached_queries),
+            ('304', conditional_seconds, conditional_queries)):
+        print(f"{name:<13} {seconds * 1e6:9.1f} us/view "
+              f"{queries:4.1f} queries/view "
+              f"({full_seconds / seconds:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
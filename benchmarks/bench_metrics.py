@@ -0,0 +1,87 @@
+"""
+Measure the overhead of request metrics on the /input hot path
+
+Posts the diagnosis form through the test client with metrics enabled and
+disabled, in alternating order to even out drift, and reports the best
+request time of each. End-to-end timings are noisier than the overhead
+itself, so the cost of exactly what one /input request records (four
+stages, the request histogram and counter) is also timed in a tight loop
+and compared with the request time. Uses the in-memory test database.
+Run from the repository root:
+
+    python -m benchmarks.bench_metrics --requests 2000
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    import app as app_module
+    from app import app, db
+    from database import User, FEATURE_COLUMNS
+    from metrics import stage_timer
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    enabled_stage = app_module.stage
+    disabled_stage = stage_timer(app_module.STAGE_SECONDS, enabled=False)
+    data = dict.fromkeys(FEATURE_COLUMNS, 1.0)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(fullname='Bench', username='bench',
+                            email='bench@example.com', password='x'))
+        db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = 'bench'
+            session['user_id'] = 1
+
+        timings = {True: [], False: []}
+        for round_number in range(args.rounds):
+            # Swap the order every round, the first batch of a round is
+            # consistently a little slower
+            order = (True, False) if round_number % 2 else (False, True)
+            for enabled in order:
+                app_module.METRICS_ENABLED = enabled
+                app_module.stage = enabled_stage if enabled \
+                    else disabled_stage
+                started = time.perf_counter()
+                for _ in range(args.requests // args.rounds):
+                    client.post('/input', data=data)
+                timings[enabled].append(time.perf_counter() - started)
+
+        # What the instrumentation adds to one request, in isolation
+        with app.test_request_context('/input'):
+            request_endpoint = 'diagnosis'
+            loops = 100000
+            started = time.perf_counter()
+            for _ in range(loops):
+                request_started = time.perf_counter()
+                for name in ('validate', 'predict', 'persist', 'render'):
+                    with enabled_stage(name):
+                        pass
+                app_module.REQUEST_SECONDS.observe(
+                    time.perf_counter() - request_started,
+                    request_endpoint, 'POST')
+                app_module.REQUESTS.inc(request_endpoint, 'POST', '200')
+            instrumentation = (time.perf_counter() - started) / loops
+
+    per_request = {enabled: min(seconds) / (args.requests // args.rounds)
+                   for enabled, seconds in timings.items()}
+    print(f"metrics off: {per_request[False] * 1e6:8.1f} us/request")
+    print(f"metrics on:  {per_request[True] * 1e6:8.1f} us/request "
+          f"({per_request[True] / per_request[False] - 1:+.2%})")
+    print(f"instrumentation alone: {instrumentation * 1e6:.1f} us/request "
+          f"({instrumentation / per_request[False]:.2%} of a request)")
+
+
+if __name__ == '__main__':
+    main()
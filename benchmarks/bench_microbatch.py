@@ -0,0 +1,77 @@
+"""
+Compare direct and micro-batched single-row prediction under concurrency
+
+Run from the repository root:
+
+    python -m benchmarks.bench_microbatch --threads 32 --requests 4000
+"""
+import argparse
+import threading
+import time
+import numpy as np
+from sklearn.datasets import load_breast_cancer
+from models.model import registry
+from models.batching import MicroBatcher
+
+
+model = registry.current.model
+
+
+def run(predict, rows, threads, requests):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = requests // threads
+
+    def worker(offset):
+        local = []
+        for i in range(per_thread):
+            row = rows[(offset + i) % len(rows)]
+            started = time.perf_counter()
+            predict(row)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i * per_thread,))
+               for i in range(threads)]
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1e3
+    return {'throughput_rps': len(latencies) / elapsed,
+            'p50_ms': np.percentile(latencies, 50),
+            'p99_ms': np.percentile(latencies, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    rows = load_breast_cancer().data
+
+    def direct(row):
+        return model.predict(np.asarray(row).reshape(1, -1))
+
+    batcher = MicroBatcher(model.predict,
+                           max_batch_size=args.max_batch_size,
+                           max_wait=args.max_wait_ms / 1e3)
+
+    for name, predict in (('direct', direct), ('batched', batcher.predict)):
+        result = run(predict, rows, args.threads, args.requests)
+        print(f"{name:>8}: {result['throughput_rps']:8.1f} req/s  "
+              f"p50 {result['p50_ms']:7.2f} ms  "
+              f"p99 {result['p99_ms']:7.2f} ms")
+    print(f"batcher stats: {batcher.stats()}")
+    batcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare pickled and memory-mapped model artifacts across worker processes
+
+Every worker loads the artifact and makes its first prediction while the
+others are alive, then reports the time that took and its memory. PSS splits
+shared pages between the processes mapping them, so it shows the saving that
+RSS hides. Run from the repository root (Linux only, for /proc):
+
+    python -m benchmarks.bench_mmap --workers 16
+"""
+import argparse
+import multiprocessing
+import pickle
+import tempfile
+import time
+import numpy as np
+
+
+def memory_kib():
+    usage = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                usage[key] = int(value.split()[0])
+    return usage
+
+
+def worker(kind, path, barrier, results):
+    # Import before measuring, so only the artifact itself is counted
+    import sklearn.ensemble  # noqa: F401
+    from models.compiled import CompiledForest
+
+    before = memory_kib()
+    started = time.perf_counter()
+    if kind == 'pickle':
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+    else:
+        model = CompiledForest.load(path, mmap=True)
+    model.predict(np.zeros((1, 30)))
+    first_prediction_ms = (time.perf_counter() - started) * 1e3
+
+    # Measure while every worker holds its copy
+    barrier.wait()
+    after = memory_kib()
+    results.put((first_prediction_ms, after['Rss'] - before['Rss'],
+                 after['Pss'] - before['Pss']))
+    barrier.wait()
+
+
+def run(kind, path, workers):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker,
+                                 args=(kind, path, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    measurements = np.array([results.get() for _ in processes])
+    for process in processes:
+        process.join()
+
+    first_ms, rss_kib, pss_kib = measurements.mean(axis=0)
+    print(f"{kind:>7}: first prediction {first_ms:7.1f} ms  "
+          f"RSS/worker {rss_kib / 1024:6.2f} MiB  "
+          f"PSS/worker {pss_kib / 1024:6.2f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    from models.compiled import CompiledForest
+    from models.model import model_path
+
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    with tempfile.TemporaryDirectory() as directory:
+        CompiledForest.from_model(model).save(directory)
+        run('pickle', model_path, args.workers)
+        run('mmap', directory, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare column and packed feature storage for diagnosis rows
+
+Inserts the same rows in both layouts, then reports the insert rate, the
+database size and the time to load every row back into one feature matrix.
+Uses a fresh SQLite file unless --database-url points elsewhere (the tables
+are dropped and recreated, so never point it at real data). Run from the
+repository root:
+
+    python -m benchmarks.bench_packed --rows 50000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from flask import Flask
+from sqlalchemy import insert, select, text
+
+
+def database_size(db, path):
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.execute(text(
+            "SELECT pg_total_relation_size('cancer_diagnoses')")).scalar()
+    db.session.execute(text('VACUUM'))
+    return os.path.getsize(path)
+
+
+def run(app, mode, matrix, batch_size, path):
+    from database import db, CancerDiagnosis, FEATURE_COLUMNS, User
+    from feature_storage import feature_matrix, feature_values
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(fullname='Bench', username='bench',
+                            email='bench@example.com', password='x'))
+        db.session.commit()
+
+        started = time.perf_counter()
+        for start in range(0, len(matrix), batch_size):
+            rows = [dict(feature_values(vector, mode == 'packed'),
+                         user_id=1, diagnosis_result='Not Cancerous')
+                    for vector in matrix[start:start + batch_size]]
+            db.session.execute(insert(CancerDiagnosis), rows)
+            db.session.commit()
+        insert_seconds = time.perf_counter() - started
+
+        size = database_size(db, path)
+        columns = [getattr(CancerDiagnosis, name) for name in FEATURE_COLUMNS]
+        started = time.perf_counter()
+        loaded = feature_matrix(select(CancerDiagnosis.features, *columns))
+        load_seconds = time.perf_counter() - started
+        assert np.array_equal(loaded, matrix)
+        db.session.remove()
+
+    print(f"{mode:>7}: insert {len(matrix) / insert_seconds:9.0f} rows/s  "
+          f"size {size / 2 ** 20:7.2f} MiB  "
+          f"load matrix {load_seconds * 1e3:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    from database import db
+
+    matrix = np.random.default_rng(0).random((args.rows, 30))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            args.database_url or f"sqlite:///{path}"
+        db.init_app(app)
+        for mode in ('columns', 'packed'):
+            run(app, mode, matrix, args.batch_size, path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure prediction throughput while logins are being checked
+
+Threads of one simulated worker either verify passwords (like /login) or
+score single rows (like /input) for a fixed time. Compares hashing in the
+request threads with hashing in a process pool behind admission control.
+Run from the repository root:
+
+    python -m benchmarks.bench_passwords --login-threads 8 --predict-threads 4
+"""
+import argparse
+import threading
+import time
+import numpy as np
+from sklearn.datasets import load_breast_cancer
+from models.model import predict_cancerous
+from passwords import PasswordHasher, HasherBusy
+
+
+def run(label, hasher, stored, rows, login_threads, predict_threads,
+        duration):
+    counts = {'logins': 0, 'rejected': 0}
+    latencies = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def login():
+        while time.perf_counter() < stop:
+            try:
+                hasher.verify(stored, 'password123')
+                key = 'logins'
+            except HasherBusy:
+                key = 'rejected'
+            with lock:
+                counts[key] += 1
+
+    def predict(offset):
+        local = []
+        i = offset
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            predict_cancerous(rows[i % len(rows)])
+            local.append(time.perf_counter() - started)
+            i += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=login) for _ in range(login_threads)]
+    threads += [threading.Thread(target=predict, args=(i * 97,))
+                for i in range(predict_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies_ms = np.array(latencies) * 1e3
+    print(f"{label:>14}: {counts['logins'] / duration:7.1f} logins/s  "
+          f"{counts['rejected'] / duration:7.1f} rejected/s  "
+          f"{len(latencies) / duration:8.1f} predictions/s  "
+          f"p50 {np.percentile(latencies_ms, 50):6.2f} ms  "
+          f"p99 {np.percentile(latencies_ms, 99):6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--method', default='scrypt')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-concurrent', type=int, default=2)
+    parser.add_argument('--login-threads', type=int, default=8)
+    parser.add_argument('--predict-threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    rows = [list(row) for row in load_breast_cancer().data]
+    configurations = [
+        ('inline', PasswordHasher(args.method,
+                                  max_concurrent=args.login_threads)),
+        ('pool+admission', PasswordHasher(args.method, workers=args.workers,
+                                          max_concurrent=args.max_concurrent,
+                                          admission_timeout=0.05)),
+    ]
+    for label, hasher in configurations:
+        stored = hasher.hash('password123')
+        run(label, hasher, stored, rows, args.login_threads,
+            args.predict_threads, args.duration)
+        hasher.close()
+
+
+if __name__ == '__main__':
+    main()
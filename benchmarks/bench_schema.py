@@ -0,0 +1,79 @@
+"""
+Compare the per-request cost of parsing diagnosis features
+
+Times turning one posted form into model input through the WTForms path
+(build CancerDiagnosisForm, validate its 30 FloatFields, collect the data
+into a list) against the schema vectorizer reading the same request
+values straight into a float64 row. JSON batches of objects keyed by
+feature name are timed as well. Parsing happens inside a request context,
+as in a view, but no view runs. Run from the repository root:
+
+    python -m benchmarks.bench_schema --requests 5000
+"""
+import argparse
+import os
+import time
+from sklearn.datasets import load_breast_cancer
+from werkzeug.datastructures import MultiDict
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+
+def best_of(operation, number, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            operation()
+        runs.append((time.perf_counter() - started) / number)
+    return min(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+
+    from flask import request
+    from app import app
+    from forms import CancerDiagnosisForm
+    from schema import FEATURE_NAMES, vectorizer
+
+    rows = load_breast_cancer().data.tolist()
+    formdata = MultiDict({name: str(value)
+                          for name, value in zip(FEATURE_NAMES, rows[0])})
+
+    def form_path():
+        form = CancerDiagnosisForm(meta={'csrf': False})
+        assert form.validate()
+        return [form[name].data for name in FEATURE_NAMES]
+
+    def vectorizer_path():
+        return vectorizer.row(request.form)
+
+    with app.test_request_context('/input', method='POST', data=formdata):
+        assert form_path() == vectorizer_path()[0].tolist()
+        form_seconds = best_of(form_path, args.requests, args.repeat)
+        row_seconds = best_of(vectorizer_path, args.requests, args.repeat)
+
+    objects = [dict(zip(FEATURE_NAMES, row)) for row in rows[:args.batch]]
+    lists = rows[:args.batch]
+    batch_number = max(args.requests // args.batch, 10)
+    object_seconds = best_of(lambda: vectorizer.batch(objects),
+                             batch_number, args.repeat)
+    list_seconds = best_of(lambda: vectorizer.batch(lists),
+                           batch_number, args.repeat)
+
+    print(f"form path:        {form_seconds * 1e6:8.1f} us/request")
+    print(f"vectorizer row:   {row_seconds * 1e6:8.1f} us/request "
+          f"({form_seconds / row_seconds:.1f}x faster)")
+    print(f"batch of {args.batch} objects: {object_seconds * 1e6:8.1f} us "
+          f"({object_seconds / args.batch * 1e6:.2f} us/row)")
+    print(f"batch of {args.batch} lists:   {list_seconds * 1e6:8.1f} us "
+          f"({list_seconds / args.batch * 1e6:.2f} us/row)")
+
+
+if __name__ == '__main__':
+    main()
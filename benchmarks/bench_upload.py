@@ -0,0 +1,80 @@
+"""
+Time a bulk CSV upload end to end: parse, score and insert
+
+Writes a CSV of random diagnoses, then ingests it the way /upload does and
+reports rows per second and how much the peak RSS grew while ingesting. Uses a
+fresh SQLite file unless --database-url points elsewhere (the tables are
+dropped and recreated, so never point it at real data). Run from the
+repository root:
+
+    python -m benchmarks.bench_upload --rows 100000
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+import resource
+import numpy as np
+from flask import Flask
+
+
+def write_csv(path, rows):
+    from database import FEATURE_COLUMNS
+
+    generator = np.random.default_rng(0)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FEATURE_COLUMNS)
+        # In slices, so writing the file does not raise the peak RSS
+        for start in range(0, rows, 1000):
+            count = min(1000, rows - start)
+            writer.writerows(generator.random(
+                (count, len(FEATURE_COLUMNS))).tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--packed', action='store_true')
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    from database import db, User
+    from upload import ingest_csv
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url or \
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        db.init_app(app)
+        path = os.path.join(directory, 'upload.csv')
+        write_csv(path, args.rows)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            user = User(fullname='Bench', username='bench',
+                        email='bench@example.com', password='x')
+            db.session.add(user)
+            db.session.commit()
+
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time.perf_counter()
+            with open(path, newline='') as f:
+                report = ingest_csv(f, user.id, args.chunk_size, args.packed)
+            seconds = time.perf_counter() - started
+            # ru_maxrss is in KiB on Linux
+            growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss \
+                - baseline
+        size = os.path.getsize(path)
+
+    print(f"{report['inserted']} rows in {seconds:.2f} s "
+          f"({report['inserted'] / seconds:.0f} rows/s), "
+          f"peak RSS grew {growth / 1024:.1f} MiB "
+          f"for a {size / 2 ** 20:.1f} MiB file")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+In-process load generator for the Flask app
+
+Synthetic users, one thread and test client each, log in and then post
+rows of the breast cancer dataset to /input, reading /history every few
+diagnoses. Requests go through the full WSGI stack (routing, forms,
+model, database, templates) without a network in between.
+"""
+import threading
+import time
+import numpy as np
+from sklearn.datasets import load_breast_cancer
+
+
+def create_users(count):
+    from database import db, User
+
+    ids = []
+    for index in range(count):
+        username = f"loaduser{index}"
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            user = User(fullname=f"Load User {index}", username=username,
+                        email=f"{username}@example.com", password='x')
+            db.session.add(user)
+            db.session.commit()
+        ids.append((user.id, username))
+    return ids
+
+
+def run_load(app, users=8, duration=10.0, history_every=5):
+    """
+    Throughput and latency percentiles per endpoint, by name
+    """
+    from database import FEATURE_COLUMNS
+
+    with app.app_context():
+        accounts = create_users(users)
+    # The load is about serving, not about CSRF tokens
+    csrf_enabled = app.config.get('WTF_CSRF_ENABLED', True)
+    app.config['WTF_CSRF_ENABLED'] = False
+    forms = [dict(zip(FEATURE_COLUMNS, row))
+             for row in load_breast_cancer().data.tolist()]
+
+    latencies = {'input': [], 'history': []}
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(users + 1)
+
+    def user(index, user_id, username):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = username
+            session['user_id'] = user_id
+        local = {'input': [], 'history': []}
+        failures = 0
+        start_barrier.wait()
+        stop = time.perf_counter() + duration
+        step = index
+        while time.perf_counter() < stop:
+            step += 1
+            if step % history_every == 0:
+                name, request = 'history', lambda: client.get('/history')
+            else:
+                form = forms[step % len(forms)]
+                name, request = 'input', \
+                    lambda: client.post('/input', data=form)
+            started = time.perf_counter()
+            response = request()
+            local[name].append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures += 1
+        with lock:
+            for name, values in local.items():
+                latencies[name].extend(values)
+            errors.append(failures)
+
+    threads = [threading.Thread(target=user, args=(index, *account))
+               for index, account in enumerate(accounts)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    app.config['WTF_CSRF_ENABLED'] = csrf_enabled
+
+    total = sum(len(values) for values in latencies.values())
+    results = {
+        'load.throughput': {'value': total / elapsed, 'unit': 'req/s',
+                            'higher_is_better': True},
+        'load.errors': {'value': sum(errors), 'unit': 'requests',
+                        'higher_is_better': False},
+    }
+    for name, values in latencies.items():
+        if not values:
+            continue
+        for percentile in (50, 95, 99):
+            results[f"load.{name}.p{percentile}"] = {
+                'value': float(np.percentile(values, percentile)),
+                'unit': 's', 'higher_is_better': False}
+    return results
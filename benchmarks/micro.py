@@ -0,0 +1,105 @@
+"""
+Micro-benchmarks of the serving hot paths
+
+Each benchmark reports the median seconds per operation over a few
+repeats. The app must be importable with DATABASE_URL pointing at a
+throwaway database; ``benchmarks.suite`` takes care of that.
+"""
+import statistics
+import time
+from sklearn.datasets import load_breast_cancer
+from werkzeug.datastructures import MultiDict
+
+
+def measure(operation, number, repeat=5):
+    """
+    Median seconds per call of ``operation`` over ``repeat`` runs
+    """
+    operation()  # warm up
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            operation()
+        runs.append((time.perf_counter() - started) / number)
+    return statistics.median(runs)
+
+
+def run_micro(app, user_id, scale=1.0):
+    """
+    Seconds per operation of every micro-benchmark, by name
+    """
+    from flask import request
+    from database import db, CancerDiagnosis, FEATURE_COLUMNS
+    from feature_storage import feature_values
+    from forms import CancerDiagnosisForm
+    from history import history_page
+    from models.drift import FeatureSketch, load_profile
+    from models.model import (
+        DRIFT_PROFILE_PATH,
+        MODEL_ENGINE,
+        model_path,
+        predict_batch,
+        predict_cancerous,
+    )
+    from models.registry import load_model
+    from schema import vectorizer
+
+    rows = load_breast_cancer().data
+    row_lists = rows.tolist()
+    results = {}
+
+    def count(n):
+        return max(int(n * scale), 1)
+
+    results['model_load'] = measure(
+        lambda: load_model('default', model_path, MODEL_ENGINE),
+        number=1, repeat=3)
+
+    state = {'i': 0}
+
+    def single():
+        state['i'] = (state['i'] + 1) % len(row_lists)
+        predict_cancerous(row_lists[state['i']])
+
+    results['predict_single'] = measure(single, count(200))
+    results['predict_batch_100'] = measure(
+        lambda: predict_batch(rows[:100]), count(50))
+
+    sketch = FeatureSketch(load_profile(DRIFT_PROFILE_PATH)['edges'])
+    results['drift_observe'] = measure(
+        lambda: sketch.update(row_lists[0]), count(1000))
+
+    formdata = MultiDict({name: str(value) for name, value
+                          in zip(FEATURE_COLUMNS, row_lists[0])})
+
+    def validate():
+        with app.test_request_context('/input', method='POST',
+                                      data=formdata):
+            form = CancerDiagnosisForm(meta={'csrf': False})
+            assert form.validate()
+
+    results['form_validation'] = measure(validate, count(200))
+
+    def vectorize():
+        with app.test_request_context('/input', method='POST',
+                                      data=formdata):
+            vectorizer.row(request.form)
+
+    results['vectorize_row'] = measure(vectorize, count(200))
+
+    with app.app_context():
+        def insert():
+            db.session.add(CancerDiagnosis(
+                user_id=user_id, diagnosis_result='Non-Cancerous',
+                **feature_values(row_lists[0])))
+            db.session.commit()
+
+        results['orm_insert'] = measure(insert, count(200))
+        results['orm_select_history'] = measure(
+            lambda: history_page(user_id, limit=50), count(200))
+        db.session.remove()
+
+    return {f"micro.{name}": {'value': seconds, 'unit': 's',
+                              'higher_is_better': False}
+            for name, seconds in results.items()}
@@ -0,0 +1,160 @@
+"""
+Benchmark suite for the serving hot paths, with stored baselines
+
+Runs the micro-benchmarks (model load, single and batch prediction, form
+validation, feature vectorizing, ORM insert and select) and the in-process
+load generator, prints the results and compares them with a baseline JSON
+file. The exit status is 1 when any result is worse than the baseline by
+more than --threshold (0.2 = 20%), so the suite can gate changes in CI.
+
+By default everything runs against a fresh SQLite file. Pass
+--database-url (or set BENCH_DATABASE_URL) to use a local PostgreSQL
+instead; its tables are dropped and recreated, so only ever point it at a
+throwaway database. When that database cannot be reached the suite says
+so and falls back to SQLite. Run from the repository root:
+
+    python -m benchmarks.suite --save          # record a baseline
+    python -m benchmarks.suite                 # compare with it
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def compare(results, baseline, threshold):
+    """
+    ``(name, baseline, value, change)`` of the results that regressed
+
+    ``change`` is the relative slowdown: the increase of a time, or the
+    drop of a throughput. Results missing from either side are skipped.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        before, after = reference['value'], result['value']
+        if result['higher_is_better']:
+            change = (before - after) / before if before else 0.0
+        elif before:
+            change = (after - before) / before
+        else:
+            change = float('inf') if after > 0 else 0.0
+        if change > threshold:
+            regressions.append((name, before, after, change))
+    return regressions
+
+
+def database_available(url):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(url)
+    try:
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        return True
+    except Exception as error:
+        print(f"Database at {engine.url!r} is not available ({error}), "
+              "falling back to SQLite", file=sys.stderr)
+        return False
+    finally:
+        engine.dispose()
+
+
+def environment(app):
+    from database import db
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    return {'python': platform.python_version(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'database': dialect}
+
+
+def run(args):
+    # The app reads its configuration on import, so set it up first
+    if not (args.database_url and database_available(args.database_url)):
+        os.environ['DATABASE_URL'] = \
+            f"sqlite:///{os.path.join(args.workdir, 'bench.db')}"
+    else:
+        os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    from app import app
+    from database import db
+    from benchmarks.load import create_users, run_load
+    from benchmarks.micro import run_micro
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user_id = create_users(1)[0][0]
+
+    results = {}
+    if args.only in (None, 'micro'):
+        results.update(run_micro(app, user_id, args.scale))
+    if args.only in (None, 'load'):
+        results.update(run_load(app, args.users, args.duration))
+    return environment(app), results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='Write the results as the new baseline.')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--only', choices=('micro', 'load'))
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplier for micro-benchmark iterations.')
+    parser.add_argument('--database-url',
+                        default=os.getenv('BENCH_DATABASE_URL'))
+    parser.add_argument('--output', help='Also write the results here.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        env, results = run(args)
+
+    for name, result in sorted(results.items()):
+        print(f"{name:<28} {result['value']:14.6g} {result['unit']}")
+    report = {'environment': env, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['environment'] != env:
+        print(f"Warning: baseline recorded on {baseline['environment']}, "
+              f"this run is on {env}", file=sys.stderr)
+    regressions = compare(results, baseline['results'], args.threshold)
+    for name, before, after, change in regressions:
+        print(f"REGRESSION {name}: {before:.6g} -> {after:.6g} "
+              f"({change:+.1%})")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,11 @@
 from datetime import datetime, timezone
+import numpy as np
 from flask_sqlalchemy import SQLAlchemy
+from engines import RoutingSession
+from schema import FEATURES, FEATURE_NAMES
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(db.Model):
@@ -29,44 +32,26 @@ class User(db.Model):
         return f"User('{self.username}', '{self.fullname}')"
 
 
-class CancerDiagnosis(db.Model):
+# One nullable Float column per feature, NULL when stored packed
+FeatureColumns = type('FeatureColumns', (), {
+    feature.name: db.Column(db.Float, nullable=True) for feature in FEATURES})
+
+# Every diagnosis stores its features, packed or in all of the columns
+FEATURES_STORED_CONSTRAINT = 'ck_cancer_diagnoses_features_stored'
+FEATURES_STORED = "features IS NOT NULL OR ({})".format(
+    ' AND '.join(f"{name} IS NOT NULL" for name in FEATURE_NAMES))
+
+
+class CancerDiagnosis(FeatureColumns, db.Model):
     __tablename__ = "cancer_diagnoses"
     id = db.Column(db.Integer, primary_key=True)
 
     # Link to User model (foreign key)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
-    # Form fields for cancer diagnosis
-    mean_radius = db.Column(db.Float, nullable=False)
-    mean_texture = db.Column(db.Float, nullable=False)
-    mean_perimeter = db.Column(db.Float, nullable=False)
-    mean_area = db.Column(db.Float, nullable=False)
-    mean_smoothness = db.Column(db.Float, nullable=False)
-    mean_compactness = db.Column(db.Float, nullable=False)
-    mean_concavity = db.Column(db.Float, nullable=False)
-    mean_concave_points = db.Column(db.Float, nullable=False)
-    mean_symmetry = db.Column(db.Float, nullable=False)
-    mean_fractal_dimension = db.Column(db.Float, nullable=False)
-    radius_error = db.Column(db.Float, nullable=False)
-    texture_error = db.Column(db.Float, nullable=False)
-    perimeter_error = db.Column(db.Float, nullable=False)
-    area_error = db.Column(db.Float, nullable=False)
-    smoothness_error = db.Column(db.Float, nullable=False)
-    compactness_error = db.Column(db.Float, nullable=False)
-    concavity_error = db.Column(db.Float, nullable=False)
-    concave_points_error = db.Column(db.Float, nullable=False)
-    symmetry_error = db.Column(db.Float, nullable=False)
-    fractal_dimension_error = db.Column(db.Float, nullable=False)
-    worst_radius = db.Column(db.Float, nullable=False)
-    worst_texture = db.Column(db.Float, nullable=False)
-    worst_perimeter = db.Column(db.Float, nullable=False)
-    worst_area = db.Column(db.Float, nullable=False)
-    worst_smoothness = db.Column(db.Float, nullable=False)
-    worst_compactness = db.Column(db.Float, nullable=False)
-    worst_concavity = db.Column(db.Float, nullable=False)
-    worst_concave_points = db.Column(db.Float, nullable=False)
-    worst_symmetry = db.Column(db.Float, nullable=False)
-    worst_fractal_dimension = db.Column(db.Float, nullable=False)
+    # The same 30 values packed into one little-endian float64 (or float32)
+    # array, used instead of the columns above in packed storage mode
+    features = db.Column(db.LargeBinary, nullable=True)
 
     created_at = db.Column(db.DateTime,
                            default=lambda: datetime.now(timezone.utc),
@@ -78,3 +63,62 @@ class CancerDiagnosis(db.Model):
 
     # Diagnosis result (Cancerous or Non-Cancerous)
     diagnosis_result = db.Column(db.String(20), nullable=False)
+
+    @property
+    def feature_vector(self):
+        """
+        The 30 features in model order; a zero-copy view of packed storage
+        """
+        if self.features is not None:
+            return unpack_features(self.features)
+        return np.array([getattr(self, name) for name in FEATURE_COLUMNS],
+                        dtype=np.float64)
+
+    # Serves a user's history newest first, in the order it is paginated
+    __table_args__ = (
+        db.Index('ix_cancer_diagnoses_user_id_created_at_id',
+                 user_id, created_at.desc(), id.desc()),
+        db.CheckConstraint(FEATURES_STORED, name=FEATURES_STORED_CONSTRAINT),
+    )
+
+
+# Feature columns in the order the model expects them
+FEATURE_COLUMNS = FEATURE_NAMES
+
+# Running mean and sum of squared deviations (M2) of every feature
+StatsColumns = type('StatsColumns', (), {
+    f"{prefix}_{name}": db.Column(db.Float, nullable=False, default=0.0)
+    for prefix in ('mean', 'm2') for name in FEATURE_NAMES})
+
+
+class DiagnosisStats(StatsColumns, db.Model):
+    """
+    Diagnosis counts and feature moments per user and result, kept up to
+    date by every insert; user 0 holds the totals of all users
+    """
+    __tablename__ = "diagnosis_stats"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    diagnosis_result = db.Column(db.String(20), nullable=False)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint(user_id, diagnosis_result,
+                            name='uq_diagnosis_stats_user_id_result'),
+    )
+
+
+def pack_features(values, dtype='<f8'):
+    """
+    Pack a feature vector into the bytes stored in ``features``
+    """
+    return np.ascontiguousarray(values, dtype=dtype).tobytes()
+
+
+def unpack_features(blob):
+    """
+    Read-only float array over packed ``features`` bytes, without copying
+    """
+    # 8 bytes per value for float64 rows, 4 for float32 ones
+    dtype = '<f8' if len(blob) == 8 * len(FEATURE_COLUMNS) else '<f4'
+    return np.frombuffer(blob, dtype=dtype)
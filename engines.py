@@ -0,0 +1,132 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select
+from sqlalchemy.pool import QueuePool
+
+
+# Bind key of the optional read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool that records how long checkouts wait for a connection
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self._record_wait(time.perf_counter() - started)
+
+    def _record_wait(self, seconds):
+        # recreate() builds a new pool, so the counters start lazily
+        if '_wait_lock' not in self.__dict__:
+            self._wait_lock = threading.Lock()
+            self.waits = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+        with self._wait_lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+def engine_options(url, pool_size=5, max_overflow=10, pool_timeout=30,
+                   pool_recycle=-1, pre_ping=True, statement_timeout_ms=0):
+    """
+    Engine keyword arguments for ``url``
+
+    SQLite keeps its default pool, which has no size or overflow; a
+    statement timeout is only set on PostgreSQL, where the server enforces
+    it for every statement of the connection.
+    """
+    options = {'pool_pre_ping': pre_ping, 'pool_recycle': pool_recycle}
+    if url.startswith('sqlite'):
+        return options
+    options.update(poolclass=MeteredQueuePool, pool_size=pool_size,
+                   max_overflow=max_overflow, pool_timeout=pool_timeout)
+    if statement_timeout_ms and url.startswith('postgresql'):
+        options['connect_args'] = {
+            'options': f"-c statement_timeout={int(statement_timeout_ms)}"}
+    return options
+
+
+def pool_stats(engine):
+    """
+    Connections checked out and waiting figures of ``engine``'s pool
+    """
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(),
+                     checked_in=pool.checkedin(), overflow=pool.overflow())
+    if isinstance(pool, MeteredQueuePool):
+        stats.update(waits=getattr(pool, 'waits', 0),
+                     wait_seconds=getattr(pool, 'wait_seconds', 0.0),
+                     max_wait_seconds=getattr(pool, 'max_wait_seconds', 0.0))
+    return stats
+
+
+def reading_from_replica():
+    return has_app_context() and g.get('db_replica', False)
+
+
+def use_replica(f):
+    """
+    Serve the SELECTs of a read-only route from the read replica, if any
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_replica = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            # An application context can outlive one request (as in tests)
+            g.pop('db_replica', None)
+    return decorated_function
+
+
+@contextmanager
+def primary_reads():
+    """
+    Send the SELECTs of the block to the primary, even in a ``use_replica``
+    route, for rows that must not lag behind (such as the logged-in user)
+    """
+    replica = g.pop('db_replica', None) if has_app_context() else None
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.db_replica = replica
+
+
+class RoutingSession(Session):
+    """
+    Session that sends plain SELECTs of ``use_replica`` routes to the
+    replica; flushes, writes and raw SQL always go to the primary
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing
+                and isinstance(clause, Select) and reading_from_replica()
+                and not (self.new or self.dirty or self.deleted)):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def read_engine(db):
+    """
+    Engine for queries run outside the session, such as streamed exports
+    """
+    if reading_from_replica():
+        return db.engines.get(REPLICA_BIND, db.engine)
+    return db.engine
@@ -0,0 +1,110 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from database import db, CancerDiagnosis, FEATURE_COLUMNS, unpack_features
+
+
+EXPORT_COLUMNS = (
+    CancerDiagnosis.id,
+    CancerDiagnosis.user_id,
+    CancerDiagnosis.created_at,
+    *(getattr(CancerDiagnosis, name) for name in FEATURE_COLUMNS),
+    CancerDiagnosis.diagnosis_result,
+)
+EXPORT_FIELDS = tuple(column.key for column in EXPORT_COLUMNS)
+EXPORT_FORMATS = ('csv', 'ndjson')
+# Rows fetched from the server-side cursor and written per chunk
+CHUNK_SIZE = 5000
+
+
+def parse_date(value):
+    """
+    Parse an ISO date or datetime query parameter, None when empty
+    """
+    return datetime.fromisoformat(value) if value else None
+
+
+def export_query(user_id=None, start=None, end=None):
+    """
+    Diagnoses in id order, optionally for one user and ``start <= created_at
+    < end``
+    """
+    query = select(*EXPORT_COLUMNS, CancerDiagnosis.features)\
+        .order_by(CancerDiagnosis.id)
+    if user_id is not None:
+        query = query.where(CancerDiagnosis.user_id == user_id)
+    if start is not None:
+        query = query.where(CancerDiagnosis.created_at >= start)
+    if end is not None:
+        query = query.where(CancerDiagnosis.created_at < end)
+    return query
+
+
+def iter_chunks(query, chunk_size=CHUNK_SIZE, engine=None):
+    """
+    Yield lists of plain row tuples read through a server-side cursor
+    """
+    # stream_results makes psycopg2 use a named (server-side) cursor, so
+    # only one chunk is ever held in memory; no ORM entities are built
+    with (engine or db.engine).connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=chunk_size).execute(query)
+        for partition in result.partitions():
+            yield [_unpacked(row) for row in partition]
+
+
+def _unpacked(row):
+    # The last column is the packed blob, set instead of the feature columns
+    blob = row[-1]
+    if blob is None:
+        return tuple(row[:-1])
+    return (*row[:3], *unpack_features(blob).tolist(), row[-2])
+
+
+def _csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(chunks):
+    for chunk in chunks:
+        lines = []
+        for row in chunk:
+            record = dict(zip(EXPORT_FIELDS, row))
+            record['created_at'] = record['created_at'].isoformat()
+            lines.append(json.dumps(record))
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip(pieces):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(query, fmt='csv', gzip=False, chunk_size=CHUNK_SIZE,
+                  engine=None):
+    """
+    Generate the export as encoded byte chunks with flat memory use
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt!r}")
+    encode = _csv_chunks if fmt == 'csv' else _ndjson_chunks
+    pieces = (text.encode() for text in
+              encode(iter_chunks(query, chunk_size, engine)))
+    return _gzip(pieces) if gzip else pieces
@@ -0,0 +1,141 @@
+import numpy as np
+from sqlalchemy import bindparam, inspect, select, text, update
+from database import (
+    db,
+    CancerDiagnosis,
+    FEATURE_COLUMNS,
+    FEATURES_STORED,
+    FEATURES_STORED_CONSTRAINT,
+    pack_features,
+    unpack_features,
+)
+
+
+STORAGE_MODES = ('columns', 'packed')
+
+
+def feature_values(values, packed=False, dtype='<f8'):
+    """
+    Column values storing one feature vector, as 30 columns or one blob
+    """
+    if packed:
+        return {'features': pack_features(values, dtype)}
+    return dict(zip(FEATURE_COLUMNS, values))
+
+
+def expand_row(row):
+    """
+    Selected row as a dict, with packed features spread into the columns
+    """
+    values = row._asdict()
+    blob = values.pop('features', None)
+    if blob is not None:
+        values.update(zip(FEATURE_COLUMNS, unpack_features(blob).tolist()))
+    return values
+
+
+def feature_matrix(query):
+    """
+    Load the features selected by ``query`` (``features`` plus the 30
+    columns, in that order) into one float64 matrix
+    """
+    rows = db.session.execute(query).all()
+    matrix = np.empty((len(rows), len(FEATURE_COLUMNS)), dtype=np.float64)
+    for index, row in enumerate(rows):
+        if row[0] is not None:
+            matrix[index] = unpack_features(row[0])
+        else:
+            matrix[index] = row[1:]
+    return matrix
+
+
+def add_features_column():
+    """
+    Add the ``features`` column to tables created before it existed
+    """
+    columns = {column['name']: column for column in
+               inspect(db.engine).get_columns(CancerDiagnosis.__tablename__)}
+    if 'features' not in columns:
+        column_type = CancerDiagnosis.features.type.compile(
+            dialect=db.engine.dialect)
+        db.session.execute(text(
+            f"ALTER TABLE {CancerDiagnosis.__tablename__} "
+            f"ADD COLUMN features {column_type}"))
+    return columns
+
+
+def _allow_null_columns(columns):
+    not_null = [name for name in FEATURE_COLUMNS
+                if not columns[name]['nullable']]
+    if not not_null:
+        return
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError(
+            "The feature columns are NOT NULL and this database cannot drop "
+            "the constraint in place; recreate the table with init-db first")
+    for name in not_null:
+        db.session.execute(text(
+            f"ALTER TABLE {CancerDiagnosis.__tablename__} "
+            f"ALTER COLUMN {name} DROP NOT NULL"))
+    # Rows without a packed vector still need all of the columns
+    db.session.execute(text(
+        f"ALTER TABLE {CancerDiagnosis.__tablename__} "
+        f"ADD CONSTRAINT {FEATURES_STORED_CONSTRAINT} "
+        f"CHECK ({FEATURES_STORED})"))
+
+
+def migrate_feature_storage(to='packed', chunk_size=1000, dtype='<f8'):
+    """
+    Convert existing rows to packed (or back to column) storage in chunks
+
+    Adds the ``features`` column to tables created before it existed and,
+    on PostgreSQL, drops the NOT NULL constraints of the feature columns.
+    Rows are rewritten in id order with one executemany per chunk; returns
+    the number of rows converted.
+    """
+    if to not in STORAGE_MODES:
+        raise ValueError(f"Unknown feature storage mode: {to!r}")
+    table = CancerDiagnosis.__table__
+    columns = add_features_column()
+    if to == 'packed':
+        _allow_null_columns(columns)
+    db.session.commit()
+
+    feature_columns = [table.c[name] for name in FEATURE_COLUMNS]
+    if to == 'packed':
+        query = select(table.c.id, *feature_columns)\
+            .where(table.c.features.is_(None))
+        statement = update(table)\
+            .where(table.c.id == bindparam('row_id'))\
+            .values(features=bindparam('packed'),
+                    **{name: None for name in FEATURE_COLUMNS})
+    else:
+        query = select(table.c.id, table.c.features)\
+            .where(table.c.features.isnot(None))
+        statement = update(table)\
+            .where(table.c.id == bindparam('row_id'))\
+            .values(features=None,
+                    **{name: bindparam(f"v_{name}")
+                       for name in FEATURE_COLUMNS})
+
+    converted, last_id = 0, 0
+    while True:
+        rows = db.session.execute(
+            query.where(table.c.id > last_id)
+            .order_by(table.c.id).limit(chunk_size)).all()
+        if not rows:
+            return converted
+        if to == 'packed':
+            matrix = np.asarray([row[1:] for row in rows], dtype=dtype)
+            parameters = [{'row_id': row.id, 'packed': vector.tobytes()}
+                          for row, vector in zip(rows, matrix)]
+        else:
+            parameters = [{'row_id': row.id,
+                           **{f"v_{name}": value for name, value in
+                              zip(FEATURE_COLUMNS,
+                                  unpack_features(row.features).tolist())}}
+                          for row in rows]
+        db.session.connection().execute(statement, parameters)
+        db.session.commit()
+        converted += len(rows)
+        last_id = rows[-1].id
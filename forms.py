@@ -1,6 +1,8 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, FloatField
-from wtforms.validators import DataRequired, Length, Email, EqualTo, InputRequired
+from wtforms.validators import DataRequired, Length, Email, EqualTo, InputRequired, NumberRange
+from schema import FEATURES, MAX_VALUE
 
 
 class RegisterForm(FlaskForm):
@@ -48,106 +50,24 @@ class LoginForm(FlaskForm):
 
 
 class CancerDiagnosisForm(FlaskForm):
-    mean_radius = FloatField('Mean Radius',
-                             validators=[InputRequired(
-                                 message="Mean Radius is required.")])
-    mean_texture = FloatField('Mean Texture',
-                              validators=[InputRequired(
-                                  message="Mean Texture is required.")])
-    mean_perimeter = FloatField('Mean Perimeter',
-                                validators=[InputRequired(
-                                    message="Mean Perimeter is required.")])
-    mean_area = FloatField('Mean Area',
-                           validators=[InputRequired(
-                               message="Mean Area is required.")])
-    mean_smoothness = FloatField('Mean Smoothness',
-                                 validators=[InputRequired(
-                                     message="Mean Smoothness is required.")])
-    mean_compactness = FloatField('Mean Compactness',
-                                  validators=[InputRequired(
-                                      message="Mean Compactness is required."
-                                      )])
-    mean_concavity = FloatField('Mean Concavity',
-                                validators=[InputRequired(
-                                    message="Mean Concavity is required.")])
-    mean_concave_points = FloatField('Mean Concave Points',
-                                     validators=[InputRequired(
-                                         message="Mean Concave Points is"
-                                         "required.")])
-    mean_symmetry = FloatField('Mean Symmetry',
-                               validators=[InputRequired(
-                                   message="Mean Symmetry is required.")])
-    mean_fractal_dimension = FloatField('Mean Fractal Dimension',
-                                        validators=[InputRequired(
-                                            message="Mean Fractal Dimension is"
-                                            "required.")])
-    radius_error = FloatField('Radius Error',
-                              validators=[InputRequired(
-                                  message="Radius Error is required.")])
-    texture_error = FloatField('Texture Error',
-                               validators=[InputRequired(
-                                   message="Texture Error is required.")])
-    perimeter_error = FloatField('Perimeter Error',
-                                 validators=[InputRequired(
-                                     message="Perimeter Error is required.")])
-    area_error = FloatField('Area Error',
-                            validators=[InputRequired(
-                                message="Area Error is required.")])
-    smoothness_error = FloatField('Smoothness Error',
-                                  validators=[InputRequired(
-                                      message="Smoothness Error is required."
-                                      )])
-    compactness_error = FloatField('Compactness Error',
-                                   validators=[InputRequired(
-                                       message="Compactness Error is required."
-                                       )])
-    concavity_error = FloatField('Concavity Error',
-                                 validators=[InputRequired(
-                                     message="Concavity Error is required.")])
-    concave_points_error = FloatField('Concave Points Error',
-                                      validators=[InputRequired(
-                                          message="Concave Points Error is"
-                                          "required.")])
-    symmetry_error = FloatField('Symmetry Error',
-                                validators=[InputRequired(
-                                    message="Symmetry Error is required.")])
-    fractal_dimension_error = FloatField('Fractal Dimension Error',
-                                         validators=[InputRequired(
-                                             message="Fractal Dimension Error"
-                                             "is required.")])
-    worst_radius = FloatField('Worst Radius',
-                              validators=[InputRequired(
-                                  message="Worst Radius is required.")])
-    worst_texture = FloatField('Worst Texture',
-                               validators=[InputRequired(
-                                   message="Worst Texture is required.")])
-    worst_perimeter = FloatField('Worst Perimeter',
-                                 validators=[InputRequired(
-                                     message="Worst Perimeter is required.")])
-    worst_area = FloatField('Worst Area',
-                            validators=[InputRequired(
-                                message="Worst Area is required.")])
-    worst_smoothness = FloatField('Worst Smoothness',
-                                  validators=[InputRequired(
-                                      message="Worst Smoothness is required."
-                                      )])
-    worst_compactness = FloatField('Worst Compactness',
-                                   validators=[InputRequired(
-                                       message="Worst Compactness is required."
-                                        )])
-    worst_concavity = FloatField('Worst Concavity',
-                                 validators=[InputRequired(
-                                     message="Worst Concavity is required.")])
-    worst_concave_points = FloatField('Worst Concave Points',
-                                      validators=[InputRequired(
-                                          message="Worst Concave Points is"
-                                          "required.")])
-    worst_symmetry = FloatField('Worst Symmetry',
-                                validators=[InputRequired(
-                                    message="Worst Symmetry is required.")])
-    worst_fractal_dimension = FloatField('Worst Fractal Dimension',
-                                         validators=[InputRequired(
-                                             message="Worst Fractal Dimension"
-                                             "is required.")])
-
-    submit = SubmitField('Submit')
+    """
+    One required number per feature of the schema, in model order
+    """
+
+
+for feature in FEATURES:
+    setattr(CancerDiagnosisForm, feature.name, FloatField(
+        feature.label, validators=[
+            InputRequired(message=f"{feature.label} is required."),
+            NumberRange(-MAX_VALUE, MAX_VALUE,
+                        message=f"{feature.label} is out of range.")]))
+CancerDiagnosisForm.submit = SubmitField('Submit')
+
+
+class UploadForm(FlaskForm):
+    file = FileField('CSV File', validators=[
+        FileRequired(message="Please choose a CSV file."),
+        FileAllowed(['csv'], message="Only .csv files can be uploaded.")
+    ])
+
+    submit = SubmitField('Upload')
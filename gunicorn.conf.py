@@ -0,0 +1,64 @@
+import os
+
+
+def env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+# Pre-fork server: N worker processes with T threads each
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = env_int('GUNICORN_WORKERS', (os.cpu_count() or 1) * 2 + 1)
+threads = env_int('GUNICORN_THREADS', 4)
+worker_class = 'gthread'
+
+# Load the app and model in the master so workers share them copy-on-write
+preload_app = True
+
+# Recycle workers gracefully after a number of requests (with jitter so
+# they do not all restart at once), and bound how long a request may take
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 10000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 1000)
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def on_starting(server):
+    from metrics import MetricsRegistry
+    from models.model import drift_monitor
+
+    # Counters restart with the server, drop the previous run's snapshots
+    MetricsRegistry(os.getenv('METRICS_DIR')).clear_directory()
+    if drift_monitor is not None:
+        drift_monitor.clear_directory()
+
+
+def post_fork(server, worker):
+    from app import app
+    from database import db
+    from models.model import registry, RELOAD_INTERVAL
+
+    # Never reuse database connections opened by the master
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    # Background threads do not survive fork(), restart them per worker
+    if RELOAD_INTERVAL > 0:
+        registry.watch(RELOAD_INTERVAL)
+
+
+def worker_exit(server, worker):
+    from app import drift_monitor, metrics, password_hasher, write_behind
+
+    # Commit the rows still buffered before the worker goes away
+    if write_behind is not None:
+        write_behind.close()
+    password_hasher.close()
+    # Leave the final counts for the workers that are still serving
+    metrics.write_snapshot()
+    if drift_monitor is not None:
+        drift_monitor.write_snapshot()
@@ -0,0 +1,167 @@
+import base64
+import binascii
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import select, or_, and_
+from database import db, CancerDiagnosis, FEATURE_COLUMNS
+from feature_storage import expand_row
+
+
+# Only the columns the history page shows, plus the keyset
+HISTORY_COLUMNS = (
+    CancerDiagnosis.id,
+    CancerDiagnosis.created_at,
+    *(getattr(CancerDiagnosis, name) for name in FEATURE_COLUMNS),
+    CancerDiagnosis.features,
+    CancerDiagnosis.diagnosis_result,
+)
+
+
+def encode_cursor(row):
+    """
+    Opaque cursor pointing just after ``row``
+    """
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid history cursor: {cursor!r}")
+
+
+def history_page(user_id, cursor=None, limit=50):
+    """
+    One page of a user's diagnoses, newest first
+
+    Uses keyset pagination on ``(created_at, id)``, so every page is an index
+    range scan of ``limit`` rows, however much history the user has.
+    Returns ``(rows, next_cursor)`` with every row as a dict of the shown
+    columns; ``next_cursor`` is None on the last page.
+    """
+    query = select(*HISTORY_COLUMNS)\
+        .where(CancerDiagnosis.user_id == user_id)\
+        .order_by(CancerDiagnosis.created_at.desc(),
+                  CancerDiagnosis.id.desc())\
+        .limit(limit + 1)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(or_(
+            CancerDiagnosis.created_at < created_at,
+            and_(CancerDiagnosis.created_at == created_at,
+                 CancerDiagnosis.id < row_id)))
+
+    rows = [expand_row(row) for row in db.session.execute(query)]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def history_version(user_id):
+    """
+    ``(id, created_at)`` of the user's newest diagnosis, None without any
+
+    It changes whenever a diagnosis is added, so it versions everything
+    the history pages show. One probe of the history index, however much
+    history the user has.
+    """
+    row = db.session.execute(
+        select(CancerDiagnosis.id, CancerDiagnosis.created_at)
+        .where(CancerDiagnosis.user_id == user_id)
+        .order_by(CancerDiagnosis.created_at.desc(),
+                  CancerDiagnosis.id.desc())
+        .limit(1)).first()
+    return tuple(row) if row is not None else None
+
+
+def template_fingerprint(app, *names):
+    """
+    Digest of the source of templates, so a deploy that changes how the
+    history renders also changes its ETags
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for name in names:
+        source, _, _ = app.jinja_loader.get_source(app.jinja_env, name)
+        digest.update(source.encode())
+    return digest.hexdigest()
+
+
+def history_etag(user_id, version, page, salt=''):
+    """
+    Entity tag of one history page of a user at ``version``
+    """
+    raw = f"{salt}|{user_id}|{version}|{page}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+class FragmentCache:
+    """
+    Size-bounded LRU cache of rendered history fragments of one process
+
+    Entries are keyed by user and page and hold the history version they
+    were rendered for, so a fragment is never served once the user has a
+    newer diagnosis, whichever process inserted it. ``discard()`` frees a
+    user's fragments as soon as this process inserts for them.
+    """
+
+    def __init__(self, max_bytes):
+        # Sizes are counted in characters, the same as bytes for the ASCII
+        # markup of the history table
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, page, version):
+        key = (user_id, page)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, page, version, fragment):
+        if len(fragment) > self.max_bytes:
+            return
+        key = (user_id, page)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (version, fragment)
+            self._pages.setdefault(user_id, set()).add(page)
+            self.size += len(fragment)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, user_id):
+        with self._lock:
+            for page in list(self._pages.get(user_id, ())):
+                self._remove((user_id, page))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry[1])
+        pages = self._pages[key[0]]
+        pages.discard(key[1])
+        if not pages:
+            del self._pages[key[0]]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size,
+                    'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses}
@@ -0,0 +1,82 @@
+import threading
+import time
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from database import db, User
+
+
+class UserCache:
+    """
+    Short-TTL cache of users' column values across requests of one process
+
+    Only plain column values are kept, so nothing is tied to a finished
+    request's session. Entries are dropped when this process updates or
+    deletes the user; other processes see the change after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            return entry[0]
+
+    def set(self, user):
+        values = {attribute.key: getattr(user, attribute.key)
+                  for attribute in inspect(User).column_attrs}
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[user.id] = (values, time.monotonic() + self.ttl)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+def attach_cached_user(values):
+    """
+    Put a cached user into the current session without querying the database
+    """
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_user(user_id=None, username=None, cache=None):
+    """
+    Load a user by id (or by username for sessions created before ids were
+    stored in them), going through ``cache`` when one is given
+    """
+    if user_id is not None:
+        values = cache.get(user_id) if cache is not None else None
+        if values is not None:
+            return attach_cached_user(values)
+        user = db.session.get(User, user_id)
+    elif username is not None:
+        user = User.query.filter_by(username=username).first()
+    else:
+        return None
+    if user is not None and cache is not None:
+        cache.set(user)
+    return user
+
+
+def invalidate_on_change(cache):
+    """
+    Drop users from ``cache`` whenever this process updates or deletes them
+    """
+    def discard(mapper, connection, target):
+        cache.discard(target.id)
+
+    event.listen(User, 'after_update', discard)
+    event.listen(User, 'after_delete', discard)
@@ -0,0 +1,308 @@
+import atexit
+import bisect
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from flask import request
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds; request stages range from microseconds (validation) to seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Snapshot files of dead workers are folded into this one
+ARCHIVE_FILE = 'metrics-archive.json'
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _write_json(path, data):
+    # Write a file of this call's own then rename it, so readers never see
+    # a partial file and concurrent writers never share one
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.",
+        suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def _label_text(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"')
+               .replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value
+                          in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """
+    Monotonic count per label values
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value]
+                    for labels, value in self._values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def render(self, samples):
+        for labels, value in sorted(samples.items()):
+            yield (f"{self.name}"
+                   f"{_label_text(self.labelnames, labels)} {value}")
+
+
+class Histogram:
+    """
+    Observations counted into fixed buckets, plus their sum, per label values
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # Non-cumulative counts, the last one for +Inf, then the sum
+                entry = self._values[labels] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(entry)]
+                    for labels, entry in self._values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self, samples):
+        bounds = [*(repr(float(bucket)) for bucket in self.buckets), '+Inf']
+        for labels, entry in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, entry):
+                cumulative += count
+                text = _label_text(self.labelnames, labels, [('le', bound)])
+                yield f"{self.name}_bucket{text} {cumulative}"
+            text = _label_text(self.labelnames, labels)
+            yield f"{self.name}_sum{text} {entry[-1]}"
+            yield f"{self.name}_count{text} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process, aggregated with other workers through files
+
+    With a ``directory``, every process writes a snapshot of its metrics to
+    ``metrics-<pid>.json`` every ``flush_interval`` seconds and before it
+    is scraped; ``render()`` then sums the snapshots of all processes, so
+    any worker can answer for the whole server. Snapshots of workers that
+    are gone are folded into one archive file, so counters never go back.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        return {name: metric.snapshot()
+                for name, metric in self.metrics.items()}
+
+    # Aggregation across worker processes
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def ensure_started(self):
+        """
+        Start writing snapshots from this process, once per worker
+        """
+        # Threads do not survive fork(), so every worker starts its own
+        if self.directory is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+
+            def run():
+                while True:
+                    time.sleep(self.flush_interval)
+                    try:
+                        self.write_snapshot()
+                    except Exception:
+                        # Keep flushing; the next tick may succeed
+                        logger.exception("Writing the metrics snapshot "
+                                         "failed")
+
+            threading.Thread(target=run, name='metrics-writer',
+                             daemon=True).start()
+        atexit.register(self.write_snapshot)
+
+    def write_snapshot(self):
+        if self.directory is None:
+            return
+        _write_json(self._path(os.getpid()), self.snapshot())
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _merge_into(self, totals, snapshot):
+        for name, samples in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            merged = totals.setdefault(name, {})
+            for labels, value in samples:
+                labels = tuple(labels)
+                merged[labels] = metric.merge(merged.get(labels), value)
+
+    def collect(self):
+        """
+        Metric values summed over every process sharing the directory
+        """
+        if self.directory is None:
+            totals = {}
+            self._merge_into(totals, self.snapshot())
+            return totals
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.write_snapshot()
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            # One process at a time folds dead workers into the archive
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+            archive = {}
+            self._merge_into(archive, self._read(archive_path))
+            live, dead = [], []
+            for filename in os.listdir(self.directory):
+                pid = filename[len('metrics-'):-len('.json')]
+                if not (filename.startswith('metrics-')
+                        and filename.endswith('.json') and pid.isdigit()):
+                    continue
+                path = os.path.join(self.directory, filename)
+                (live if _is_alive(int(pid)) else dead).append(path)
+            if dead:
+                for path in dead:
+                    self._merge_into(archive, self._read(path))
+                _write_json(archive_path, {
+                    name: [[list(labels), value]
+                           for labels, value in samples.items()]
+                    for name, samples in archive.items()})
+                for path in dead:
+                    os.remove(path)
+
+        totals = archive
+        for path in live:
+            self._merge_into(totals, self._read(path))
+        return totals
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        totals = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(totals.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+    def clear_directory(self):
+        """
+        Remove the snapshots of a previous run of the server
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.startswith('metrics-'):
+                os.remove(os.path.join(self.directory, filename))
+
+
+def stage_timer(histogram, enabled=True):
+    """
+    ``stage(name)`` times one stage of the current request's endpoint
+    """
+    if not enabled:
+        disabled = nullcontext()
+        return lambda name: disabled
+
+    def stage(name):
+        return histogram.time(request.endpoint, name)
+    return stage
@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Merge concurrent single-row predictions into one model call
+
+    Callers enqueue a row and wait on a future. A dispatcher thread collects
+    rows until either ``max_batch_size`` rows are waiting or the oldest row
+    has waited ``max_wait`` seconds, scores them as one matrix and hands every
+    caller its own slice of the result. Rows submitted with extra arguments
+    (such as the model pinned by the caller) are only batched with rows
+    sharing the same ones, and scored with ``predict_fn(rows, *args)``.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait=0.002):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._requests = 0
+            self._batches = 0
+            self._largest_batch = 0
+            self._queue_wait_total = 0.0
+            self._queue_wait_max = 0.0
+
+    def stats(self):
+        """
+        Batch size and queue wait counters since the last reset
+        """
+        with self._lock:
+            batches = self._batches or 1
+            requests = self._requests or 1
+            return {
+                'requests': self._requests,
+                'batches': self._batches,
+                'mean_batch_size': self._requests / batches,
+                'max_batch_size': self._largest_batch,
+                'mean_queue_wait_ms': self._queue_wait_total / requests * 1e3,
+                'max_queue_wait_ms': self._queue_wait_max * 1e3,
+            }
+
+    def submit(self, row, *args):
+        """
+        Enqueue one feature vector and return a future for its prediction
+        """
+        future = Future()
+        self._ensure_started().put((row, args, future, time.perf_counter()))
+        return future
+
+    def predict(self, row, *args, timeout=None):
+        return self.submit(row, *args).result(timeout)
+
+    def close(self):
+        """
+        Stop the dispatcher after the rows already queued are scored
+        """
+        with self._lock:
+            thread, work_queue = self._thread, self._queue
+            self._thread = self._queue = None
+        if thread is not None and self._pid == os.getpid():
+            work_queue.put(None)
+            thread.join()
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so a pre-forked worker starts its
+        # own dispatcher the first time it submits a row
+        if self._thread is not None and self._pid == os.getpid():
+            return self._queue
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run,
+                                                args=(self._queue,),
+                                                name='micro-batcher',
+                                                daemon=True)
+                self._thread.start()
+            return self._queue
+
+    def _run(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # The window starts when the oldest row was enqueued
+            deadline = item[3] + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        item = work_queue.get(timeout=remaining)
+                    else:
+                        item = work_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+            if stop:
+                return
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        waits = [started - enqueued for _, _, _, enqueued in batch]
+        with self._lock:
+            self._requests += len(batch)
+            self._batches += 1
+            self._largest_batch = max(self._largest_batch, len(batch))
+            self._queue_wait_total += sum(waits)
+            self._queue_wait_max = max(self._queue_wait_max, max(waits))
+        # One model call per distinct set of arguments, in arrival order
+        groups = {}
+        for item in batch:
+            key = tuple(id(arg) for arg in item[1])
+            groups.setdefault(key, []).append(item)
+        for group in groups.values():
+            self._score(group)
+
+    def _score(self, batch):
+        try:
+            input_rows = np.vstack([
+                np.asarray(row, dtype=np.float64).reshape(1, -1)
+                for row, _, _, _ in batch])
+            predictions = self.predict_fn(input_rows, *batch[0][1])
+        except Exception as error:
+            if len(batch) > 1:
+                # Do not fail every caller because of one malformed row
+                for item in batch:
+                    self._score([item])
+                return
+            for _, _, future, _ in batch:
+                future.set_exception(error)
+            return
+
+        for index, (_, _, future, _) in enumerate(batch):
+            future.set_result(predictions[index:index + 1])
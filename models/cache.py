@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def model_version(path):
+    """
+    Content hash identifying a model artifact
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class SQLiteCacheBackend:
+    """
+    Prediction store in a local SQLite file shared by worker processes
+    """
+
+    # Expired rows are purged once every this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL)")
+
+    def _connection(self):
+        # sqlite3 connections must not be shared across threads or forks
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM predictions WHERE key = ? AND expires_at > ?",
+            (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.ttl))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                connection.execute(
+                    "DELETE FROM predictions WHERE expires_at <= ?",
+                    (time.time(),))
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM predictions")
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predictions with a per-entry TTL
+
+    Keys combine the canonicalized feature vector with the model version, so
+    entries computed by another model can never be returned. When
+    ``decimals`` is set, features are rounded before hashing so that nearly
+    identical resubmissions share an entry. An optional shared ``backend``
+    lets several worker processes reuse each other's results.
+    """
+
+    def __init__(self, max_entries=4096, ttl=300, decimals=None,
+                 backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.decimals = decimals
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._shared_hits = 0
+        self._evictions = self._expirations = 0
+
+    def key(self, input_data, version):
+        values = np.asarray(input_data, dtype=np.float64).reshape(-1)
+        if self.decimals is not None:
+            values = np.round(values, self.decimals)
+        # Adding 0.0 folds -0.0 into 0.0 so both hash the same
+        values = np.ascontiguousarray(values + 0.0)
+        digest = hashlib.blake2b(values.tobytes(), digest_size=16)
+        return f"{version}:{digest.hexdigest()}"
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+                self._expirations += 1
+
+        value = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._shared_hits += 1
+        self._store(key, value)
+        return value
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry, e.g. after the model has been reloaded
+        """
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'shared_hits': self._shared_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
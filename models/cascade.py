@@ -0,0 +1,60 @@
+import threading
+import numpy as np
+
+
+class Cascade:
+    """
+    Answer from a compact fast-tier model, escalating to the full forest
+
+    The fast model's probability of label 1 stands unless it lies inside
+    the uncertainty band ``[low, high]``; only those rows are scored again
+    by the full model passed to each call, so the full forest can be
+    swapped by the registry without touching the cascade.
+    """
+
+    def __init__(self, fast, low=0.2, high=0.8):
+        if not 0.0 <= low <= 0.5 <= high <= 1.0:
+            raise ValueError(f"Invalid uncertainty band [{low}, {high}]")
+        self.fast = fast
+        self.low = low
+        self.high = high
+        self._positive = np.flatnonzero(fast.classes_ == 1)[0]
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.escalated = 0
+        self.trees = 0
+
+    def predict_proba(self, input_rows, full):
+        """
+        Probability of label 1 for every row
+        """
+        input_rows = np.asarray(input_rows, dtype=np.float64)
+        probabilities = self.fast.predict_proba(input_rows)[:, self._positive]
+        uncertain = np.flatnonzero((probabilities >= self.low)
+                                   & (probabilities <= self.high))
+        if len(uncertain):
+            positive = np.flatnonzero(full.classes_ == 1)[0]
+            probabilities[uncertain] = \
+                full.predict_proba(input_rows[uncertain])[:, positive]
+        with self._lock:
+            self.rows += len(input_rows)
+            self.escalated += len(uncertain)
+            self.trees += (len(input_rows) * self.fast.n_estimators
+                           + len(uncertain) * full.n_estimators)
+        return probabilities
+
+    def predict(self, input_rows, full):
+        """
+        Labels, decided the way the forests decide them (ties go to 0)
+        """
+        probabilities = self.predict_proba(input_rows, full)
+        return full.classes_.take((probabilities > 0.5).astype(np.intp))
+
+    def stats(self):
+        with self._lock:
+            rows = self.rows
+            return {'band': [self.low, self.high],
+                    'fast_trees': self.fast.n_estimators,
+                    'rows': rows, 'escalated': self.escalated,
+                    'escalation_rate': self.escalated / rows if rows else 0.0,
+                    'trees_per_row': self.trees / rows if rows else 0.0}
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+
+# Packed arrays written by CompiledForest.save(), in manifest order
+ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'value', 'roots',
+               'classes')
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+
+
+class CompiledForest:
+    """
+    Array-backed evaluator for a fitted ``RandomForestClassifier``
+
+    Every estimator's ``tree_`` is flattened into one set of packed node
+    arrays, so a row (or a small batch) is routed through all trees at once
+    with a few vectorized NumPy operations per tree level instead of going
+    through sklearn's per-estimator ``predict`` path. Leaves point to
+    themselves, which lets the traversal run a fixed number of steps.
+    Predictions match the wrapped forest exactly for finite inputs.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots,
+                 max_depth, classes, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.n_features_in_ = int(n_features)
+        self.n_estimators = len(roots)
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Flatten the trees of a fitted forest into packed arrays
+        """
+        features, thresholds, lefts, rights, values, roots = \
+            [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count, dtype=np.intp)
+            is_leaf = tree.children_left == -1
+
+            # Leaves loop back onto themselves and always "go left"
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, nodes, tree.children_left)
+                         + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right)
+                          + offset)
+
+            # Normalize leaf values the same way DecisionTreeClassifier does
+            value = tree.value[:, 0, :model.n_classes_]
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features),
+                                         dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds),
+                                           dtype=np.float64),
+            left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.intp),
+            right=np.ascontiguousarray(np.concatenate(rights),
+                                       dtype=np.intp),
+            value=np.ascontiguousarray(np.concatenate(values),
+                                       dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max(estimator.tree_.max_depth
+                          for estimator in model.estimators_),
+            classes=model.classes_,
+            n_features=model.n_features_in_,
+        )
+
+    def save(self, directory, source=None):
+        """
+        Write the packed arrays as uncompressed ``.npy`` files plus a manifest
+
+        Every array gets its own file, and so its own page-aligned mapping,
+        which lets ``load(..., mmap=True)`` share the pages between all
+        processes on a host.
+        """
+        os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        for name in ARRAY_NAMES:
+            array = np.ascontiguousarray(self._array(name))
+            if array.dtype == np.intp:
+                # Fixed width so artifacts are portable between platforms
+                array = array.astype(np.int64)
+            filename = f"{name}.npy"
+            path = os.path.join(directory, filename)
+            np.save(path, array, allow_pickle=False)
+            with open(path, 'rb') as f:
+                checksum = hashlib.sha256(f.read()).hexdigest()
+            arrays[name] = {'file': filename, 'dtype': array.dtype.str,
+                            'shape': list(array.shape), 'sha256': checksum}
+
+        manifest = {'format_version': FORMAT_VERSION,
+                    'source': source,
+                    'n_features': self.n_features_in_,
+                    'n_estimators': self.n_estimators,
+                    'max_depth': self.max_depth,
+                    'arrays': arrays}
+        # Written last, so a directory with a manifest is always complete
+        with open(os.path.join(directory, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load arrays written by ``save()``, memory-mapped read-only by default
+        """
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled model format in "
+                             f"{directory}: {manifest.get('format_version')}")
+
+        arrays = {}
+        for name in ARRAY_NAMES:
+            entry = manifest['arrays'][name]
+            array = np.load(os.path.join(directory, entry['file']),
+                            mmap_mode='r' if mmap else None,
+                            allow_pickle=False)
+            if list(array.shape) != entry['shape']:
+                raise ValueError(f"{entry['file']} has shape {array.shape}, "
+                                 f"expected {entry['shape']}")
+            arrays[name] = array
+
+        return cls(max_depth=manifest['max_depth'],
+                   n_features=manifest['n_features'],
+                   classes=np.array(arrays.pop('classes')),
+                   **arrays)
+
+    def _array(self, name):
+        return self.classes_ if name == 'classes' else getattr(self, name)
+
+    def apply(self, input_rows):
+        """
+        Return the global leaf index reached in every tree, shape
+        ``(n_trees, n_samples)``
+        """
+        # sklearn compares float32 inputs against float64 thresholds
+        input_rows = np.asarray(input_rows, dtype=np.float32)
+        if input_rows.ndim == 1:
+            input_rows = input_rows.reshape(1, -1)
+        n_samples, n_features = input_rows.shape
+        if n_features != self.n_features_in_:
+            raise ValueError(f"X has {n_features} features, but the forest "
+                             f"expects {self.n_features_in_} features")
+        flat = input_rows.ravel()
+        row_offsets = (np.arange(n_samples, dtype=np.intp)
+                       * n_features)[np.newaxis, :]
+
+        nodes = np.repeat(self.roots[:, np.newaxis], n_samples, axis=1)
+        for _ in range(self.max_depth):
+            values = flat.take(row_offsets + self.feature.take(nodes))
+            nodes = np.where(values <= self.threshold.take(nodes),
+                             self.left.take(nodes), self.right.take(nodes))
+        return nodes
+
+    def predict_proba(self, input_rows):
+        # Summing over the leading tree axis accumulates tree by tree, in the
+        # same order and precision as RandomForestClassifier.predict_proba
+        probabilities = self.value[self.apply(input_rows)].sum(axis=0)
+        probabilities /= self.n_estimators
+        return probabilities
+
+    def predict(self, input_rows):
+        return self.classes_.take(
+            np.argmax(self.predict_proba(input_rows), axis=1))
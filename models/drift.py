@@ -0,0 +1,367 @@
+# Streaming input-drift monitor for the model's feature vectors
+#
+# Build the reference profile of the shipped model, from the repository
+# root (models/train_model.py saves one next to every version it writes):
+#   python -m models.drift [--bins 10] [--output PATH]
+import argparse
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Population stability index levels, as commonly read
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+# Snapshot files of dead workers are folded into this one
+ARCHIVE_FILE = 'drift-archive.json'
+# The totals and report of the last scheduled check
+LAST_CHECK_FILE = 'drift-last.json'
+# Added to empty bins so PSI stays finite
+EPSILON = 1e-4
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def build_profile(X, names, bins=10):
+    """
+    Reference profile of training rows ``X``: per feature, quantile bin
+    edges, the share of rows in every bin, and the mean and std
+    """
+    X = np.asarray(X, dtype=np.float64)
+    quantiles = np.linspace(0.0, 1.0, bins + 1)[1:-1]
+    edges = np.quantile(X, quantiles, axis=0).T
+    sketch = FeatureSketch(edges)
+    sketch.update(X)
+    return {'features': list(names), 'rows': len(X),
+            'edges': edges.tolist(),
+            'expected': (sketch.counts / len(X)).tolist(),
+            'mean': X.mean(axis=0).tolist(), 'std': X.std(axis=0).tolist()}
+
+
+def load_profile(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class FeatureSketch:
+    """
+    Fixed-bin histogram and moments of every feature, in constant memory
+
+    Every field is a sum, so the sketches of several processes (or time
+    windows) merge by adding them up, and subtracting two cumulative
+    snapshots gives the window between them.
+    """
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        features = self.edges.shape[0]
+        # Rows at or above every edge, edge-major so that one row updates
+        # them with an elementwise add: cheaper than binning it
+        self._edges = np.ascontiguousarray(self.edges.T)
+        self._at_least = np.zeros(self._edges.shape, dtype=np.int64)
+        self.rows = 0
+        self.sums = np.zeros(features)
+        self.squares = np.zeros(features)
+        self._lock = threading.Lock()
+
+    def update(self, input_rows):
+        input_rows = np.asarray(input_rows, dtype=np.float64)
+        if input_rows.ndim == 1:
+            reached = input_rows >= self._edges
+            squares = input_rows * input_rows
+            with self._lock:
+                self._at_least += reached
+                self.rows += 1
+                self.sums += input_rows
+                self.squares += squares
+            return
+        reached = (input_rows[:, np.newaxis, :] >= self._edges).sum(axis=0)
+        with self._lock:
+            self._at_least += reached
+            self.rows += len(input_rows)
+            self.sums += input_rows.sum(axis=0)
+            self.squares += np.square(input_rows).sum(axis=0)
+
+    def _counts(self, at_least, rows):
+        return -np.diff(at_least.T, axis=1, prepend=rows, append=0)
+
+    @property
+    def counts(self):
+        """
+        Rows in every bin, one row of bins per feature
+        """
+        with self._lock:
+            return self._counts(self._at_least.copy(), self.rows)
+
+    def snapshot(self):
+        with self._lock:
+            at_least, rows = self._at_least.copy(), self.rows
+            sums, squares = self.sums.tolist(), self.squares.tolist()
+        return {'rows': rows, 'counts': self._counts(at_least, rows).tolist(),
+                'sums': sums, 'squares': squares}
+
+
+def merge(first, second, sign=1):
+    """
+    Sum (or, with ``sign=-1``, difference) of two sketch snapshots
+    """
+    if not first:
+        return second
+    if not second:
+        return first
+    return {'rows': first['rows'] + sign * second['rows'],
+            **{key: (np.asarray(first[key])
+                     + sign * np.asarray(second[key])).tolist()
+               for key in ('counts', 'sums', 'squares')}}
+
+
+def compare(snapshot, profile):
+    """
+    PSI and binned KS distance of every feature against the profile
+    """
+    rows = snapshot['rows'] if snapshot else 0
+    report = {'rows': rows, 'features': {}, 'drifted': []}
+    if not rows:
+        return report
+    actual = np.asarray(snapshot['counts']) / rows
+    expected = np.asarray(profile['expected'])
+    smoothed_actual = np.maximum(actual, EPSILON)
+    smoothed_expected = np.maximum(expected, EPSILON)
+    psi = ((smoothed_actual - smoothed_expected)
+           * np.log(smoothed_actual / smoothed_expected)).sum(axis=1)
+    # Largest gap between the two CDFs at the bin edges
+    ks = np.abs(np.cumsum(actual - expected, axis=1)).max(axis=1)
+    means = np.asarray(snapshot['sums']) / rows
+    for index, name in enumerate(profile['features']):
+        if psi[index] >= PSI_SIGNIFICANT:
+            status = 'significant'
+            report['drifted'].append(name)
+        elif psi[index] >= PSI_MODERATE:
+            status = 'moderate'
+        else:
+            status = 'stable'
+        report['features'][name] = {
+            'psi': float(psi[index]), 'ks': float(ks[index]),
+            'mean': float(means[index]),
+            'reference_mean': profile['mean'][index], 'status': status}
+    return report
+
+
+class DriftMonitor:
+    """
+    Sketch every scored feature vector and compare them with a reference
+
+    ``observe()`` costs a few vectorized NumPy operations per call. With a
+    ``directory`` shared by the worker processes, each one writes its
+    cumulative sketch there every ``interval`` seconds and the reports
+    cover all of them. Every ``interval`` one process compares the window
+    since the previous check with the reference and logs the result.
+    """
+
+    def __init__(self, profile, directory=None, interval=60.0):
+        self.profile = profile
+        self.directory = directory
+        self.interval = interval
+        self.sketch = FeatureSketch(profile['edges'])
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def observe(self, input_rows):
+        self.ensure_started()
+        self.sketch.update(input_rows)
+
+    def ensure_started(self):
+        """
+        Start the scheduled checks of this process, once per worker
+        """
+        # Threads do not survive fork(), so every worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+            def run():
+                while True:
+                    time.sleep(self.interval)
+                    try:
+                        # Every worker publishes its sketch on every tick,
+                        # whichever of them runs the check
+                        self.write_snapshot()
+                        self.check()
+                    except Exception:
+                        logger.exception("Drift check failed")
+
+            threading.Thread(target=run, name='drift-monitor',
+                             daemon=True).start()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"drift-{pid}.json")
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, path, data):
+        # Write a file of this call's own then rename it, so readers never
+        # see a partial file and the tick thread and requests never share one
+        descriptor, temporary = tempfile.mkstemp(
+            dir=self.directory, prefix=f"{os.path.basename(path)}.",
+            suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                json.dump(data, f)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def write_snapshot(self):
+        if self.directory is not None:
+            self._write(self._path(os.getpid()), self.sketch.snapshot())
+
+    def clear_directory(self):
+        """
+        Remove the sketches and checks of a previous run of the server
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.startswith('drift-'):
+                os.remove(os.path.join(self.directory, filename))
+
+    @contextmanager
+    def _exclusive(self):
+        # Serialize collections and checks across threads and processes
+        if self.directory is None:
+            with self._lock:
+                yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _collect(self):
+        if self.directory is None:
+            return self.sketch.snapshot()
+        self.write_snapshot()
+        archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+        totals = archive = self._read(archive_path)
+        dead = []
+        for filename in os.listdir(self.directory):
+            pid = filename[len('drift-'):-len('.json')]
+            if not (filename.startswith('drift-')
+                    and filename.endswith('.json') and pid.isdigit()):
+                continue
+            path = os.path.join(self.directory, filename)
+            snapshot = self._read(path)
+            totals = merge(totals, snapshot)
+            if not _is_alive(int(pid)):
+                archive = merge(archive, snapshot)
+                dead.append(path)
+        if dead:
+            self._write(archive_path, archive)
+            for path in dead:
+                os.remove(path)
+        return totals
+
+    def collect(self):
+        """
+        Sketch totals of every process sharing the directory
+        """
+        with self._exclusive():
+            return self._collect()
+
+    def _read_last(self):
+        if self.directory is None:
+            return self._last
+        return self._read(os.path.join(self.directory, LAST_CHECK_FILE))
+
+    def check(self, force=False):
+        """
+        Compare the window since the previous check with the reference and
+        log it, unless another process did so less than ``interval`` ago;
+        returns the window's report, or None when skipped
+        """
+        with self._exclusive():
+            return self._check(force)
+
+    def _check(self, force):
+        last = self._read_last()
+        now = time.time()
+        if not force and now - last.get('time', 0) < self.interval * 0.9:
+            return None
+        totals = self._collect()
+        window = merge(totals, last.get('totals'), sign=-1)
+        report = compare(window, self.profile)
+        report.update(start=last.get('time'), end=now)
+        checked = {'time': now, 'totals': totals, 'report': report}
+        if self.directory is None:
+            self._last = checked
+        else:
+            self._write(os.path.join(self.directory, LAST_CHECK_FILE),
+                        checked)
+        if report['drifted']:
+            logger.warning("Input drift in %d rows: %s", report['rows'],
+                           ', '.join(report['drifted']))
+        else:
+            logger.info("No input drift in %d rows", report['rows'])
+        return report
+
+    def report(self):
+        """
+        Drift since start and over the last checked window
+        """
+        totals = self.collect()
+        return {'cumulative': compare(totals, self.profile),
+                'window': self._read_last().get('report'),
+                'interval': self.interval}
+
+
+def main():
+    from sklearn.datasets import load_breast_cancer
+    from sklearn.model_selection import train_test_split
+
+    parser = argparse.ArgumentParser(
+        description="Build the drift reference profile of the training data")
+    parser.add_argument('--bins', type=int, default=10)
+    parser.add_argument('--output', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'reference_profile.json'))
+    args = parser.parse_args()
+
+    # The training split of models/train_model.py
+    data = load_breast_cancer()
+    X_train, _, _, _ = train_test_split(data.data, data.target,
+                                        test_size=0.2, random_state=42)
+    profile = build_profile(X_train, data.feature_names, args.bins)
+    with open(args.output, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"Saved the profile of {profile['rows']} rows to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# Export a pickled forest to the memory-mapped compiled format
+#
+# Usage, from the repository root:
+#   python -m models.export_model [--model PATH] [--output DIRECTORY]
+#
+# The output directory can be served as a registry version, e.g. exporting
+# to models/versions/compiled and running `flask model activate compiled`.
+import argparse
+import os
+import pickle
+import numpy as np
+from sklearn.datasets import load_breast_cancer
+from models.cache import model_version
+from models.compiled import CompiledForest
+
+
+models_dir = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(
+    description="Export a pickled forest to memory-mappable arrays")
+parser.add_argument('--model', default=os.path.join(
+    models_dir, 'cancer_diagnosis_model.pkl'))
+parser.add_argument('--output', default=os.path.join(
+    models_dir, 'versions', 'compiled'))
+args = parser.parse_args()
+
+# Loading the pickled forest and flattening its trees
+with open(args.model, 'rb') as f:
+    model = pickle.load(f)
+compiled = CompiledForest.from_model(model)
+
+# Writing the arrays and the manifest
+manifest = compiled.save(args.output, source=model_version(args.model))
+
+# Checking the mapped arrays reproduce the forest exactly
+X = load_breast_cancer().data
+mapped = CompiledForest.load(args.output)
+exact = np.array_equal(mapped.predict_proba(X), model.predict_proba(X))
+
+size = sum(os.path.getsize(os.path.join(args.output, entry['file']))
+           for entry in manifest['arrays'].values())
+print(f"exported {manifest['n_estimators']} trees "
+      f"({size / 1024:.1f} KiB) to {args.output}, exact match: {exact}")
@@ -0,0 +1,146 @@
+# Build the compact fast-tier model served in front of the full forest
+#
+# Usage, from the repository root:
+#   python -m models.fast_tier [--model PATH] [--trees N]
+#                              [--low P] [--high P] [--output PATH]
+#
+# Picks the --trees trees of the full forest whose average agrees best
+# with the whole forest on the training split (greedy forward selection),
+# and pickles them as a RandomForestClassifier of their own. The report
+# compares the full forest, the fast tier alone and the cascade (fast
+# tier, escalating rows whose probability lies in [--low, --high]) on the
+# holdout split: accuracy, agreement with the full forest, trees evaluated
+# per row and single-row latency. Serve it with MODEL_CASCADE=1.
+import argparse
+import copy
+import json
+import os
+import pickle
+import statistics
+import sys
+import time
+import numpy as np
+from sklearn.datasets import load_breast_cancer
+from sklearn.model_selection import train_test_split
+from models.cache import model_version
+from models.cascade import Cascade
+
+
+models_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def select_trees(model, X, count):
+    """
+    Indices of ``count`` trees whose average best reproduces the forest
+
+    Each step adds the tree that maximizes agreement with the forest's
+    labels, then minimizes the mean probability gap.
+    """
+    forest = model.predict_proba(X)[:, 1]
+    labels = forest > 0.5
+    votes = np.array([tree.predict_proba(X)[:, 1]
+                      for tree in model.estimators_])
+    chosen, total = [], np.zeros(len(X))
+    for size in range(1, min(count, len(votes)) + 1):
+        best, best_score = None, None
+        for index in range(len(votes)):
+            if index in chosen:
+                continue
+            average = (total + votes[index]) / size
+            score = (np.mean((average > 0.5) == labels),
+                     -np.mean(np.abs(average - forest)))
+            if best_score is None or score > best_score:
+                best, best_score = index, score
+        chosen.append(best)
+        total += votes[best]
+    return chosen
+
+
+def compact_forest(model, indices):
+    """
+    A forest of only the trees at ``indices`` (sharing them with ``model``)
+    """
+    compact = copy.copy(model)
+    compact.estimators_ = [model.estimators_[index] for index in indices]
+    compact.n_estimators = len(indices)
+    return compact
+
+
+def median_ms(predict, rows):
+    predict(rows[:1])  # warm up
+    timings = []
+    for index in range(len(rows)):
+        started = time.perf_counter()
+        predict(rows[index:index + 1])
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build and evaluate the fast-tier model")
+    parser.add_argument('--model', default=os.path.join(
+        models_dir, 'cancer_diagnosis_model.pkl'))
+    parser.add_argument('--trees', type=int, default=10)
+    parser.add_argument('--low', type=float, default=0.2)
+    parser.add_argument('--high', type=float, default=0.8)
+    parser.add_argument('--output', default=os.path.join(
+        models_dir, 'cancer_diagnosis_fast.pkl'))
+    args = parser.parse_args()
+
+    with open(args.model, 'rb') as f:
+        model = pickle.load(f)
+    # The same split as models/train_model.py, so the holdout is unseen
+    data = load_breast_cancer()
+    X_train, X_test, y_train, y_test = train_test_split(
+        data.data, data.target, test_size=0.2, random_state=42)
+
+    indices = select_trees(model, X_train, args.trees)
+    fast = compact_forest(model, indices)
+    cascade = Cascade(fast, args.low, args.high)
+
+    full_labels = model.predict(X_test)
+    fast_labels = fast.predict(X_test)
+    cascade_labels = cascade.predict(X_test, model)
+    cascade_stats = cascade.stats()
+
+    def scores(labels):
+        return {'accuracy': float(np.mean(labels == y_test)),
+                'agreement': float(np.mean(labels == full_labels))}
+
+    report = {
+        'source': model_version(args.model),
+        'trees': indices,
+        'band': [args.low, args.high],
+        'holdout_rows': len(y_test),
+        'full': {**scores(full_labels), 'trees_per_row': model.n_estimators,
+                 'single_ms': median_ms(model.predict, X_test)},
+        'fast': {**scores(fast_labels), 'trees_per_row': fast.n_estimators,
+                 'single_ms': median_ms(fast.predict, X_test)},
+        'cascade': {**scores(cascade_labels),
+                    'trees_per_row': cascade_stats['trees_per_row'],
+                    'escalation_rate': cascade_stats['escalation_rate'],
+                    'single_ms': median_ms(
+                        lambda rows: cascade.predict(rows, model), X_test)},
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'wb') as f:
+        pickle.dump(fast, f, pickle.HIGHEST_PROTOCOL)
+    report_path = f"{os.path.splitext(args.output)[0]}.json"
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for tier in ('full', 'fast', 'cascade'):
+        result = report[tier]
+        print(f"{tier:<8} accuracy {result['accuracy']:.4f}"
+              f"  agreement {result['agreement']:.4f}"
+              f"  trees/row {result['trees_per_row']:6.1f}"
+              f"  single {result['single_ms']:.2f} ms")
+    print(f"escalated {report['cascade']['escalation_rate']:.1%} of rows; "
+          f"saved {args.output} and {report_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
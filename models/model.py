@@ -1,20 +1,184 @@
 import os
-import pickle
 import numpy as np
+from models.batching import MicroBatcher
+from models.cache import PredictionCache, SQLiteCacheBackend
+from models.cascade import Cascade
+from models.drift import DriftMonitor, load_profile
+from models.registry import ModelRegistry, load_model
+from schema import check_feature_order
 
 
-# Load the trained model from the pickle file
-model_path = os.path.join("models", "cancer_diagnosis_model.pkl")
-with open(model_path, 'rb') as f:
-    model = pickle.load(f)
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+# The trained model shipped with the app
+model_path = os.path.join(MODELS_DIR, "cancer_diagnosis_model.pkl")
+# Directory holding versioned artifacts named <version>.pkl
+REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR',
+                         os.path.join(MODELS_DIR, "versions"))
+# Seconds between checks for a newly published version, 0 to disable (then
+# a version published from /admin reaches only the worker that served it)
+RELOAD_INTERVAL = float(os.getenv('MODEL_RELOAD_INTERVAL', 5))
+
+# "sklearn" calls the forest directly, "compiled" evaluates packed tree arrays
+MODEL_ENGINE = os.getenv('MODEL_ENGINE', 'sklearn')
+
+# Load the trained model (or the published version) and warm it up,
+# refusing artifacts that do not take the features in schema order
+registry = ModelRegistry(REGISTRY_DIR, model_path, engine_name=MODEL_ENGINE,
+                         validate=check_feature_order)
+if RELOAD_INTERVAL > 0:
+    registry.watch(RELOAD_INTERVAL)
+
+# Merge concurrent single-row predictions into batched model calls
+MICROBATCH_ENABLED = os.getenv('MODEL_MICROBATCH', '0') == '1'
+MICROBATCH_MAX_SIZE = int(os.getenv('MODEL_MICROBATCH_MAX_SIZE', 64))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv('MODEL_MICROBATCH_MAX_WAIT_MS', 2))
+
+# Reuse predictions for resubmitted feature vectors
+CACHE_ENABLED = os.getenv('PREDICTION_CACHE', '0') == '1'
+CACHE_MAX_ENTRIES = int(os.getenv('PREDICTION_CACHE_SIZE', 4096))
+CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', 300))
+# Round features to this many decimals before keying, unset for exact keys
+CACHE_DECIMALS = os.getenv('PREDICTION_CACHE_DECIMALS')
+# SQLite file shared by worker processes, unset for a per-process cache only
+CACHE_SHARED_PATH = os.getenv('PREDICTION_CACHE_SHARED_PATH')
+
+prediction_cache = PredictionCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL,
+    decimals=int(CACHE_DECIMALS) if CACHE_DECIMALS else None,
+    backend=(SQLiteCacheBackend(CACHE_SHARED_PATH, CACHE_TTL)
+             if CACHE_ENABLED and CACHE_SHARED_PATH else None))
+# Cached predictions belong to the model that made them
+registry.on_swap(lambda loaded: prediction_cache.clear())
+
+
+# Answer from the compact fast-tier model (built by models/fast_tier.py)
+# and only ask the full forest about rows inside the uncertainty band
+CASCADE_ENABLED = os.getenv('MODEL_CASCADE', '0') == '1'
+FAST_MODEL_PATH = os.getenv('MODEL_FAST_PATH') or \
+    os.path.join(MODELS_DIR, "cancer_diagnosis_fast.pkl")
+CASCADE_LOW = float(os.getenv('MODEL_CASCADE_LOW', 0.2))
+CASCADE_HIGH = float(os.getenv('MODEL_CASCADE_HIGH', 0.8))
+
+cascade = None
+if CASCADE_ENABLED:
+    fast_model = load_model('fast', FAST_MODEL_PATH, MODEL_ENGINE)
+    check_feature_order(fast_model.model)
+    cascade = Cascade(fast_model.engine, CASCADE_LOW, CASCADE_HIGH)
+
+
+# Sketch every scored feature vector and compare them with the training
+# data's profile (built by models/drift.py) on a schedule
+DRIFT_ENABLED = os.getenv('MODEL_DRIFT_MONITOR', '1') == '1'
+DRIFT_PROFILE_PATH = os.getenv('MODEL_DRIFT_PROFILE') or \
+    os.path.join(MODELS_DIR, "reference_profile.json")
+# Directory shared by the gunicorn workers to merge their sketches
+DRIFT_DIR = os.getenv('MODEL_DRIFT_DIR') or None
+DRIFT_INTERVAL = float(os.getenv('MODEL_DRIFT_INTERVAL', 300))
+
+drift_monitor = None
+if DRIFT_ENABLED:
+    drift_monitor = DriftMonitor(load_profile(DRIFT_PROFILE_PATH),
+                                 directory=DRIFT_DIR, interval=DRIFT_INTERVAL)
+
+
+def _predict_with(engine, input_rows):
+    if cascade is not None:
+        return cascade.predict(input_rows, engine)
+    return engine.predict(input_rows)
+
+
+def _predict_rows(input_rows, engine):
+    return _predict_with(engine, input_rows)
+
+
+batcher = MicroBatcher(_predict_rows,
+                       max_batch_size=MICROBATCH_MAX_SIZE,
+                       max_wait=MICROBATCH_MAX_WAIT_MS / 1e3)
 
 
 def predict_cancerous(input_data):
+    # Pin the serving version so a concurrent swap cannot change it midway
+    current = registry.current
+    if CACHE_ENABLED:
+        key = prediction_cache.key(input_data, current.version)
+        label = prediction_cache.get(key)
+        if label is not None:
+            prediction = np.array([label])
+        else:
+            prediction = _predict_one(current, input_data)
+            prediction_cache.set(key, int(prediction[0]))
+    else:
+        prediction = _predict_one(current, input_data)
+    # Only rows the model accepted count towards drift
+    if drift_monitor is not None:
+        drift_monitor.observe(input_data)
+    return prediction
+
+
+def _predict_one(current, input_data):
+    if MICROBATCH_ENABLED:
+        # Wait for the dispatcher to score this row together with others,
+        # with the model pinned by the caller
+        return batcher.predict(input_data, current.engine)
+
     # Convert input data to a NumPy array and reshape if necessary
     input_data = np.array(input_data).reshape(1, -1)
 
     # Make predictions using the loaded model
-    prediction = model.predict(input_data)
+    prediction = _predict_with(current.engine, input_data)
 
     # Return the prediction (0 = non-cancerous, 1 = cancerous)
     return prediction
+
+
+def predict_batch(input_rows):
+    """
+    Score many feature vectors with a single model call
+
+    Returns a tuple ``(labels, probabilities)`` where ``probabilities`` is
+    the probability of label 1 (cancerous) for every row.
+    """
+    engine = registry.current.engine
+
+    # One contiguous float64 matrix, so sklearn does not copy it again
+    input_rows = np.ascontiguousarray(input_rows, dtype=np.float64)
+    if input_rows.ndim != 2 or input_rows.shape[1] != engine.n_features_in_:
+        raise ValueError(f"Expected an (N, {engine.n_features_in_}) matrix, "
+                         f"got shape {input_rows.shape}")
+
+    if cascade is not None:
+        probabilities = cascade.predict_proba(input_rows, engine)
+        labels = engine.classes_.take((probabilities > 0.5).astype(np.intp))
+    else:
+        # predict() would run predict_proba() again internally, so derive
+        # the labels from the probabilities the same way the forest does
+        probabilities = engine.predict_proba(input_rows)
+        labels = engine.classes_.take(np.argmax(probabilities, axis=1))
+        positive = np.flatnonzero(engine.classes_ == 1)[0]
+        probabilities = probabilities[:, positive]
+
+    # Only rows the model accepted count towards drift
+    if drift_monitor is not None:
+        drift_monitor.observe(input_rows)
+    return labels, probabilities
+
+
+def model_info():
+    """
+    Version, engine and runtime counters of the serving model
+    """
+    current, previous = registry.current, registry.previous
+    return {
+        'name': current.name,
+        'version': current.version,
+        'loaded_at': current.loaded_at,
+        'previous': previous.name if previous is not None else None,
+        'available': registry.versions(),
+        'engine': MODEL_ENGINE,
+        'cache': prediction_cache.stats() if CACHE_ENABLED else None,
+        'microbatch': batcher.stats() if MICROBATCH_ENABLED else None,
+        'cascade': cascade.stats() if cascade is not None else None,
+        'drift_rows': (drift_monitor.sketch.rows
+                       if drift_monitor is not None else None),
+    }
@@ -0,0 +1,253 @@
+import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from models.cache import model_version
+from models.compiled import CompiledForest, MANIFEST_FILE
+
+
+# Name of the default artifact shipped next to this module
+DEFAULT_VERSION = 'default'
+# Pointer file that tells every worker which version to serve
+POINTER_FILE = 'CURRENT'
+
+
+class LoadedModel:
+    """
+    A model artifact that has been unpickled, compiled and warmed up
+    """
+
+    def __init__(self, name, path, model, engine):
+        self.name = name
+        self.path = path
+        self.model = model
+        self.engine = engine
+        self.version = artifact_version(path)
+        self.loaded_at = time.time()
+
+
+def artifact_version(path):
+    """
+    Content hash of a pickled model or of an exported model's manifest
+    """
+    if os.path.isdir(path):
+        # The manifest records a checksum of every exported array
+        path = os.path.join(path, MANIFEST_FILE)
+    return model_version(path)
+
+
+def load_model(name, path, engine_name='sklearn'):
+    if os.path.isdir(path):
+        # Exported arrays are mapped read-only and shared between workers
+        model = engine = CompiledForest.load(path, mmap=True)
+    else:
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        if engine_name == 'compiled':
+            engine = CompiledForest.from_model(model)
+        else:
+            engine = model
+
+    # Warm up so the first real request does not pay lazy initialization
+    warmup = np.zeros((1, engine.n_features_in_))
+    engine.predict(warmup)
+    engine.predict_proba(warmup)
+    return LoadedModel(name, path, model, engine)
+
+
+class ModelRegistry:
+    """
+    Versioned model artifacts with background loading and atomic swaps
+
+    ``current`` is a plain attribute that is replaced in one assignment, so
+    predictions read it without any lock: a caller that grabbed the old
+    version keeps using it until it finishes. Artifacts live in
+    ``directory`` either as ``<version>.pkl`` or as a ``<version>/``
+    directory exported by ``models/export_model.py``; the ``default``
+    version is the model shipped with the app. Workers in other processes
+    follow the version written to the pointer file when ``watch()`` is
+    running. ``validate(model)`` may raise to refuse an artifact before it
+    is served.
+    """
+
+    def __init__(self, directory, default_path, engine_name='sklearn',
+                 validate=None):
+        self.directory = directory
+        self.default_path = default_path
+        self.engine_name = engine_name
+        self.validate = validate
+        # Serializes swaps; the predict path never takes it
+        self._swap_lock = threading.Lock()
+        self._listeners = []
+        self._watcher_pid = None
+        self._pointer_mtime = self._read_pointer_mtime()
+        self.previous = None
+        pointed = self.read_pointer().get('version')
+        self.current = self._load(pointed or DEFAULT_VERSION)
+
+    def artifact_path(self, name):
+        if name == DEFAULT_VERSION:
+            return self.default_path
+        if not name or os.path.basename(name) != name or name.startswith('.'):
+            raise ValueError(f"Invalid model version name: {name!r}")
+        exported = os.path.join(self.directory, name)
+        if os.path.exists(os.path.join(exported, MANIFEST_FILE)):
+            return exported
+        return os.path.join(self.directory, f"{name}.pkl")
+
+    def versions(self):
+        names = [DEFAULT_VERSION]
+        if os.path.isdir(self.directory):
+            names += sorted(
+                filename[:-len('.pkl')] if filename.endswith('.pkl')
+                else filename
+                for filename in os.listdir(self.directory)
+                if filename.endswith('.pkl') or os.path.exists(
+                    os.path.join(self.directory, filename, MANIFEST_FILE)))
+        return names
+
+    def on_swap(self, callback):
+        """
+        Call ``callback(loaded_model)`` after every swap
+        """
+        self._listeners.append(callback)
+
+    def _load(self, name):
+        path = self.artifact_path(name)
+        if not os.path.exists(path):
+            raise LookupError(f"Model version {name!r} does not exist")
+        # Reactivating the version we just swapped out needs no reload,
+        # unless its artifact was replaced since
+        for loaded in (self.previous, getattr(self, 'current', None)):
+            if (loaded is not None and loaded.name == name
+                    and loaded.version == artifact_version(path)):
+                return loaded
+        loaded = load_model(name, path, self.engine_name)
+        if self.validate is not None:
+            self.validate(loaded.model)
+        return loaded
+
+    def _swap(self, loaded):
+        with self._swap_lock:
+            if loaded is self.current:
+                return loaded
+            self.previous, self.current = self.current, loaded
+        for callback in self._listeners:
+            callback(loaded)
+        return loaded
+
+    def activate(self, name):
+        """
+        Load ``name`` in the calling thread, then swap it in
+        """
+        return self._swap(self._load(name))
+
+    def reload(self, name=DEFAULT_VERSION):
+        """
+        Load and warm up ``name`` in a background thread and swap it in
+        when ready; returns a future for the loaded model
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self.activate(name))
+            except Exception as error:
+                future.set_exception(error)
+
+        threading.Thread(target=run, name='model-loader', daemon=True).start()
+        return future
+
+    def rollback(self):
+        """
+        Swap back to the previously served version
+        """
+        if self.previous is None:
+            raise LookupError("There is no previous model version")
+        return self._swap(self.previous)
+
+    # Pointer file, so every worker process converges on the same version
+
+    def _pointer_path(self):
+        return os.path.join(self.directory, POINTER_FILE)
+
+    def _read_pointer_mtime(self):
+        try:
+            return os.stat(self._pointer_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read_pointer(self):
+        try:
+            with open(self._pointer_path()) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def publish(self, name, previous=None):
+        """
+        Record ``name`` as the version every worker should serve;
+        ``previous`` is the version it replaces, by default the published
+        one (or the one served here, if none is)
+        """
+        if not os.path.exists(self.artifact_path(name)):
+            raise LookupError(f"Model version {name!r} does not exist")
+        pointer = self.read_pointer()
+        if previous is None:
+            previous = pointer.get('version', self.current.name)
+        if previous == name:
+            previous = pointer.get('previous')
+        self._write_pointer({'version': name, 'previous': previous})
+
+    def publish_rollback(self):
+        pointer = self.read_pointer()
+        if not pointer.get('previous'):
+            raise LookupError("There is no previous model version")
+        self._write_pointer({'version': pointer['previous'],
+                             'previous': pointer['version']})
+        return pointer['previous']
+
+    def _write_pointer(self, pointer):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename, so readers never see a partial file
+        temporary = f"{self._pointer_path()}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(pointer, f)
+        os.replace(temporary, self._pointer_path())
+
+    def poll(self):
+        """
+        Activate the published version if the pointer file changed
+        """
+        mtime = self._read_pointer_mtime()
+        if mtime is None or mtime == self._pointer_mtime:
+            return None
+        self._pointer_mtime = mtime
+        name = self.read_pointer().get('version')
+        if name and name != self.current.name:
+            return self.activate(name)
+        return None
+
+    def watch(self, interval):
+        """
+        Poll the pointer file every ``interval`` seconds in this process
+        """
+        # Threads do not survive fork(), so each worker starts its own
+        if self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.poll()
+                except Exception:
+                    # Keep serving the current version; retry next tick
+                    pass
+
+        threading.Thread(target=run, name='model-watcher',
+                         daemon=True).start()
@@ -1,30 +1,312 @@
-# Importing necessary libraries
+# Train candidate forests in parallel and keep the best one that serves fast
+#
+# Usage, from the repository root:
+#   python -m models.train_model [--workers N] [--max-single-ms MS]
+#                                [--max-batch-ms MS] [--max-size-mb MB]
+#
+# A grid of RandomForestClassifier settings is cross-validated on the
+# training split of the breast cancer dataset, one (candidate, fold) per
+# task on a process pool. Fold splits, fold scores and fitted candidates
+# are cached under --cache-dir, so a re-run only computes what changed.
+# Every candidate's single-row and batch prediction latency and pickled
+# size are then measured one at a time in this process, and the most
+# accurate candidate within the budget is written to the registry as
+# <version>.pkl with a <version>.json report of all the trade-offs and the
+# <version>.profile.json reference of the drift monitor (MODEL_DRIFT_PROFILE).
+# Serve it with `flask model activate <version>`.
+import argparse
+import hashlib
+import itertools
+import json
+import os
 import pickle
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import sklearn
 from sklearn.datasets import load_breast_cancer
-from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from models.drift import build_profile
 
-# Loading the breast cancer dataset
-data = load_breast_cancer()
-X = data.data
-y = data.target
 
-# Splitting the dataset into training and testing sets
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2,
-                                                    random_state=42)
+models_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Training a RandomForestClassifier model
-model = RandomForestClassifier(random_state=42)
-model.fit(X_train, y_train)
+# The hyperparameter grid searched by default
+GRID = {
+    'n_estimators': [10, 25, 50, 100, 200],
+    'max_depth': [None, 6, 12],
+    'max_features': ['sqrt', 'log2'],
+}
+RANDOM_STATE = 42
+# Rows scored at once when measuring batch latency
+BATCH_ROWS = 100
 
-# Evaluating the model
-y_pred = model.predict(X_test)
-accuracy = accuracy_score(y_test, y_pred)
 
-# Saving the trained model to a pickle file
-model_filename = './cancer_diagnosis_model.pkl'
-with open(model_filename, 'wb') as file:
-    pickle.dump(model, file)
+def candidates(grid=GRID):
+    names = sorted(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
 
-print(f"cancer diagnosis model accuracy: {accuracy}")
+
+def cache_key(*parts):
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+
+def write_atomic(path, data, mode='wb'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, mode) as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def data_fingerprint(X, y):
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(np.ascontiguousarray(X).tobytes())
+    digest.update(np.ascontiguousarray(y).tobytes())
+    return digest.hexdigest()
+
+
+def fold_splits(cache_dir, fingerprint, y, folds):
+    """
+    Stratified fold indices of the training rows, cached on disk
+    """
+    path = os.path.join(cache_dir, f"splits-{fingerprint}-{folds}.npz")
+    if os.path.exists(path):
+        with np.load(path) as saved:
+            return [(saved[f"train{index}"], saved[f"test{index}"])
+                    for index in range(folds)]
+    splitter = StratifiedKFold(folds, shuffle=True, random_state=RANDOM_STATE)
+    splits = list(splitter.split(np.zeros(len(y)), y))
+    arrays = {}
+    for index, (train, test) in enumerate(splits):
+        arrays[f"train{index}"], arrays[f"test{index}"] = train, test
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(temporary, **arrays)
+    os.replace(temporary, path)
+    return splits
+
+
+def build_model(params):
+    # One core per model, the pool runs one model per core
+    return RandomForestClassifier(random_state=RANDOM_STATE, n_jobs=1,
+                                  **params)
+
+
+def evaluate_fold(path, params, X, y, train, test):
+    """
+    Fit on one fold and write its accuracy to ``path``
+    """
+    started = time.perf_counter()
+    model = build_model(params).fit(X[train], y[train])
+    result = {'accuracy': accuracy_score(y[test], model.predict(X[test])),
+              'fit_seconds': time.perf_counter() - started}
+    write_atomic(path, json.dumps(result), mode='w')
+    return result
+
+
+def fit_candidate(path, params, X, y):
+    """
+    Fit on all training rows and pickle the model to ``path``
+    """
+    model = build_model(params).fit(X, y)
+    write_atomic(path, pickle.dumps(model, pickle.HIGHEST_PROTOCOL))
+
+
+def measure_latency(model, X, repeats):
+    """
+    Median milliseconds of a single-row and a batch prediction
+    """
+    # Cycle through the rows when asked for more repeats than there are
+    rows = [X[index % len(X)][np.newaxis] for index in range(repeats)]
+    batch = X[:BATCH_ROWS]
+    model.predict(rows[0])  # warm up
+    single = []
+    for row in rows:
+        started = time.perf_counter()
+        model.predict(row)
+        single.append(time.perf_counter() - started)
+    batched = []
+    for _ in range(max(repeats // 10, 3)):
+        started = time.perf_counter()
+        model.predict_proba(batch)
+        batched.append(time.perf_counter() - started)
+    return statistics.median(single) * 1e3, statistics.median(batched) * 1e3
+
+
+def run_search(X_train, y_train, grid, folds, cache_dir, workers):
+    """
+    Cross-validate every candidate and fit it on all training rows,
+    computing only what is not cached yet; returns ``(candidate, fold
+    results, model path)`` for every candidate and the number of tasks run
+    """
+    fingerprint = data_fingerprint(X_train, y_train)
+    splits = fold_splits(cache_dir, fingerprint, y_train, folds)
+    version = (fingerprint, sklearn.__version__, RANDOM_STATE)
+    plan, tasks = [], []
+    for params in candidates(grid):
+        fold_paths = [os.path.join(cache_dir, 'folds',
+                                   f"{cache_key(version, params, folds, fold)}"
+                                   ".json")
+                      for fold in range(folds)]
+        model_path = os.path.join(cache_dir, 'models',
+                                  f"{cache_key(version, params)}.pkl")
+        plan.append((params, fold_paths, model_path))
+        for fold_path, (train, test) in zip(fold_paths, splits):
+            if not os.path.exists(fold_path):
+                tasks.append((evaluate_fold, fold_path, params, X_train,
+                              y_train, train, test))
+        if not os.path.exists(model_path):
+            tasks.append((fit_candidate, model_path, params, X_train,
+                          y_train))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(*task) for task in tasks]
+            for done, future in enumerate(futures, 1):
+                future.result()
+                print(f"\r{done}/{len(tasks)} tasks", end='', flush=True)
+        print()
+
+    results = []
+    for params, fold_paths, model_path in plan:
+        scores = []
+        for fold_path in fold_paths:
+            with open(fold_path) as f:
+                scores.append(json.load(f))
+        results.append((params, scores, model_path))
+    return results, len(tasks)
+
+
+def select(report, budget):
+    """
+    The most accurate candidate within ``budget``, the faster one on ties
+    """
+    for candidate in report:
+        reasons = []
+        if candidate['single_ms'] > budget['max_single_ms']:
+            reasons.append('single-row latency')
+        if candidate['batch_ms'] > budget['max_batch_ms']:
+            reasons.append('batch latency')
+        if candidate['size_bytes'] > budget['max_size_mb'] * 1024 * 1024:
+            reasons.append('size')
+        candidate['over_budget'] = reasons
+    eligible = [candidate for candidate in report
+                if not candidate['over_budget']]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda candidate: (candidate['cv_accuracy'],
+                                                -candidate['single_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Search, measure and select a diagnosis model")
+    parser.add_argument('--output', default=os.getenv(
+        'MODEL_REGISTRY_DIR') or os.path.join(models_dir, 'versions'),
+        help='Registry directory the selected version is written to.')
+    parser.add_argument('--version', default=datetime.now(timezone.utc)
+                        .strftime('rf-%Y%m%d%H%M%S'))
+    parser.add_argument('--cache-dir', default=os.path.join(
+        models_dir, '.train-cache'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--max-single-ms', type=float, default=10.0)
+    parser.add_argument('--max-batch-ms', type=float, default=50.0,
+                        help=f'Budget for scoring {BATCH_ROWS} rows at once.')
+    parser.add_argument('--max-size-mb', type=float, default=20.0)
+    parser.add_argument('--latency-repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    # Loading the breast cancer dataset, keeping a holdout split
+    data = load_breast_cancer()
+    X_train, X_test, y_train, y_test = train_test_split(
+        data.data, data.target, test_size=0.2, random_state=RANDOM_STATE)
+
+    started = time.perf_counter()
+    results, computed = run_search(X_train, y_train, GRID, args.folds,
+                                   args.cache_dir, args.workers)
+    search_seconds = time.perf_counter() - started
+
+    # Latency is measured one model at a time, on an otherwise idle process
+    report = []
+    for params, scores, model_path in results:
+        with open(model_path, 'rb') as f:
+            blob = f.read()
+        model = pickle.loads(blob)
+        single_ms, batch_ms = measure_latency(model, X_test,
+                                              args.latency_repeats)
+        accuracies = [score['accuracy'] for score in scores]
+        report.append({
+            'params': params,
+            'cv_accuracy': statistics.mean(accuracies),
+            'cv_accuracy_std': statistics.pstdev(accuracies),
+            'test_accuracy': accuracy_score(y_test, model.predict(X_test)),
+            'fit_seconds': statistics.mean(score['fit_seconds']
+                                           for score in scores),
+            'single_ms': single_ms,
+            'batch_ms': batch_ms,
+            'size_bytes': len(blob),
+            'cache_path': model_path,
+        })
+
+    budget = {'max_single_ms': args.max_single_ms,
+              'max_batch_ms': args.max_batch_ms,
+              'max_size_mb': args.max_size_mb}
+    selected = select(report, budget)
+    summary = {
+        'version': args.version if selected else None,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'data': {'rows': len(data.target), 'train_rows': len(y_train),
+                 'features': list(data.feature_names),
+                 'fingerprint': data_fingerprint(X_train, y_train)},
+        'search': {'grid': GRID, 'folds': args.folds,
+                   'workers': args.workers, 'tasks_run': computed,
+                   'seconds': search_seconds,
+                   'sklearn': sklearn.__version__},
+        'budget': budget,
+        'batch_rows': BATCH_ROWS,
+        'selected': selected,
+        'candidates': sorted(report, key=lambda candidate:
+                             -candidate['cv_accuracy']),
+    }
+
+    for candidate in summary['candidates']:
+        marker = '*' if candidate is selected else ' '
+        print(f"{marker} {json.dumps(candidate['params'], sort_keys=True):<62}"
+              f" cv {candidate['cv_accuracy']:.4f}"
+              f" single {candidate['single_ms']:6.2f} ms"
+              f" batch {candidate['batch_ms']:6.2f} ms"
+              f" {candidate['size_bytes'] / 1024:8.1f} KiB"
+              f" {', '.join(candidate['over_budget'])}")
+    print(f"{computed} tasks run in {search_seconds:.1f}s, the rest cached")
+
+    if selected is None:
+        path = os.path.join(args.cache_dir, 'last-report.json')
+        write_atomic(path, json.dumps(summary, indent=2), mode='w')
+        print(f"No candidate fits the budget, report written to {path}")
+        return 1
+    # Writing the artifact and its report next to each other
+    with open(selected['cache_path'], 'rb') as f:
+        write_atomic(os.path.join(args.output, f"{args.version}.pkl"),
+                     f.read())
+    write_atomic(os.path.join(args.output, f"{args.version}.json"),
+                 json.dumps(summary, indent=2), mode='w')
+    profile = build_profile(X_train, data.feature_names)
+    write_atomic(os.path.join(args.output, f"{args.version}.profile.json"),
+                 json.dumps(profile, indent=2), mode='w')
+    print(f"Saved {args.version} (cv accuracy "
+          f"{selected['cv_accuracy']:.4f}, test accuracy "
+          f"{selected['test_accuracy']:.4f}) to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
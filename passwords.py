@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from contextlib import contextmanager
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    """
+    Raised when a password cannot be hashed or checked in time
+    """
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _check(stored, password):
+    return check_password_hash(stored, password)
+
+
+class PasswordHasher:
+    """
+    Hash and check passwords, in a process pool when ``workers`` is set
+
+    Key stretching is deliberately CPU-bound; in a pool it neither holds the
+    GIL nor competes with prediction threads for the interpreter. At most
+    ``max_concurrent`` requests of one process hash at a time and the others
+    wait up to ``admission_timeout`` seconds before ``HasherBusy`` is raised,
+    so a login storm cannot occupy every request thread. ``method`` is a
+    werkzeug method string such as ``scrypt:32768:8:1`` or
+    ``pbkdf2:sha256:600000``; hashes made with other parameters are reported
+    by ``needs_rehash()``.
+    """
+
+    def __init__(self, method='scrypt', workers=0, max_concurrent=2,
+                 admission_timeout=1.0, timeout=10.0):
+        self.method = method
+        self.workers = workers
+        self.admission_timeout = admission_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._prefix = None
+        self.rejected = 0
+
+    def _executor(self):
+        # Pools do not survive fork(), so every worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # spawn, since the forking process may be running threads
+                    self._pool = ProcessPoolExecutor(
+                        self.workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        try:
+            return self._executor().submit(function, *args)\
+                .result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy("Password hashing timed out") from None
+
+    @contextmanager
+    def admit(self):
+        """
+        Hold one of the hashing slots of this process
+        """
+        if not self._slots.acquire(timeout=self.admission_timeout):
+            self.rejected += 1
+            raise HasherBusy("Too many password checks in progress")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        with self.admit():
+            hashed = self._run(_hash, password, self.method)
+        self._prefix = hashed.split('$', 1)[0]
+        return hashed
+
+    def verify(self, stored, password):
+        with self.admit():
+            return self._run(_check, stored, password)
+
+    def needs_rehash(self, stored):
+        """
+        Whether ``stored`` was made with another algorithm or cost
+        """
+        if self._prefix is None:
+            # werkzeug fills in default parameters (``scrypt`` stands for
+            # ``scrypt:32768:8:1``), so learn the full prefix from one hash
+            self._prefix = self._run(_hash, '', self.method).split('$', 1)[0]
+        return stored.split('$', 1)[0] != self._prefix
+
+    def close(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown()
+            self._pool = None
+            self._pid = None
@@ -0,0 +1,306 @@
+import atexit
+import base64
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from database import db, CancerDiagnosis
+from stats import record_diagnoses, rows_matrix
+
+
+# diagnoses-<pid>.jsonl is a live journal, recovering-<pid>-<n>.jsonl one
+# that process <pid> has claimed for replay
+JOURNAL_NAME = re.compile(
+    r'^(?:diagnoses|recovering)-(\d+)(?:-\d+)?\.jsonl$')
+# Failures worth retrying: the database is unreachable or restarting
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+def _journal_owner(filename):
+    match = JOURNAL_NAME.match(filename)
+    return int(match.group(1)) if match else None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _encode(row):
+    encoded = {}
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, bytes):
+            # Packed features
+            value = base64.b64encode(value).decode()
+        encoded[key] = value
+    return encoded
+
+
+def _decode(row):
+    for key in ('created_at', 'updated_at'):
+        if isinstance(row.get(key), str):
+            row[key] = datetime.fromisoformat(row[key])
+    if isinstance(row.get('features'), str):
+        row['features'] = base64.b64decode(row['features'])
+    return row
+
+
+def insert_diagnoses(rows):
+    """
+    Save CancerDiagnosis rows with one bulk insert, updating the stats
+    """
+    db.session.execute(insert(CancerDiagnosis), rows)
+    record_diagnoses([row['user_id'] for row in rows],
+                     [row['diagnosis_result'] for row in rows],
+                     rows_matrix(rows))
+    db.session.commit()
+
+
+class WriteBehindWriter:
+    """
+    Buffer CancerDiagnosis rows and insert them in bulk in the background
+
+    ``submit()`` appends the row to a local journal and returns at once; a
+    writer thread inserts queued rows in batches of up to ``max_batch_size``
+    rows, or whatever arrived within ``max_delay`` seconds. After each commit
+    a marker is appended to the journal, so rows that were accepted but not
+    committed are replayed after a crash (at least once). When
+    ``max_pending`` rows are already waiting, ``submit()`` waits up to
+    ``enqueue_timeout`` seconds for room and then inserts synchronously.
+    Connection failures are retried; a batch failing for any other reason
+    is split to find the rows that can never be inserted, which are moved
+    to ``dead-letter-<pid>.jsonl`` in the spill directory.
+    """
+
+    def __init__(self, app, spill_dir, max_batch_size=200, max_delay=0.2,
+                 max_pending=10000, enqueue_timeout=0.5, fsync=True,
+                 close_timeout=10.0):
+        self.app = app
+        self.spill_dir = spill_dir
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self.fsync = fsync
+        self.close_timeout = close_timeout
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # recover() runs under _lock, so dead letters are counted apart
+        self._dead_lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        self._journal = None
+        self._slots = None
+        self._seq = 0
+        self._pending = 0
+        self.flushed_rows = 0
+        self.synchronous_rows = 0
+        self.dead_rows = 0
+
+    def journal_path(self, pid=None):
+        return os.path.join(self.spill_dir,
+                            f"diagnoses-{pid or os.getpid()}.jsonl")
+
+    def _ensure_started(self):
+        # Threads and file handles do not survive fork(), so every worker
+        # starts its own writer and journal on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.recover()
+            self._queue = queue.Queue()
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+            self._journal = open(self.journal_path(), 'a')
+            self._pending = 0
+            self._thread = threading.Thread(target=self._run,
+                                            args=(self._queue,),
+                                            name='write-behind', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+        atexit.register(self.close)
+
+    def recover(self):
+        """
+        Insert rows left in the journals of workers that are gone
+        """
+        recovered = 0
+        for index, filename in enumerate(sorted(os.listdir(self.spill_dir))):
+            owner = _journal_owner(filename)
+            if owner is None or (owner != os.getpid() and _is_alive(owner)):
+                continue
+            # Claim the journal first, so two workers never replay it twice
+            path = os.path.join(self.spill_dir,
+                                f"recovering-{os.getpid()}-{index}.jsonl")
+            try:
+                os.rename(os.path.join(self.spill_dir, filename), path)
+            except FileNotFoundError:
+                continue
+            rows = {}
+            with open(path) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    if 'flushed' in entry:
+                        for seq in [s for s in rows if s <= entry['flushed']]:
+                            del rows[seq]
+                    else:
+                        rows[entry['seq']] = entry['row']
+            if rows:
+                self._insert([_decode(row) for row in rows.values()],
+                             retry=False)
+                recovered += len(rows)
+            os.remove(path)
+        return recovered
+
+    def submit(self, row):
+        """
+        Accept a row for insertion, returns False if it had to be inserted
+        synchronously because the buffer was full
+        """
+        self._ensure_started()
+        if not self._slots.acquire(timeout=self.enqueue_timeout):
+            # Backpressure: the caller pays for the insert itself
+            insert_diagnoses([row])
+            self.synchronous_rows += 1
+            return False
+
+        with self._lock:
+            self._seq += 1
+            self._pending += 1
+            self._journal.write(json.dumps({'seq': self._seq,
+                                            'row': _encode(row)}) + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            # Enqueued under the lock, so batches commit in journal order
+            self._queue.put((self._seq, row))
+        return True
+
+    def _run(self, work_queue):
+        stop = False
+        while not stop:
+            item = work_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = work_queue.get(timeout=max(remaining, 0.0001))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _rollback(self):
+        with self.app.app_context():
+            db.session.rollback()
+            db.session.remove()
+
+    def _insert(self, rows, retry=True):
+        """
+        Insert ``rows``, retrying connection failures with backoff unless
+        ``retry`` is false; rows failing otherwise are dead-lettered
+        """
+        delay = 0.1
+        while True:
+            try:
+                with self.app.app_context():
+                    insert_diagnoses(rows)
+                    db.session.remove()
+                return
+            except TRANSIENT_ERRORS:
+                self._rollback()
+                if not retry:
+                    raise
+                # Keep the rows (they are journaled) and retry with backoff
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+            except Exception as error:
+                self._rollback()
+                if len(rows) == 1:
+                    self._dead_letter(rows[0], error)
+                    return
+                # Bisect, so the valid rows of the batch are still inserted
+                middle = len(rows) // 2
+                self._insert(rows[:middle], retry)
+                self._insert(rows[middle:], retry)
+                return
+
+    def _dead_letter(self, row, error):
+        path = os.path.join(self.spill_dir,
+                            f"dead-letter-{os.getpid()}.jsonl")
+        with open(path, 'a') as f:
+            f.write(json.dumps({'row': _encode(row),
+                                'error': f"{type(error).__name__}: {error}",
+                                'at': datetime.now().isoformat()}) + '\n')
+        with self._dead_lock:
+            self.dead_rows += 1
+
+    def _flush(self, batch):
+        self._insert([row for _, row in batch])
+
+        with self._lock:
+            self._journal.write(json.dumps({'flushed': batch[-1][0]}) + '\n')
+            self._journal.flush()
+            self._pending -= len(batch)
+            self.flushed_rows += len(batch)
+            if self._pending == 0:
+                # Everything journaled is committed, start an empty journal
+                self._journal.truncate(0)
+                self._journal.seek(0)
+                self._idle.notify_all()
+        for _ in batch:
+            self._slots.release()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every accepted row has been committed
+        """
+        if self._pid != os.getpid():
+            return True
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self):
+        """
+        Commit the buffered rows and stop the writer thread, waiting at most
+        ``close_timeout`` seconds; rows still buffered then stay in the
+        journal and are replayed by the next worker
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+            thread, work_queue, journal = \
+                self._thread, self._queue, self._journal
+        work_queue.put(None)
+        thread.join(self.close_timeout)
+        if thread.is_alive():
+            return
+        journal.close()
+        if os.path.getsize(journal.name) == 0:
+            os.remove(journal.name)
@@ -0,0 +1,178 @@
+import cProfile
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+PROFILE_MODES = ('cprofile', 'sampler')
+# Statements listed in a request's SQL summary, slowest first
+MAX_STATEMENTS = 20
+
+_local = threading.local()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if getattr(_local, 'sql', None) is not None:
+        started = conn.info.setdefault('profile_started', [])
+        started.append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    sql = getattr(_local, 'sql', None)
+    started = conn.info.get('profile_started')
+    if sql is None or not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    entry = sql.setdefault(statement, [0, 0.0])
+    entry[0] += 1
+    entry[1] += elapsed
+
+
+class StackSampler:
+    """
+    Sample the stack of one thread at a fixed interval, in collapsed form
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                module = frame.f_globals.get('__name__', '?')
+                names.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def collapsed(self):
+        """
+        ``frame;frame;frame count`` lines, as read by flamegraph tools
+        """
+        return ''.join(f"{stack} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """
+    Profile selected requests and write the results to ``directory``
+
+    A request is profiled when ``authorized()`` accepts it and it carries
+    an ``X-Profile: 1`` header (or a ``profile=1`` query parameter), or
+    when it is the ``sample_rate``-th request of this process. ``cprofile``
+    mode writes a pstats file, ``sampler`` mode the collapsed stacks of a
+    low-overhead sampling thread; both write a JSON summary with the SQL
+    statements the request ran. Nothing is hooked into the app unless
+    ``init_app()`` is called, so a disabled profiler costs nothing.
+    """
+
+    def __init__(self, directory, mode='cprofile', sample_rate=0,
+                 interval=0.005):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode!r}")
+        self.directory = directory
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._requests = itertools.count(1)
+        self._profiles = itertools.count(1)
+
+    def init_app(self, app, authorized):
+        self.authorized = authorized
+        app.before_request(self._start)
+        app.after_request(self._add_header)
+        app.teardown_request(self._finish)
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def _requested(self):
+        flagged = request.headers.get('X-Profile') == '1' \
+            or request.args.get('profile') == '1'
+        if flagged and self.authorized():
+            return True
+        return bool(self.sample_rate) \
+            and next(self._requests) % self.sample_rate == 0
+
+    def _start(self):
+        if not self._requested():
+            return
+        name = (f"{time.strftime('%Y%m%dT%H%M%S')}-"
+                f"{request.endpoint or 'unknown'}-{os.getpid()}-"
+                f"{next(self._profiles)}")
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) owns this thread
+                return
+        else:
+            profiler = StackSampler(threading.get_ident(), self.interval)
+            profiler.start()
+        g.profile = {'name': name, 'profiler': profiler,
+                     'started': time.perf_counter()}
+        _local.sql = {}
+
+    def _add_header(self, response):
+        if 'profile' in g:
+            response.headers['X-Profile-Id'] = g.profile['name']
+        return response
+
+    def _finish(self, error=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profiler = profile['profiler']
+        if self.mode == 'cprofile':
+            profiler.disable()
+        else:
+            profiler.stop()
+        elapsed = time.perf_counter() - profile['started']
+        sql, _local.sql = _local.sql, None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, profile['name'])
+        if self.mode == 'cprofile':
+            profiler.dump_stats(f"{path}.pstats")
+        else:
+            with open(f"{path}.collapsed", 'w') as f:
+                f.write(profiler.collapsed())
+        statements = sorted(sql.items(), key=lambda item: -item[1][1])
+        summary = {
+            'endpoint': request.endpoint, 'method': request.method,
+            'path': request.path, 'seconds': elapsed, 'mode': self.mode,
+            'error': repr(error) if error is not None else None,
+            'sql': {'count': sum(count for count, _ in sql.values()),
+                    'seconds': sum(seconds for _, seconds in sql.values()),
+                    'statements': [{'statement': statement, 'count': count,
+                                    'seconds': seconds}
+                                   for statement, (count, seconds)
+                                   in statements[:MAX_STATEMENTS]]},
+        }
+        with open(f"{path}.json", 'w') as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,164 @@
+import math
+import operator
+import numpy as np
+
+
+class Feature:
+    """
+    One model input: column, form field and JSON key ``name``, as titled
+    in the breast cancer dataset the model was trained on
+    """
+
+    __slots__ = ('name', 'title', 'label')
+
+    def __init__(self, title):
+        self.title = title
+        self.name = title.replace(' ', '_')
+        self.label = title.title()
+
+    def __repr__(self):
+        return f"Feature({self.title!r})"
+
+
+# The model inputs in training order, as named by load_breast_cancer()
+FEATURES = tuple(Feature(title) for title in (
+    'mean radius', 'mean texture', 'mean perimeter', 'mean area',
+    'mean smoothness', 'mean compactness', 'mean concavity',
+    'mean concave points', 'mean symmetry', 'mean fractal dimension',
+    'radius error', 'texture error', 'perimeter error', 'area error',
+    'smoothness error', 'compactness error', 'concavity error',
+    'concave points error', 'symmetry error', 'fractal dimension error',
+    'worst radius', 'worst texture', 'worst perimeter', 'worst area',
+    'worst smoothness', 'worst compactness', 'worst concavity',
+    'worst concave points', 'worst symmetry', 'worst fractal dimension',
+))
+FEATURE_NAMES = tuple(feature.name for feature in FEATURES)
+
+
+def check_feature_order(model):
+    """
+    Raise ``ValueError`` unless ``model`` takes the features in schema order
+
+    Models fitted on named columns are checked name by name, others can
+    only be checked for the number of inputs.
+    """
+    names = getattr(model, 'feature_names_in_', None)
+    if names is not None:
+        names = tuple(str(name).replace(' ', '_') for name in names)
+        if names != FEATURE_NAMES:
+            raise ValueError(f"The model was trained on features {names}, "
+                             f"expected {FEATURE_NAMES}")
+    elif model.n_features_in_ != len(FEATURES):
+        raise ValueError(f"The model takes {model.n_features_in_} features, "
+                         f"expected {len(FEATURES)}")
+
+
+class FeatureError(ValueError):
+    """
+    Raised for request values that are not a valid feature vector
+
+    ``errors`` maps a field name (prefixed with the row index for batches)
+    to what is wrong with it.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f"{field}: {message}"
+                                   for field, message in errors.items()))
+
+
+# sklearn's trees compare features as float32, so larger values are refused
+MAX_VALUE = float(np.finfo(np.float32).max)
+
+
+class FeatureVectorizer:
+    """
+    Parse raw request values straight into float64 model input
+
+    Rows come either as mappings keyed by feature name (form data, JSON
+    objects) or as sequences in schema order. The field lookups are
+    compiled once, so parsing a row costs one ``itemgetter`` call and a
+    float conversion per value, into a preallocated array.
+    """
+
+    def __init__(self, features=FEATURES):
+        self.names = tuple(feature.name for feature in features)
+        self.width = len(self.names)
+        self._get = operator.itemgetter(*self.names)
+
+    def row(self, values, out=None):
+        """
+        One ``(1, n_features)`` row from a mapping or a sequence
+        """
+        if out is None:
+            out = np.empty((1, self.width), dtype=np.float64)
+        self._fill(out[0], values, '')
+        return out
+
+    def batch(self, rows, out=None):
+        """
+        An ``(N, n_features)`` matrix from a sequence of rows
+        """
+        if rows and not isinstance(rows[0], dict):
+            # Fast path: numpy converts a list of number lists in C
+            try:
+                matrix = np.asarray(rows, dtype=np.float64)
+            except (TypeError, ValueError, OverflowError):
+                matrix = None
+            if (matrix is not None
+                    and matrix.shape == (len(rows), self.width)
+                    and (np.abs(matrix) <= MAX_VALUE).all()):
+                if out is None:
+                    return matrix
+                out[:] = matrix
+                return out
+        if out is None:
+            out = np.empty((len(rows), self.width), dtype=np.float64)
+        errors = {}
+        for index, values in enumerate(rows):
+            try:
+                self._fill(out[index], values, f"{index}.")
+            except FeatureError as error:
+                errors.update(error.errors)
+        if errors:
+            raise FeatureError(errors)
+        return out
+
+    def _fill(self, target, values, prefix):
+        if isinstance(values, (list, tuple)):
+            if len(values) != self.width:
+                raise FeatureError({f"{prefix}row": f"expected {self.width} "
+                                    f"values, got {len(values)}"})
+        else:
+            try:
+                values = self._get(values)
+            except KeyError as error:
+                raise FeatureError({f"{prefix}{error.args[0]}":
+                                    "value is required"})
+            except TypeError:
+                raise FeatureError({f"{prefix}row": "expected an object or "
+                                    "a list of numbers"})
+        errors = None
+        for position, value in enumerate(values):
+            try:
+                number = float(value)
+            except OverflowError:
+                # An integer too large for a float
+                message = "value is out of range"
+            except (TypeError, ValueError):
+                message = "value is required" if value in ('', None) \
+                    else f"{value!r} is not a number"
+            else:
+                if abs(number) <= MAX_VALUE:
+                    target[position] = number
+                    continue
+                message = "value must be finite" \
+                    if not math.isfinite(number) else \
+                    "value is out of range"
+            errors = errors or {}
+            errors[f"{prefix}{self.names[position]}"] = message
+        if errors:
+            raise FeatureError(errors)
+
+
+vectorizer = FeatureVectorizer()
@@ -0,0 +1,184 @@
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from database import (
+    db,
+    CancerDiagnosis,
+    DiagnosisStats,
+    FEATURE_COLUMNS,
+    unpack_features,
+)
+
+
+# Stats rows of this user id hold the totals of all users
+ALL_USERS = 0
+
+MEAN_COLUMNS = tuple(f"mean_{name}" for name in FEATURE_COLUMNS)
+M2_COLUMNS = tuple(f"m2_{name}" for name in FEATURE_COLUMNS)
+
+_UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def moments(matrix):
+    """
+    ``(count, mean, m2)`` of the rows of ``matrix``
+    """
+    mean = matrix.mean(axis=0)
+    return len(matrix), mean, ((matrix - mean) ** 2).sum(axis=0)
+
+
+def merge(first, second):
+    """
+    Moments of two groups combined (Chan et al.); adding a single row this
+    way is one step of Welford's method
+    """
+    count_a, mean_a, m2_a = first
+    count_b, mean_b, m2_b = second
+    count = count_a + count_b
+    if not count:
+        return first
+    delta = mean_b - mean_a
+    return (count, mean_a + delta * count_b / count,
+            m2_a + m2_b + delta * delta * count_a * count_b / count)
+
+
+def group_moments(user_ids, results, matrix):
+    """
+    Moments by ``(user_id, result)``, including the all-users groups
+    """
+    user_ids, results = np.asarray(user_ids), np.asarray(results)
+    groups = {}
+    result_names, result_codes = np.unique(results, return_inverse=True)
+    for code, result in enumerate(result_names.tolist()):
+        groups[ALL_USERS, result] = moments(matrix[result_codes == code])
+    # Sort once by (result, user), then every group is one slice
+    order = np.lexsort((user_ids, result_codes))
+    keys = np.stack((result_codes[order], user_ids[order]), axis=1)
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)])
+    for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+        code, user_id = keys[start]
+        groups[int(user_id), str(result_names[code])] = \
+            moments(matrix[order[start:end]])
+    return groups
+
+
+def _upsert():
+    """
+    Insert a group's moments, or merge them into the existing row in the
+    database, so concurrent writers never lose an update
+    """
+    table = DiagnosisStats.__table__
+    statement = _UPSERTS[db.engine.dialect.name](table)
+    new, old = statement.excluded, table.c
+    count = old['count'] + new['count']
+    merged = {'count': count}
+    for mean, m2 in zip(MEAN_COLUMNS, M2_COLUMNS):
+        delta = new[mean] - old[mean]
+        merged[mean] = old[mean] + delta * new['count'] / count
+        merged[m2] = old[m2] + new[m2] \
+            + delta * delta * old['count'] * new['count'] / count
+    return statement.on_conflict_do_update(
+        index_elements=[old.user_id, old.diagnosis_result], set_=merged)
+
+
+def _stats_row(key, group):
+    (user_id, result), (count, mean, m2) = key, group
+    return {'user_id': user_id, 'diagnosis_result': result, 'count': count,
+            **dict(zip(MEAN_COLUMNS, mean.tolist())),
+            **dict(zip(M2_COLUMNS, m2.tolist()))}
+
+
+def record_diagnoses(user_ids, results, matrix):
+    """
+    Add new diagnoses to the stats in the current transaction
+
+    One upsert per touched ``(user, result)`` row, in a fixed order so
+    concurrent transactions lock them the same way; the work does not
+    depend on how many diagnoses are already stored.
+    """
+    if not len(matrix):
+        return
+    groups = group_moments(user_ids, results,
+                           np.asarray(matrix, dtype=np.float64))
+    db.session.execute(_upsert(), [_stats_row(key, group)
+                                   for key, group in sorted(groups.items())])
+
+
+def rows_matrix(rows):
+    """
+    Feature matrix of CancerDiagnosis row dicts, packed or not
+    """
+    matrix = np.empty((len(rows), len(FEATURE_COLUMNS)))
+    for index, row in enumerate(rows):
+        if row.get('features') is not None:
+            matrix[index] = unpack_features(row['features'])
+        else:
+            matrix[index] = [row[name] for name in FEATURE_COLUMNS]
+    return matrix
+
+
+def _summary(count, mean, m2):
+    return {'count': count, 'features': {
+        name: {'mean': float(mean[index]) if count else None,
+               'variance': float(m2[index] / (count - 1))
+               if count > 1 else None}
+        for index, name in enumerate(FEATURE_COLUMNS)}}
+
+
+def read_stats(user_id=ALL_USERS):
+    """
+    Counts and feature means and variances by result and overall
+
+    Reads at most one stats row per result, whatever the size of the
+    diagnoses table.
+    """
+    rows = db.session.execute(
+        select(DiagnosisStats).where(DiagnosisStats.user_id == user_id))\
+        .scalars().all()
+    width = len(FEATURE_COLUMNS)
+    total = (0, np.zeros(width), np.zeros(width))
+    results = {}
+    for row in sorted(rows, key=lambda row: row.diagnosis_result):
+        group = (row.count,
+                 np.array([getattr(row, name) for name in MEAN_COLUMNS]),
+                 np.array([getattr(row, name) for name in M2_COLUMNS]))
+        results[row.diagnosis_result] = _summary(*group)
+        total = merge(total, group)
+    return {'all': _summary(*total), 'results': results}
+
+
+def rebuild_stats(chunk_size=5000):
+    """
+    Recompute the stats from the diagnoses table, reading it in id order
+    one chunk at a time; returns the number of diagnoses counted
+
+    The old stats are replaced in the same transaction as the new ones
+    are written, so readers never see them empty. Diagnoses inserted
+    while the rebuild runs may be missed: run it when writes are paused.
+    """
+    table = CancerDiagnosis.__table__
+    query = select(table.c.id, table.c.user_id, table.c.diagnosis_result,
+                   table.c.features,
+                   *(table.c[name] for name in FEATURE_COLUMNS))\
+        .order_by(table.c.id).limit(chunk_size)
+    groups, counted, last_id = {}, 0, 0
+    while True:
+        rows = [row._asdict() for row in db.session.execute(
+            query.where(table.c.id > last_id))]
+        if not rows:
+            break
+        chunk = group_moments([row['user_id'] for row in rows],
+                              [row['diagnosis_result'] for row in rows],
+                              rows_matrix(rows))
+        for key, group in chunk.items():
+            groups[key] = merge(groups[key], group) if key in groups \
+                else group
+        counted += len(rows)
+        last_id = rows[-1]['id']
+
+    db.session.execute(delete(DiagnosisStats))
+    if groups:
+        db.session.execute(insert(DiagnosisStats), [
+            _stats_row(key, group) for key, group in sorted(groups.items())])
+    db.session.commit()
+    return counted
@@ -1,5 +1,40 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
 import pytest
+from flask import Flask, jsonify, request
+from sqlalchemy import create_engine, event, insert
+import app as app_module
 from app import app as main_app, db  # Import the main app and db
+from werkzeug.datastructures import MultiDict
+from werkzeug.security import generate_password_hash
+from database import User, CancerDiagnosis, FEATURE_COLUMNS
+from persistence import WriteBehindWriter
+from metrics import MetricsRegistry
+from profiling import RequestProfiler
+from schema import FEATURE_NAMES, FeatureError, vectorizer
+from stats import rebuild_stats
+from engines import (
+    REPLICA_BIND,
+    MeteredQueuePool,
+    pool_stats,
+    primary_reads,
+    use_replica,
+)
+from passwords import PasswordHasher
+from feature_storage import migrate_feature_storage
+from history import history_page
+from export import export_query, export_stream
+from upload import ingest_csv
+from benchmarks.suite import compare
 
 
 # Define user data
@@ -81,6 +116,19 @@ def logged_in_user(test_client, create_user):
     return user_data
 
 
+@pytest.fixture
+def count_queries(test_client):
+    # Record every SQL statement sent to the database
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
 # Test the home endpoint
 def test_home(test_client):
     response = test_client.get('/')
@@ -148,6 +196,56 @@ def test_login(test_client, create_user):
     assert b'Login successful!' in response.data
 
 
+def csrf_token(test_client, path):
+    response = test_client.get(path)
+    return response.data.decode().split('name="csrf_token"')[1]\
+        .split('value="')[1].split('"')[0]
+
+
+def login_data(test_client):
+    return {'identifier': user_data['username'],
+            'password': user_data['password'],
+            'csrf_token': csrf_token(test_client, '/login')}
+
+
+# Test that logging in upgrades a hash made with outdated parameters
+def test_login_rehashes_password(test_client, create_user):
+    user = User.query.filter_by(username=user_data['username']).first()
+    user.password = generate_password_hash(user_data['password'],
+                                           'pbkdf2:sha256:1000')
+    db.session.commit()
+
+    response = test_client.post('/login', data=login_data(test_client))
+    assert response.status_code == 302
+    db.session.expire_all()
+    assert user.password.startswith('scrypt:')
+    assert not app_module.password_hasher.needs_rehash(user.password)
+
+
+# Test that logins are turned away while the hashing slots are taken
+def test_login_admission_control(test_client, create_user, monkeypatch):
+    hasher = PasswordHasher(max_concurrent=1, admission_timeout=0.01)
+    monkeypatch.setattr(app_module, 'password_hasher', hasher)
+    data = login_data(test_client)
+    with hasher.admit():
+        response = test_client.post('/login', data=data)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert hasher.rejected == 1
+
+
+# Test hashing and checking passwords in a process pool
+def test_password_hasher_pool():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+    try:
+        hashed = hasher.hash('secret')
+        assert hasher.verify(hashed, 'secret')
+        assert not hasher.verify(hashed, 'wrong')
+        assert not hasher.needs_rehash(hashed)
+    finally:
+        hasher.close()
+
+
 # Test the logout endpoint
 def test_logout(test_client, logged_in_user):
     # Test the logout
@@ -221,6 +319,677 @@ def test_history(test_client, logged_in_user):
     assert b'Diagnosis History' in response.data
 
 
+# Test the batch prediction API
+def test_api_predict(test_client, logged_in_user):
+    instances = [
+        [12.0, 10.0, 80.0, 500.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6,
+         1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0,
+         15.0, 10.0, 85.0, 550.0, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7],
+        [20.0, 25.0, 130.0, 1200.0, 0.1, 0.2, 0.2, 0.1, 0.2, 0.06,
+         0.8, 1.2, 5.5, 90.0, 0.006, 0.03, 0.04, 0.015, 0.02, 0.004,
+         25.0, 33.0, 170.0, 2000.0, 0.15, 0.5, 0.6, 0.25, 0.35, 0.09],
+    ]
+    response = test_client.post('/api/v1/predict',
+                                json={'instances': instances})
+    assert response.status_code == 200
+    predictions = response.get_json()['predictions']
+    assert len(predictions) == 2
+    for prediction in predictions:
+        assert prediction['label'] in (0, 1)
+        assert 0.0 <= prediction['probability'] <= 1.0
+        assert prediction['result'] in ('Cancerous', 'Non-Cancerous')
+    # Nothing is stored unless persist is requested
+    assert CancerDiagnosis.query.count() == 0
+
+    response = test_client.post('/api/v1/predict',
+                                json={'instances': instances,
+                                      'persist': True})
+    assert response.status_code == 200
+    assert CancerDiagnosis.query.count() == 2
+
+    # Objects keyed by feature name score the same as lists
+    response = test_client.post('/api/v1/predict', json={'instances': [
+        dict(zip(FEATURE_NAMES, instance)) for instance in instances]})
+    assert response.get_json()['predictions'] == predictions
+
+    # Rows with the wrong number of features are rejected
+    response = test_client.post('/api/v1/predict',
+                                json={'instances': [[1.0, 2.0]]})
+    assert response.status_code == 400
+    response = test_client.post('/api/v1/predict', json={'instances': [
+        dict(zip(FEATURE_NAMES, instances[0]), mean_area='big')]})
+    assert response.status_code == 400
+    assert response.get_json()['fields'] == {
+        '0.mean_area': "'big' is not a number"}
+
+    # Values sklearn cannot take as float32, and bodies that are not
+    # objects, are client errors too
+    for value in (1e39, 1e308, 10 ** 400):
+        row = instances[0][:-1] + [value]
+        for instance in (row, dict(zip(FEATURE_NAMES, row))):
+            response = test_client.post('/api/v1/predict',
+                                        json={'instances': [instance]})
+            assert response.status_code == 400
+            assert response.get_json()['fields'] == {
+                '0.worst_fractal_dimension': "value is out of range"}
+    response = test_client.post('/api/v1/predict', json=[instances[0]])
+    assert response.status_code == 400
+
+
+# Test parsing form values and JSON rows straight into model input
+def test_feature_vectorizer():
+    values = [float(index) for index in range(len(FEATURE_NAMES))]
+    form = MultiDict({name: str(value)
+                      for name, value in zip(FEATURE_NAMES, values)})
+    assert vectorizer.row(form).tolist() == [values]
+    batch = vectorizer.batch([values, dict(zip(FEATURE_NAMES, values))])
+    assert batch.dtype == np.float64 and batch.tolist() == [values, values]
+
+    out = np.zeros((1, len(FEATURE_NAMES)))
+    assert vectorizer.row(values, out=out) is out
+
+    form['mean_radius'] = ''
+    form['worst_area'] = 'inf'
+    with pytest.raises(FeatureError) as error:
+        vectorizer.row(form)
+    assert error.value.errors == {'mean_radius': 'value is required',
+                                  'worst_area': 'value must be finite'}
+    with pytest.raises(FeatureError) as error:
+        vectorizer.batch([values, values[:3]])
+    assert list(error.value.errors) == ['1.row']
+
+
+# Test the serving model information endpoint
+def test_api_model(test_client, logged_in_user):
+    response = test_client.get('/api/v1/model')
+    assert response.status_code == 200
+    info = response.get_json()
+    assert info['version']
+    assert info['engine'] in ('sklearn', 'compiled')
+
+
+# Test the admin model reload and rollback endpoints
+def test_admin_model_reload(test_client, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(app_module.registry, 'directory', str(tmp_path))
+
+    # Without the token the endpoints are forbidden
+    response = test_client.post('/admin/model/reload')
+    assert response.status_code == 403
+
+    headers = {'X-Admin-Token': 'secret'}
+    response = test_client.post('/admin/model/reload', headers=headers,
+                                json={'version': 'missing'})
+    assert response.status_code == 404
+
+    response = test_client.post('/admin/model/reload', headers=headers,
+                                json={'version': 'default'})
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'default'
+    assert app_module.registry.read_pointer()['version'] == 'default'
+
+    # The pointer remembers the version swapped out, so it can be rolled back
+    os.remove(tmp_path / 'CURRENT')
+    shutil.copy(app_module.registry.default_path, tmp_path / 'v2.pkl')
+    response = test_client.post('/admin/model/reload', headers=headers,
+                                json={'version': 'v2'})
+    assert response.status_code == 200
+    assert app_module.registry.read_pointer() == {'version': 'v2',
+                                                  'previous': 'default'}
+    response = test_client.post('/admin/model/rollback', headers=headers)
+    assert response.get_json()['name'] == 'default'
+    assert app_module.registry.read_pointer() == {'version': 'default',
+                                                  'previous': 'v2'}
+
+
+# Test the liveness and readiness probes
+def test_health_probes(test_client):
+    response = test_client.get('/healthz')
+    assert response.status_code == 200
+    response = test_client.get('/readyz')
+    assert response.status_code == 200
+    assert response.get_json()['database'] is True
+
+
+# Test the explicit database initialization command
+def test_init_db_command(test_client):
+    result = main_app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0
+    assert 'Initialized the database' in result.output
+
+
+def diagnosis_row(value=1.0):
+    row = dict.fromkeys(FEATURE_COLUMNS, value)
+    row.update(user_id=1, diagnosis_result='Non-Cancerous')
+    return row
+
+
+# Test that buffered rows are bulk inserted and the journal is cleaned up
+def test_write_behind_writer(test_client, tmp_path):
+    writer = WriteBehindWriter(main_app, str(tmp_path), max_batch_size=10,
+                               max_delay=0.01)
+    for i in range(25):
+        assert writer.submit(diagnosis_row(float(i)))
+    assert writer.flush(timeout=10)
+    assert writer.flushed_rows == 25
+    assert CancerDiagnosis.query.count() == 25
+    writer.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+# Test that a row that can never be inserted does not block the writer
+def test_write_behind_dead_letters_bad_rows(test_client, tmp_path):
+    writer = WriteBehindWriter(main_app, str(tmp_path), max_batch_size=10,
+                               max_delay=0.05)
+    rows = [diagnosis_row(float(i)) for i in range(5)]
+    rows[2]['diagnosis_result'] = None
+    for row in rows:
+        assert writer.submit(row)
+    assert writer.flush(timeout=10)
+    assert CancerDiagnosis.query.count() == 4
+    assert writer.dead_rows == 1
+    writer.close()
+    [dead_letter] = tmp_path.iterdir()
+    entry = json.loads(dead_letter.read_text())
+    assert entry['row']['mean_radius'] == 2.0
+    assert entry['error'].startswith('IntegrityError')
+
+
+# Test that rows not yet committed by a crashed worker are replayed
+def test_write_behind_recovers_journal(test_client, tmp_path):
+    with open(tmp_path / 'diagnoses-999999999.jsonl', 'w') as journal:
+        for seq in (1, 2, 3):
+            journal.write(json.dumps({'seq': seq,
+                                      'row': diagnosis_row(seq)}) + '\n')
+        journal.write(json.dumps({'flushed': 1}) + '\n')
+        journal.write('{"seq": 4, "ro')  # torn write
+
+    writer = WriteBehindWriter(main_app, str(tmp_path))
+    assert writer.recover() == 2
+    assert CancerDiagnosis.query.count() == 2
+    assert list(tmp_path.iterdir()) == []
+
+
+# Test that a journaled row that can never be inserted is dead-lettered
+# when the first submit() replays the journal
+def test_write_behind_recovers_bad_rows(test_client, tmp_path):
+    bad = diagnosis_row(2.0)
+    bad['diagnosis_result'] = None
+    with open(tmp_path / 'diagnoses-999999999.jsonl', 'w') as journal:
+        for seq, row in enumerate([diagnosis_row(1.0), bad], 1):
+            journal.write(json.dumps({'seq': seq, 'row': row}) + '\n')
+
+    writer = WriteBehindWriter(main_app, str(tmp_path), max_delay=0.01)
+    submitter = threading.Thread(
+        target=writer.submit, args=(diagnosis_row(3.0),), daemon=True)
+    submitter.start()
+    submitter.join(timeout=10)
+    assert not submitter.is_alive()
+    assert writer.flush(timeout=10)
+    assert writer.dead_rows == 1
+    assert CancerDiagnosis.query.count() == 2
+    writer.close()
+    assert [path.name for path in tmp_path.iterdir()] == [
+        f"dead-letter-{os.getpid()}.jsonl"]
+
+
+# Test keyset pagination of the history, in HTML and JSON
+def test_history_pagination(test_client, logged_in_user):
+    created_at = datetime(2024, 1, 1)
+    rows = [diagnosis_row(float(i)) for i in range(7)]
+    for i, row in enumerate(rows):
+        # Several rows share a timestamp, the id breaks the tie
+        row['created_at'] = created_at + timedelta(minutes=i // 2)
+    db.session.execute(insert(CancerDiagnosis), rows)
+    db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        query = {'limit': 3, **({'cursor': cursor} if cursor else {})}
+        page = test_client.get('/api/v1/history', query_string=query)
+        assert page.status_code == 200
+        data = page.get_json()
+        assert len(data['diagnoses']) <= 3
+        seen += [diagnosis['id'] for diagnosis in data['diagnoses']]
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [7, 6, 5, 4, 3, 2, 1]
+    assert 'user_id' not in data['diagnoses'][0]
+
+    response = test_client.get('/history', query_string={'limit': 3})
+    assert response.status_code == 200
+    assert b'Older' in response.data
+    # The next page keeps the page size
+    older = response.data.decode().split('class="btn btn-primary"')[0]
+    assert 'limit=3' in older.rsplit('href="', 1)[1]
+
+    response = test_client.get('/api/v1/history',
+                               query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+
+
+# Test streaming exports in CSV, gzipped NDJSON and from the CLI
+def test_export_diagnoses(test_client, logged_in_user, tmp_path):
+    rows = [diagnosis_row(float(i)) for i in range(5)]
+    rows[-1]['user_id'] = 2  # someone else's diagnosis
+    for i, row in enumerate(rows):
+        row['created_at'] = datetime(2024, 1, 1 + i)
+    db.session.execute(insert(CancerDiagnosis), rows)
+    db.session.commit()
+
+    response = test_client.get('/export/diagnoses',
+                               query_string={'from': '2024-01-02'})
+    assert response.status_code == 200
+    lines = response.data.decode().splitlines()
+    assert lines[0].startswith('id,user_id,created_at,mean_radius')
+    assert len(lines) == 1 + 3
+
+    response = test_client.get('/export/diagnoses',
+                               query_string={'format': 'ndjson', 'gzip': '1'})
+    records = [json.loads(line) for line in
+               gzip.decompress(response.data).decode().splitlines()]
+    assert [record['id'] for record in records] == [1, 2, 3, 4]
+
+    # The whole table needs the admin token
+    response = test_client.get('/admin/export/diagnoses')
+    assert response.status_code == 403
+
+    output = tmp_path / 'export.csv'
+    result = main_app.test_cli_runner().invoke(
+        args=['export-diagnoses', '--output', str(output)])
+    assert result.exit_code == 0
+    assert len(output.read_text().splitlines()) == 1 + 5
+
+
+# Test uploading a CSV of diagnoses with a few bad rows
+def test_upload_diagnoses(test_client, logged_in_user, tmp_path):
+    header = ','.join(name.replace('_', ' ') for name in FEATURE_COLUMNS)
+    good = ','.join(['1.5'] * len(FEATURE_COLUMNS))
+    lines = [header, good, good, 'abc,' + good[4:], '1,2', good]
+    data = {'csrf_token': csrf_token(test_client, '/upload'),
+            'file': (io.BytesIO('\n'.join(lines).encode()), 'batch.csv')}
+    response = test_client.post('/upload', data=data,
+                                content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert b'3 diagnoses saved' in response.data
+    assert db.session.query(CancerDiagnosis).count() == 3
+
+    report = ingest_csv(io.StringIO('\n'.join(lines)), 1, chunk_size=2)
+    assert report['inserted'] == 3
+    assert [error['line'] for error in report['errors']] == [4, 5]
+    assert report['errors'][0]['error'] == "mean_radius: 'abc' is not a number"
+
+    # A header that does not name the feature fields rejects the file
+    data = {'csrf_token': csrf_token(test_client, '/upload'),
+            'file': (io.BytesIO(b'radius,texture\n1,2\n'), 'bad.csv')}
+    response = test_client.post('/upload', data=data,
+                                content_type='multipart/form-data')
+    assert response.status_code == 400
+
+    # A byte order mark and CRLF line ends are accepted, bad UTF-8 is not
+    for body, status in [(b'\xef\xbb\xbf' + '\r\n'.join(lines).encode(), 200),
+                         (b'\xff' + '\n'.join(lines).encode(), 400)]:
+        data = {'csrf_token': csrf_token(test_client, '/upload'),
+                'file': (io.BytesIO(body), 'batch.csv')}
+        response = test_client.post('/upload', data=data,
+                                    content_type='multipart/form-data')
+        assert response.status_code == status
+    assert db.session.query(CancerDiagnosis).count() == 9
+
+    path = tmp_path / 'batch.csv'
+    path.write_text('\n'.join(lines))
+    result = main_app.test_cli_runner().invoke(
+        args=['import-diagnoses', str(path), '--user-id', '1'])
+    assert result.exit_code == 0
+    assert 'Saved 3 diagnoses' in result.output
+    assert db.session.query(CancerDiagnosis).count() == 12
+
+
+def make_user(username):
+    return {'fullname': username.title(), 'username': username,
+            'email': f"{username}@example.com", 'password': 'x'}
+
+
+# Test that reads of replica routes go to the replica, writes to the primary
+def test_read_replica_routing(tmp_path):
+    routed_app = Flask(__name__)
+    routed_app.config['SQLALCHEMY_DATABASE_URI'] = \
+        f"sqlite:///{tmp_path / 'primary.db'}"
+    routed_app.config['SQLALCHEMY_BINDS'] = {
+        REPLICA_BIND: f"sqlite:///{tmp_path / 'replica.db'}"}
+    db.init_app(routed_app)
+
+    def usernames():
+        return [user.username for user in User.query.order_by(User.id)]
+
+    @routed_app.route('/primary')
+    def read_primary():
+        return jsonify(usernames())
+
+    @routed_app.route('/replica', methods=['GET', 'POST'])
+    @use_replica
+    def read_replica():
+        if request.method == 'POST':
+            db.session.add(User(**make_user('written')))
+            db.session.commit()
+        if request.args.get('identity'):
+            # Identity lookups do not wait for the replica to catch up
+            with primary_reads():
+                return jsonify(usernames())
+        return jsonify(usernames())
+
+    try:
+        with routed_app.app_context():
+            db.create_all()
+            db.metadata.create_all(db.engines[REPLICA_BIND])
+            db.session.execute(insert(User), [make_user('primary')])
+            db.session.commit()
+            with db.engines[REPLICA_BIND].begin() as connection:
+                connection.execute(insert(User), [make_user('replica')])
+
+        client = routed_app.test_client()
+        assert client.get('/primary').json == ['primary']
+        assert client.get('/replica').json == ['replica']
+        client.post('/replica')
+        assert client.get('/primary').json == ['primary', 'written']
+        assert client.get('/replica').json == ['replica']
+        assert client.get('/replica?identity=1').json == \
+            ['primary', 'written']
+        assert client.get('/replica').json == ['replica']
+    finally:
+        # init_app registered the bind on the shared extension
+        db.metadatas.pop(REPLICA_BIND, None)
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'pooled.db'}",
+                           poolclass=MeteredQueuePool, pool_size=2)
+    with engine.connect(), engine.connect():
+        stats = pool_stats(engine)
+    assert stats['checked_out'] == 2 and stats['waits'] == 2
+    assert pool_stats(engine)['checked_out'] == 0
+
+
+# Test the per-stage latency histograms served at /metrics
+def test_metrics_endpoint(test_client, logged_in_user):
+    data = dict.fromkeys(FEATURE_COLUMNS, 1.0)
+    data['csrf_token'] = csrf_token(test_client, '/input')
+    assert test_client.post('/input', data=data).status_code == 200
+
+    response = test_client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    lines = response.data.decode().splitlines()
+    assert '# TYPE request_stage_duration_seconds histogram' in lines
+    for stage in ('validate', 'predict', 'persist', 'render'):
+        labels = f'endpoint="diagnosis",stage="{stage}"'
+        assert any(line.startswith(
+            f'request_stage_duration_seconds_count{{{labels}}}')
+            for line in lines)
+    assert any(line.startswith('http_requests_total{endpoint="login",'
+                               'method="POST",status="302"}')
+               for line in lines)
+
+
+# Test summing the metrics of workers through a shared directory
+def test_metrics_aggregate_across_processes(tmp_path):
+    def registry():
+        metrics = MetricsRegistry(str(tmp_path))
+        return metrics, metrics.counter('jobs_total', 'Jobs.', ('kind',)), \
+            metrics.histogram('job_seconds', 'Job time.', buckets=(1.0,))
+
+    # A worker that has exited left its snapshot behind
+    worker = subprocess.Popen([sys.executable, '-c', 'pass'])
+    worker.wait()
+    other, jobs, seconds = registry()
+    jobs.inc('a', amount=2)
+    seconds.observe(0.5)
+    snapshot = tmp_path / f"metrics-{worker.pid}.json"
+    snapshot.write_text(json.dumps(other.snapshot()))
+
+    metrics, jobs, seconds = registry()
+    jobs.inc('a')
+    seconds.observe(2.0)
+    text = metrics.render()
+    assert 'jobs_total{kind="a"} 3' in text
+    assert 'job_seconds_bucket{le="1.0"} 1' in text
+    assert 'job_seconds_count 2' in text
+    # The dead worker's counts moved to the archive and are kept
+    assert not snapshot.exists()
+    assert 'jobs_total{kind="a"} 3' in metrics.render()
+
+    # Scrapes and the flusher thread write the same snapshot concurrently
+    errors = []
+
+    def scrape():
+        try:
+            for _ in range(100):
+                metrics.collect()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=scrape) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+# Test flagging benchmark results that are worse than the baseline
+def test_benchmark_regressions():
+    def result(value, higher_is_better=False):
+        return {'value': value, 'unit': 's',
+                'higher_is_better': higher_is_better}
+
+    baseline = {'latency': result(1.0), 'throughput': result(100.0, True),
+                'errors': result(0), 'stable': result(1.0)}
+    results = {'latency': result(1.3), 'throughput': result(70.0, True),
+               'errors': result(2), 'stable': result(1.1),
+               'new': result(5.0)}
+    regressions = compare(results, baseline, threshold=0.2)
+    assert [name for name, *_ in regressions] == \
+        ['errors', 'latency', 'throughput']
+    assert regressions[1][3] == pytest.approx(0.3)
+
+
+# Test profiling flagged and sampled requests with their SQL summary
+@pytest.mark.parametrize('mode, extension', [('cprofile', '.pstats'),
+                                             ('sampler', '.collapsed')])
+def test_request_profiler(tmp_path, mode, extension):
+    profiled_app = Flask(__name__)
+    profiled_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(profiled_app)
+    profiler = RequestProfiler(str(tmp_path), mode, sample_rate=3,
+                               interval=0.001)
+    profiler.init_app(profiled_app, authorized=lambda: request.headers.get(
+        'X-Admin-Token') == 'secret')
+
+    @profiled_app.route('/users')
+    def users():
+        db.create_all()
+        time.sleep(0.01)
+        return jsonify(User.query.count())
+
+    client = profiled_app.test_client()
+    # The flag needs the token; without it only the sample rate applies
+    assert 'X-Profile-Id' not in client.get(
+        '/users', headers={'X-Profile': '1'}).headers
+    response = client.get('/users', headers={'X-Profile': '1',
+                                             'X-Admin-Token': 'secret'})
+    name = response.headers['X-Profile-Id']
+    assert (tmp_path / f"{name}{extension}").stat().st_size > 0
+    summary = json.loads((tmp_path / f"{name}.json").read_text())
+    assert summary['endpoint'] == 'users'
+    assert summary['sql']['count'] >= 1
+    assert any('count(*)' in entry['statement']
+               for entry in summary['sql']['statements'])
+
+    client.get('/users')
+    assert 'X-Profile-Id' in client.get('/users').headers  # 3rd unflagged
+    assert len(list(tmp_path.glob('*.json'))) == 2
+
+
+# Test that each page view loads the logged-in user only once
+def test_queries_per_route(test_client, logged_in_user, count_queries,
+                           monkeypatch):
+    monkeypatch.setattr(app_module, 'history_cache',
+                        app_module.FragmentCache(1024 * 1024))
+    expected = {'/': 1, '/input': 1, '/history': 3, '/api/v1/history': 2}
+    for route, queries in expected.items():
+        count_queries.clear()
+        response = test_client.get(route)
+        assert response.status_code == 200
+        assert len(count_queries) == queries, (route, count_queries)
+
+
+# Test 304s and cached tables for repeat history views
+def test_history_conditional_and_cached(test_client, logged_in_user,
+                                        count_queries, monkeypatch):
+    cache = app_module.FragmentCache(1024 * 1024)
+    monkeypatch.setattr(app_module, 'history_cache', cache)
+    first = test_client.get('/history')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert 'no-cache' in first.headers['Cache-Control']
+
+    # Only the user and the history version are read on repeat views
+    count_queries.clear()
+    response = test_client.get('/history', headers={
+        'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304 and response.data == b''
+    assert len(count_queries) == 2
+    count_queries.clear()
+    assert test_client.get('/history').data == first.data
+    assert len(count_queries) == 2
+    assert cache.stats()['hits'] == 1
+
+    # A new diagnosis changes the version, the ETag and the table
+    db.session.execute(insert(CancerDiagnosis), [diagnosis_row(7.5)])
+    db.session.commit()
+    response = test_client.get('/history', headers={
+        'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != first.headers['ETag']
+    assert b'<td>7.5</td>' in response.data
+    response = test_client.get('/history', headers={
+        'If-Modified-Since': response.headers['Last-Modified']})
+    assert response.status_code == 304
+
+    app_module.forget_history(1)
+    assert cache.stats()['entries'] == 0
+
+
+# Test that inserts keep the stats current and a rebuild agrees with them
+def test_diagnosis_stats(test_client, logged_in_user, count_queries,
+                         monkeypatch):
+    rows = np.random.default_rng(0).normal(10.0, 3.0,
+                                           (40, len(FEATURE_NAMES)))
+    for start in (0, 25):
+        response = test_client.post('/api/v1/predict', json={
+            'instances': rows[start:start + 25].tolist(), 'persist': True})
+        assert response.status_code == 200
+    response = test_client.post('/input', data={
+        'csrf_token': csrf_token(test_client, '/input'),
+        **dict(zip(FEATURE_NAMES, rows[0].tolist()))})
+    assert response.status_code == 200
+    stored = np.vstack([rows, rows[:1]])
+
+    count_queries.clear()
+    stats = test_client.get('/api/v1/stats').get_json()
+    assert len(count_queries) == 2  # the user and the stats rows
+    assert stats['all']['count'] == 41
+    assert sum(result['count'] for result in stats['results'].values()) == 41
+    mean_area = stats['all']['features']['mean_area']
+    column = stored[:, FEATURE_NAMES.index('mean_area')]
+    assert mean_area['mean'] == pytest.approx(column.mean())
+    assert mean_area['variance'] == pytest.approx(column.var(ddof=1))
+
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', 'secret')
+    # The only user's stats are the totals of all users
+    assert test_client.get('/admin/stats', headers={
+        'X-Admin-Token': 'secret'}).get_json() == stats
+    assert rebuild_stats(chunk_size=7) == 41
+    after = test_client.get('/api/v1/stats').get_json()
+    assert after['all']['features']['worst_area']['variance'] == \
+        pytest.approx(stats['all']['features']['worst_area']['variance'])
+
+
+# Test the cross-request user cache and its invalidation
+def test_user_cache(test_client, logged_in_user, count_queries,
+                    monkeypatch):
+    cache = app_module.UserCache(ttl=60)
+    app_module.invalidate_on_change(cache)
+    monkeypatch.setattr(app_module, 'user_cache', cache)
+
+    test_client.get('/')
+    count_queries.clear()
+    response = test_client.get('/')
+    assert b'Logout' in response.data
+    assert count_queries == []
+
+    # Updating the user drops the cached copy
+    user = db.session.get(app_module.User, 1)
+    user.fullname = 'Hamed D.'
+    db.session.commit()
+    assert cache.get(1) is None
+
+
+# Test migrating rows to packed feature storage and back
+def test_packed_feature_storage(test_client):
+    rows = [diagnosis_row(float(i)) for i in range(5)]
+    db.session.execute(insert(CancerDiagnosis), rows)
+    db.session.commit()
+
+    assert migrate_feature_storage('packed', chunk_size=2) == 5
+    db.session.expire_all()
+    diagnosis = db.session.get(CancerDiagnosis, 3)
+    assert diagnosis.mean_radius is None
+    assert diagnosis.feature_vector.tolist() == [2.0] * len(FEATURE_COLUMNS)
+    # The packed rows read back the same through history and export
+    page, _ = history_page(1)
+    assert page[0]['worst_symmetry'] == 4.0
+    exported = b''.join(export_stream(export_query())).decode()
+    assert exported.splitlines()[1].split(',')[3] == '0.0'
+
+    assert migrate_feature_storage('columns') == 5
+    db.session.expire_all()
+    diagnosis = db.session.get(CancerDiagnosis, 3)
+    assert diagnosis.features is None
+    assert diagnosis.mean_radius == 2.0
+
+
+def test_init_db_upgrades_feature_storage(test_client):
+    from sqlalchemy import inspect, text
+    from sqlalchemy.exc import IntegrityError
+
+    # The table as created before packed storage existed
+    CancerDiagnosis.__table__.drop(db.engine)
+    db.session.execute(text(
+        "CREATE TABLE cancer_diagnoses (id INTEGER PRIMARY KEY, "
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL, "
+        "diagnosis_result VARCHAR(20) NOT NULL, "
+        + ', '.join(f"{name} FLOAT NOT NULL" for name in FEATURE_COLUMNS)
+        + ")"))
+    db.session.commit()
+    app_module.init_db()
+    columns = [column['name'] for column in
+               inspect(db.engine).get_columns('cancer_diagnoses')]
+    assert 'features' in columns
+
+    db.session.execute(insert(CancerDiagnosis), [diagnosis_row(1.0)])
+    db.session.commit()
+
+    # New tables check that rows hold their features one way or the other
+    CancerDiagnosis.__table__.drop(db.engine)
+    app_module.init_db()
+    row = diagnosis_row(1.0)
+    row['mean_area'] = None
+    with pytest.raises(IntegrityError):
+        db.session.execute(insert(CancerDiagnosis), [row])
+    db.session.rollback()
+
+
 # Test error handling for 404
 def test_not_found(test_client):
     response = test_client.get('/nonexistent-page')
@@ -233,3 +1002,55 @@ def test_unauthorized_access(test_client):
     response = test_client.get('/logout')  # Attempt to log out without being logged in
     assert response.status_code == 403
     assert b'You do not have access to this page.' in response.data
+
+
+def call_asgi(path, method='GET', body=b'', cookie=None, query=b''):
+    import asyncio
+    from asgi import application
+
+    headers = [(b'cookie', cookie.encode())] if cookie else []
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query, 'headers': headers}
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # The client stays connected until the response is sent
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+
+def test_async_api(test_client, logged_in_user, monkeypatch):
+    import asgi
+
+    cookie = f"session={test_client.get_cookie('session').value}"
+    instances = [[float(index) for index in range(30)]] * 3
+    body = json.dumps({'instances': instances, 'persist': True}).encode()
+
+    assert call_asgi('/api/v1/predict', 'POST', body)[0] == 403
+    status, payload = call_asgi('/api/v1/predict', 'POST', body, cookie)
+    assert status == 200
+    assert payload == test_client.post(
+        '/api/v1/predict', json={'instances': instances}).get_json()
+    assert CancerDiagnosis.query.count() == 3
+
+    status, payload = call_asgi('/api/v1/history', cookie=cookie,
+                                query=b'limit=2')
+    assert status == 200
+    assert payload == test_client.get('/api/v1/history?limit=2').get_json()
+    assert len(payload['diagnoses']) == 2 and payload['next_cursor']
+
+    # Slow inference is cancelled at the deadline
+    monkeypatch.setattr(asgi, 'REQUEST_TIMEOUT_MS', 50)
+    monkeypatch.setattr(asgi, 'predict_batch',
+                        lambda rows: time.sleep(0.5))
+    status, payload = call_asgi('/api/v1/predict', 'POST', body, cookie)
+    assert status == 504
+    assert CancerDiagnosis.query.count() == 3
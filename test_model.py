@@ -0,0 +1,302 @@
+import json
+import pickle
+import threading
+import time
+import numpy as np
+import pytest
+from sklearn.datasets import load_breast_cancer
+from sklearn.ensemble import RandomForestClassifier
+from models.model import model_path, registry as serving_registry
+from models.batching import MicroBatcher
+from models.cache import PredictionCache, SQLiteCacheBackend
+from models.cascade import Cascade
+from models.compiled import CompiledForest
+from models.registry import ModelRegistry
+from schema import FEATURES, check_feature_order
+
+
+model = serving_registry.current.model
+
+
+# Rows from the dataset the model was trained on
+X = load_breast_cancer().data
+
+
+# Test that concurrent callers get their own row's prediction back
+def test_micro_batcher_matches_model():
+    batcher = MicroBatcher(model.predict, max_batch_size=16, max_wait=0.01)
+    results = {}
+
+    def worker(index):
+        results[index] = batcher.predict(X[index].tolist(), timeout=10)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(64)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    expected = model.predict(X[:64])
+    assert [int(results[i][0]) for i in range(64)] == expected.tolist()
+
+    stats = batcher.stats()
+    assert stats['requests'] == 64
+    assert stats['batches'] < 64
+    assert stats['max_batch_size'] <= 16
+
+
+# Test that a malformed row only fails its own caller
+def test_micro_batcher_isolates_bad_rows():
+    batcher = MicroBatcher(model.predict, max_batch_size=8, max_wait=0.05)
+    good = batcher.submit(X[0])
+    bad = batcher.submit([1.0, 2.0])
+    assert int(good.result(10)[0]) == int(model.predict(X[:1])[0])
+    assert isinstance(bad.exception(10), ValueError)
+    batcher.close()
+
+
+# Test that the compiled evaluator matches the forest exactly
+def test_compiled_forest_matches_model():
+    compiled = CompiledForest.from_model(model)
+    assert np.array_equal(compiled.predict(X), model.predict(X))
+    assert np.array_equal(compiled.predict_proba(X), model.predict_proba(X))
+    # Single rows go through the same path
+    for row in X[:20]:
+        assert compiled.predict(row)[0] == model.predict([row])[0]
+
+
+# Test LRU eviction, TTL expiry and model-version isolation of the cache
+def test_prediction_cache_eviction_and_versions(monkeypatch):
+    cache = PredictionCache(max_entries=2, ttl=60)
+    keys = [cache.key(X[i], 'v1') for i in range(3)]
+    for key in keys:
+        cache.set(key, 1)
+    assert cache.get(keys[0]) is None  # evicted as least recently used
+    assert cache.get(keys[2]) == 1
+    # The same row under another model version is a different entry
+    assert cache.get(cache.key(X[2], 'v2')) is None
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 120)
+    assert cache.get(keys[2]) is None  # expired
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['evictions'] == 1
+    assert stats['expirations'] == 1
+
+
+# Test that quantized keys match nearly identical rows
+def test_prediction_cache_quantized_keys():
+    cache = PredictionCache(decimals=3)
+    assert cache.key(X[0], 'v1') == cache.key(X[0] + 1e-6, 'v1')
+    assert cache.key(X[0], 'v1') != cache.key(X[1], 'v1')
+
+
+# Test that workers share hits through the file-backed store
+def test_prediction_cache_shared_backend(tmp_path):
+    path = str(tmp_path / 'predictions.sqlite')
+    first = PredictionCache(backend=SQLiteCacheBackend(path, ttl=60))
+    second = PredictionCache(backend=SQLiteCacheBackend(path, ttl=60))
+    key = first.key(X[0], 'v1')
+    first.set(key, 0)
+    assert second.get(key) == 0
+    assert second.stats()['shared_hits'] == 1
+
+
+# Test versioned loading, atomic swap, rollback and cross-worker publishing
+def test_model_registry_swap_and_rollback(tmp_path):
+    small = RandomForestClassifier(n_estimators=3, random_state=0)
+    small.fit(X, load_breast_cancer().target)
+    with open(tmp_path / 'v2.pkl', 'wb') as f:
+        pickle.dump(small, f)
+
+    registry = ModelRegistry(str(tmp_path), model_path)
+    swapped = []
+    registry.on_swap(swapped.append)
+    pinned = registry.current
+    assert registry.versions() == ['default', 'v2']
+
+    registry.reload('v2').result(timeout=30)
+    assert registry.current.name == 'v2'
+    assert registry.current.version != pinned.version
+    # A caller holding the old version keeps predicting with it
+    assert pinned.engine.predict(X[:1])[0] == model.predict(X[:1])[0]
+
+    # Rows queued for a batch are scored by the model their caller pinned
+    batcher = MicroBatcher(lambda rows, engine: engine.predict_proba(rows),
+                           max_batch_size=8, max_wait=0.05)
+    futures = [batcher.submit(X[0], loaded.engine)
+               for loaded in (pinned, registry.current)]
+    assert futures[0].result(10)[0].tolist() == \
+        model.predict_proba(X[:1])[0].tolist()
+    assert futures[1].result(10)[0].tolist() == \
+        small.predict_proba(X[:1])[0].tolist()
+    batcher.close()
+
+    registry.rollback()
+    assert registry.current is pinned
+    assert [loaded.name for loaded in swapped] == ['v2', 'default']
+
+    # Reloading a name whose artifact was replaced loads the new one
+    tiny = RandomForestClassifier(n_estimators=2, random_state=1)
+    tiny.fit(X, load_breast_cancer().target)
+    with open(tmp_path / 'v2.pkl', 'wb') as f:
+        pickle.dump(tiny, f)
+    assert registry.reload('v2').result(timeout=30).model.n_estimators == 2
+    registry.rollback()
+
+    # Another worker follows the published pointer
+    registry.publish('v2')
+    worker = ModelRegistry(str(tmp_path), model_path)
+    assert worker.current.name == 'v2'
+    registry.publish('default')
+    worker.poll()
+    assert worker.current.name == 'default'
+
+
+# Test the memory-mapped export round trip and serving it as a version
+def test_compiled_forest_export_is_mapped(tmp_path):
+    CompiledForest.from_model(model).save(str(tmp_path / 'mapped'))
+    mapped = CompiledForest.load(str(tmp_path / 'mapped'))
+    assert isinstance(mapped.threshold, np.memmap)
+    assert not mapped.threshold.flags.writeable
+    assert np.array_equal(mapped.predict(X), model.predict(X))
+
+    registry = ModelRegistry(str(tmp_path), model_path)
+    assert 'mapped' in registry.versions()
+    assert registry.activate('mapped').engine.predict(X[:1])[0] == \
+        model.predict(X[:1])[0]
+
+
+# Test that the feature schema is the order the model was trained in
+def test_feature_schema_matches_training_order(tmp_path):
+    titles = tuple(load_breast_cancer().feature_names)
+    assert tuple(feature.title for feature in FEATURES) == titles
+    check_feature_order(model)
+
+    # A model fitted on fewer inputs is refused before it can be served
+    narrow = RandomForestClassifier(n_estimators=2, random_state=0)
+    narrow.fit(X[:, :10], load_breast_cancer().target)
+    with open(tmp_path / 'narrow.pkl', 'wb') as f:
+        pickle.dump(narrow, f)
+    registry = ModelRegistry(str(tmp_path), model_path,
+                             validate=check_feature_order)
+    with pytest.raises(ValueError):
+        registry.activate('narrow')
+    assert registry.current.name == 'default'
+
+
+# Test that the training search is cached and selection honours the budget
+def test_training_search_is_incremental(tmp_path):
+    from models.train_model import measure_latency, run_search, select
+
+    grid = {'n_estimators': [2, 4], 'max_depth': [2], 'max_features': ['sqrt']}
+    y = load_breast_cancer().target
+    results, computed = run_search(X, y, grid, 2, str(tmp_path), workers=2)
+    assert computed == 6  # two folds and one final fit per candidate
+    assert run_search(X, y, grid, 2, str(tmp_path), workers=2)[1] == 0
+    assert [len(scores) for _, scores, _ in results] == [2, 2]
+
+    report = [{'cv_accuracy': 0.97, 'single_ms': 9.0, 'batch_ms': 1.0,
+               'size_bytes': 1000},
+              {'cv_accuracy': 0.95, 'single_ms': 1.0, 'batch_ms': 1.0,
+               'size_bytes': 1000}]
+    budget = {'max_single_ms': 5.0, 'max_batch_ms': 5.0, 'max_size_mb': 1.0}
+    assert select(report, budget) is report[1]
+    assert report[0]['over_budget'] == ['single-row latency']
+    assert select(report, dict(budget, max_size_mb=0.0001)) is None
+
+    # More latency repeats than holdout rows cycle through the rows
+    single_ms, batch_ms = measure_latency(model, X[:5], repeats=12)
+    assert single_ms > 0 and batch_ms > 0
+
+
+# Test the fast tier and that the cascade escalates only uncertain rows
+def test_fast_tier_cascade(monkeypatch):
+    from models import model as model_module
+    from models.fast_tier import compact_forest, select_trees
+
+    fast = compact_forest(model, select_trees(model, X[:300], 5))
+    assert fast.n_estimators == 5 and len(model.estimators_) == 100
+
+    # Escalating everything reproduces the full forest exactly
+    everything = Cascade(fast, low=0.0, high=1.0)
+    assert np.array_equal(everything.predict(X, model), model.predict(X))
+    assert everything.stats()['trees_per_row'] == 105
+
+    cascade = Cascade(fast, low=0.2, high=0.8)
+    monkeypatch.setattr(model_module, 'cascade', cascade)
+    labels, probabilities = model_module.predict_batch(X)
+    assert np.mean(labels == model.predict(X)) > 0.98
+    stats = model_module.model_info()['cascade']
+    assert stats['rows'] == len(X)
+    assert 0 < stats['escalated'] < len(X) / 2
+    assert stats['trees_per_row'] < 60
+
+
+# Test that sketches merge across workers and the drift monitor reports
+# the drift of each checked window
+def test_drift_monitor(tmp_path):
+    from models.drift import (DriftMonitor, FeatureSketch, build_profile,
+                              compare, merge)
+
+    profile = build_profile(X[:400], [feature.name for feature in FEATURES])
+    # Sketches of two halves merge into the sketch of the whole
+    whole, first, second = (FeatureSketch(profile['edges'])
+                            for _ in range(3))
+    whole.update(X)
+    first.update(X[:200])
+    for row in X[200:]:
+        second.update(row)
+    merged, expected = merge(first.snapshot(), second.snapshot()), \
+        whole.snapshot()
+    assert merged['rows'] == 569 and merged['counts'] == expected['counts']
+    assert np.allclose(merged['sums'], expected['sums'])
+    assert compare(whole.snapshot(), profile)['drifted'] == []
+
+    monitor = DriftMonitor(profile, directory=str(tmp_path), interval=3600)
+    monitor.observe(X[:100])
+    # A sketch left behind by a worker that exited
+    (tmp_path / 'drift-99999999.json').write_text(json.dumps(
+        first.snapshot()))
+    assert monitor.collect()['rows'] == 300
+    assert not (tmp_path / 'drift-99999999.json').exists()
+    assert monitor.check(force=True)['rows'] == 300
+    assert monitor.check() is None
+
+    # Only the rows since the last check are in its window
+    monitor.observe(X[:100] * 1.5)
+    window = monitor.check(force=True)
+    assert window['rows'] == 100
+    assert 'mean_area' in window['drifted']
+    assert monitor.report()['cumulative']['rows'] == 400
+
+    # The tick thread and /admin requests write the same files concurrently
+    errors = []
+
+    def write():
+        try:
+            for _ in range(50):
+                monitor.write_snapshot()
+                monitor.report()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not list(tmp_path.glob('*.tmp'))
+
+    # Rows the model refuses are not sketched
+    from models import model as model_module
+    observed = model_module.drift_monitor.sketch.rows
+    with pytest.raises(ValueError), np.errstate(over='ignore'):
+        model_module.predict_batch(np.full((2, 30), 1e39))
+    assert model_module.drift_monitor.sketch.rows == observed
+    model_module.predict_batch(X[:2])
+    assert model_module.drift_monitor.sketch.rows == observed + 2
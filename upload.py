@@ -0,0 +1,191 @@
+import csv
+import io
+from datetime import datetime, timezone
+import numpy as np
+from sqlalchemy import insert
+from database import db, CancerDiagnosis, FEATURE_COLUMNS, pack_features
+from models.model import predict_batch
+from schema import MAX_VALUE
+from stats import record_diagnoses
+
+
+# Rows parsed, scored and inserted at a time
+CHUNK_SIZE = 5000
+# Bad rows listed in a report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class UploadError(ValueError):
+    """
+    Raised when an uploaded file cannot be read at all
+    """
+
+
+def normalize_column(name):
+    # Accept "mean radius" (as in the original dataset) for mean_radius
+    return name.strip().lower().replace(' ', '_')
+
+
+def column_positions(header):
+    """
+    Position of every feature column in the CSV header, in model order
+    """
+    names = [normalize_column(name) for name in header]
+    missing = [name for name in FEATURE_COLUMNS if name not in names]
+    unknown = [name for name in names if name not in FEATURE_COLUMNS]
+    if missing or unknown:
+        problems = []
+        if missing:
+            problems.append(f"missing columns: {', '.join(missing)}")
+        if unknown:
+            problems.append(f"unknown columns: {', '.join(unknown)}")
+        raise UploadError(f"Invalid header ({'; '.join(problems)})")
+    if len(set(names)) != len(names):
+        raise UploadError("Invalid header (duplicate columns)")
+    return [names.index(name) for name in FEATURE_COLUMNS]
+
+
+def _to_matrix(lines, values, errors):
+    lines = np.array(lines, dtype=int)
+    if not values:
+        return lines, np.empty((0, len(FEATURE_COLUMNS)))
+    try:
+        # Fast path: numpy parses the whole chunk of strings at once
+        matrix = np.array(values, dtype=np.float64)
+    except ValueError:
+        matrix = np.empty((len(values), len(FEATURE_COLUMNS)))
+        valid = np.ones(len(values), dtype=bool)
+        for index, row in enumerate(values):
+            for position, value in enumerate(row):
+                try:
+                    matrix[index, position] = float(value)
+                except ValueError:
+                    errors.append((lines[index],
+                                   f"{FEATURE_COLUMNS[position]}: "
+                                   f"{value!r} is not a number"))
+                    valid[index] = False
+                    break
+        matrix, lines = matrix[valid], lines[valid]
+
+    # NaN fails the comparison too
+    finite = (np.abs(matrix) <= MAX_VALUE).all(axis=1)
+    for line in lines[~finite]:
+        errors.append((line, "values must be finite numbers within the "
+                       "float32 range"))
+    return lines[finite], matrix[finite]
+
+
+def parse_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yield ``(line_numbers, features, errors)`` for chunks of a CSV file
+
+    ``features`` holds the rows that parsed, in model column order;
+    ``errors`` lists ``(line_number, message)`` for the ones that did not.
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        raise UploadError("The file is empty")
+    positions = column_positions(header)
+
+    lines, values, errors = [], [], []
+    for row in reader:
+        if not any(field.strip() for field in row):
+            continue
+        if len(row) != len(header):
+            errors.append((reader.line_num, f"expected {len(header)} "
+                           f"values, found {len(row)}"))
+        else:
+            lines.append(reader.line_num)
+            values.append([row[position] for position in positions])
+        if len(values) >= chunk_size:
+            yield (*_to_matrix(lines, values, errors), errors)
+            lines, values, errors = [], [], []
+    if values or errors:
+        yield (*_to_matrix(lines, values, errors), errors)
+
+
+def _insert_columns(packed):
+    columns = ['user_id', 'diagnosis_result', 'created_at', 'updated_at']
+    return columns + (['features'] if packed else list(FEATURE_COLUMNS))
+
+
+def _feature_values(features, packed):
+    if packed:
+        return [[pack_features(vector)] for vector in features]
+    return features.tolist()
+
+
+def _copy_rows(features, results, user_id, packed, now):
+    # COPY streams the chunk in one round trip, much faster than INSERTs
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    timestamp = now.isoformat()
+    for values, result in zip(_feature_values(features, packed), results):
+        if packed:
+            values = [f"\\x{values[0].hex()}"]
+        writer.writerow([user_id, result, timestamp, timestamp, *values])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {CancerDiagnosis.__tablename__} "
+        f"({', '.join(_insert_columns(packed))}) "
+        f"FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _execute_many(features, results, user_id, packed, now):
+    # Straight to the driver's executemany: SQLAlchemy would otherwise
+    # process the parameters of every row one by one
+    table = CancerDiagnosis.__table__
+    dialect = db.engine.dialect
+    columns = _insert_columns(packed)
+    compiled = insert(table).compile(dialect=dialect, column_keys=columns)
+    process = table.c.created_at.type.dialect_impl(dialect)\
+        .bind_processor(dialect)
+    timestamp = process(now) if process else now
+    rows = [dict(zip(columns, (user_id, result, timestamp, timestamp,
+                               *values)))
+            for values, result in zip(_feature_values(features, packed),
+                                      results)]
+    if compiled.positional:
+        rows = [tuple(row[name] for name in compiled.positiontup)
+                for row in rows]
+    db.session.connection().exec_driver_sql(compiled.string, rows)
+
+
+def bulk_insert(features, results, user_id, packed=False):
+    """
+    Insert scored rows with COPY on PostgreSQL, executemany elsewhere
+    """
+    now = datetime.now(timezone.utc)
+    if db.engine.dialect.name == 'postgresql':
+        _copy_rows(features, results, user_id, packed, now)
+    else:
+        _execute_many(features, results, user_id, packed, now)
+    record_diagnoses(np.full(len(features), user_id), results, features)
+    db.session.commit()
+
+
+def ingest_csv(stream, user_id, chunk_size=CHUNK_SIZE, packed=False):
+    """
+    Score and save every valid row of a CSV of diagnoses for ``user_id``
+
+    Memory use is bounded by ``chunk_size`` rows: each chunk is parsed,
+    scored with one model call and committed before the next is read.
+    Returns a report with counts and the first bad rows by line number.
+    """
+    report = {'inserted': 0, 'cancerous': 0, 'rejected': 0, 'errors': []}
+    for lines, features, errors in parse_chunks(stream, chunk_size):
+        report['rejected'] += len(errors)
+        room = max(MAX_REPORTED_ERRORS - len(report['errors']), 0)
+        report['errors'] += [{'line': int(line), 'error': message}
+                             for line, message in sorted(errors)[:room]]
+        if not len(features):
+            continue
+        labels, _ = predict_batch(features)
+        results = np.where(labels == 1, "Cancerous", "Non-Cancerous")
+        bulk_insert(features, results.tolist(), user_id, packed)
+        report['inserted'] += len(features)
+        report['cancerous'] += int((labels == 1).sum())
+    report['errors'].sort(key=lambda error: error['line'])
+    return report
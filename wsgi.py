@@ -0,0 +1,12 @@
+import gc
+from app import app
+
+
+# Imported once in the gunicorn master (preload_app), so the app and the
+# model are created before forking and shared copy-on-write by the workers.
+# Freezing moves everything allocated so far out of the garbage collector's
+# reach, so collections in the workers do not touch (and copy) those pages.
+gc.collect()
+gc.freeze()
+
+__all__ = ['app']